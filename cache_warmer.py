@@ -0,0 +1,251 @@
+#!/usr/bin/env python3.11
+"""
+Cache Warmer for Thumbor
+Parses nginx access logs (the `main` log_format), picks the most requested
+thumbor URLs and replays them against nginx or directly against the thumbor
+upstreams with bounded concurrency and rate, so thumbor_cache and the file
+storage are warm before traffic moves to a new instance.
+
+Usage:
+    cache_warmer.py /var/log/nginx/access.log --top 5000 --concurrency 16 --rate 50
+    zcat access.log.*.gz | cache_warmer.py - --upstreams --output timings.csv
+"""
+
+import os
+import re
+import sys
+import csv
+import gzip
+import json
+import time
+import asyncio
+import argparse
+import itertools
+from collections import Counter
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+
+# log_format main from nginx-cache.conf.template
+LOG_PATTERN = re.compile(
+    r'(?P<remote_addr>\S+) - (?P<remote_user>\S+) \[(?P<time_local>[^\]]+)\] '
+    r'"(?P<method>[A-Z]+) (?P<uri>\S+) [^"]*" (?P<status>\d{3}) (?P<bytes>\d+) '
+    r'"[^"]*" "[^"]*" "[^"]*" '
+    r'rt=(?P<rt>[\d.]+) uct="[^"]*" uht="[^"]*" urt="(?P<urt>[^"]*)"'
+)
+# Non-thumbor locations served by the same nginx
+SKIP_PREFIXES = ('/healthcheck', '/nginx-status', '/redis-admin', '/metrics', '/404.html', '/50x.html')
+REPLAY_STATUSES = {'200', '304'}
+
+# Thumbor URL option segments, in the order they may appear before the image
+OPTION_PATTERN = re.compile(
+    r'^(trim(:[^/]+)?|meta|\d+x\d+:\d+x\d+|(adaptive-)?(full-)?fit-in|-?\d*x-?\d*'
+    r'|left|right|center|top|bottom|middle|smart|filters:.*)$'
+)
+SIGNATURE_PATTERN = re.compile(r'^(unsafe|[A-Za-z0-9_=-]{27,28})$')
+
+NGINX_TARGET = f"http://localhost:{os.environ.get('NGINX_LISTEN_PORT', 80)}"
+THUMBOR_NUM_PROCESSES = int(os.environ.get('THUMBOR_NUM_PROCESSES', 4))
+THUMBOR_BASE_PORT = 8001
+
+
+def open_log(path):
+    if path == '-':
+        return sys.stdin
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', errors='replace')
+    return open(path, errors='replace')
+
+
+def parse_logs(paths):
+    """Count replayable thumbor URIs; returns (uri counts, original request times, lines, skipped)"""
+    counts = Counter()
+    request_times = {}
+    lines = skipped = 0
+    for path in paths:
+        with open_log(path) as log:
+            for line in log:
+                lines += 1
+                match = LOG_PATTERN.match(line)
+                if not match:
+                    skipped += 1
+                    continue
+                uri = match.group('uri')
+                if (match.group('method') != 'GET' or match.group('status') not in REPLAY_STATUSES
+                        or uri.startswith(SKIP_PREFIXES)):
+                    continue
+                counts[uri] += 1
+                request_times.setdefault(uri, []).append(float(match.group('rt')))
+    return counts, request_times, lines, skipped
+
+
+def url_options(uri):
+    """The thumbor options of a URI, e.g. /abc=/300x200/smart/filters:quality(80)/img.jpg -> 300x200/smart/filters:quality(80)"""
+    segments = uri.split('?', 1)[0].lstrip('/').split('/')
+    if segments and SIGNATURE_PATTERN.match(segments[0]):
+        segments = segments[1:]
+    options = list(itertools.takewhile(OPTION_PATTERN.match, segments[:-1]))
+    return '/'.join(options) or '(original)'
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(int(len(values) * pct / 100), len(values) - 1)]
+
+
+class Replayer:
+    """Replays URIs round-robin over targets with a concurrency and rate limit"""
+
+    def __init__(self, targets, concurrency, rate, accept, timeout):
+        self.targets = itertools.cycle(targets)
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = 0.0
+        self.concurrency = concurrency
+        self.accept = accept
+        self.timeout = timeout
+        self.client = None
+        self.results = []
+
+    async def pace(self):
+        """Wait for the next request slot allowed by the rate limit"""
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    async def fetch(self, uri, accept):
+        async with self.semaphore:
+            await self.pace()
+            target = next(self.targets)
+            request = HTTPRequest(
+                target + uri,
+                headers={'Accept': accept} if accept else None,
+                request_timeout=self.timeout,
+                follow_redirects=False,
+            )
+            result = {'uri': uri, 'target': target, 'accept': accept, 'status': None,
+                      'cache_status': None, 'seconds': None, 'bytes': 0, 'error': None}
+            started = time.monotonic()
+            try:
+                response = await self.client.fetch(request, raise_error=False)
+                result['status'] = response.code
+                result['cache_status'] = response.headers.get('X-Cache-Status') if response.headers else None
+                result['bytes'] = len(response.body or b'')
+                if response.code == 599 or response.code >= 400:
+                    result['error'] = str(response.error) if response.error else f'HTTP {response.code}'
+            except (HTTPClientError, OSError) as e:
+                result['error'] = str(e)
+            result['seconds'] = round(time.monotonic() - started, 4)
+            self.results.append(result)
+
+    async def run(self, uris):
+        # The client is bound to the running event loop, so it is created here
+        self.client = AsyncHTTPClient(force_instance=True, max_clients=self.concurrency)
+        await asyncio.gather(*(self.fetch(uri, accept) for uri in uris for accept in self.accept))
+        self.client.close()
+        return self.results
+
+
+def print_report(results, counts, request_times, top_options, elapsed):
+    times = [r['seconds'] for r in results if r['error'] is None]
+    errors = Counter(r['error'] for r in results if r['error'])
+    cache = Counter(r['cache_status'] or 'none' for r in results)
+
+    print("")
+    print("Cache warmer report")
+    print("=" * 60)
+    print(f"Requests:       {len(results)} in {elapsed:.1f}s ({len(results) / max(elapsed, 0.001):.1f} req/s)")
+    print(f"Succeeded:      {len(times)}")
+    print(f"Failed:         {sum(errors.values())}")
+    if times:
+        print(f"Latency:        p50 {percentile(times, 50):.3f}s  p95 {percentile(times, 95):.3f}s  "
+              f"p99 {percentile(times, 99):.3f}s  max {max(times):.3f}s")
+
+    print("\nX-Cache-Status:")
+    for status, count in cache.most_common():
+        print(f"  {status:<12} {count}")
+
+    print("\nTop filter combinations in the log:")
+    for options, count in top_options:
+        print(f"  {count:>8}  {options}")
+
+    print("\nSlowest URLs:")
+    for r in sorted((r for r in results if r['seconds'] is not None), key=lambda r: -r['seconds'])[:10]:
+        logged = percentile(request_times.get(r['uri'], []), 50)
+        print(f"  {r['seconds']:>7.3f}s  (log p50 {logged:.3f}s, {counts[r['uri']]} hits)  {r['uri']}")
+
+    if errors:
+        print("\nErrors:")
+        for error, count in errors.most_common(10):
+            print(f"  {count:>6}  {error}")
+
+
+def write_results(path, results):
+    if path.endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+        return
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(results[0].keys()) if results else ['uri'])
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay the most requested thumbor URLs from nginx access logs')
+    parser.add_argument('logs', nargs='+', help='nginx access logs (.gz supported, - for stdin)')
+    parser.add_argument('--top', type=int, default=1000, help='number of most requested URLs to replay')
+    parser.add_argument('--concurrency', type=int, default=8, help='maximum requests in flight')
+    parser.add_argument('--rate', type=float, default=0, help='maximum requests per second (0 = unlimited)')
+    parser.add_argument('--target', action='append', help=f'base URL to replay against (default: {NGINX_TARGET})')
+    parser.add_argument('--upstreams', action='store_true',
+                        help=f'replay directly against the {THUMBOR_NUM_PROCESSES} thumbor processes '
+                             f'on ports {THUMBOR_BASE_PORT}+, bypassing nginx')
+    parser.add_argument('--accept', action='append',
+                        help='Accept header to send; repeat to warm several variants (default: image/webp,*/*)')
+    parser.add_argument('--timeout', type=float, default=60, help='request timeout in seconds')
+    parser.add_argument('--output', help='write per-URL timings to a .csv or .json file')
+    parser.add_argument('--dry-run', action='store_true', help='only print the URLs that would be replayed')
+    args = parser.parse_args()
+    if args.top < 1 or args.concurrency < 1 or args.rate < 0:
+        parser.error('--top and --concurrency must be positive and --rate non-negative')
+
+    if args.upstreams:
+        targets = [f'http://localhost:{THUMBOR_BASE_PORT + i}' for i in range(THUMBOR_NUM_PROCESSES)]
+    else:
+        targets = [t.rstrip('/') for t in (args.target or [NGINX_TARGET])]
+    # AUTO_WEBP makes thumbor vary the response on Accept
+    accept = args.accept or ['image/webp,*/*']
+
+    counts, request_times, lines, skipped = parse_logs(args.logs)
+    top = [uri for uri, _ in counts.most_common(args.top)]
+    options = Counter()
+    for uri, count in counts.items():
+        options[url_options(uri)] += count
+    print(f"Parsed {lines} log lines ({skipped} unparseable), {len(counts)} distinct thumbor URLs, "
+          f"replaying {len(top)} x {len(accept)} variants against {', '.join(targets)}")
+
+    if args.dry_run:
+        for uri in top:
+            print(f"{counts[uri]:>8}  {uri}")
+        return
+
+    started = time.time()
+    replayer = Replayer(targets, args.concurrency, args.rate, accept, args.timeout)
+    try:
+        results = asyncio.run(replayer.run(top))
+    except KeyboardInterrupt:
+        print("\nInterrupted", file=sys.stderr)
+        results = replayer.results
+    print_report(results, counts, request_times, options.most_common(10), time.time() - started)
+    if args.output:
+        write_results(args.output, results)
+        print(f"\nPer-URL timings written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
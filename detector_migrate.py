@@ -0,0 +1,126 @@
+#!/usr/bin/env python3.11
+"""
+Detector Result Migration
+Rewrites the JSON detector results RemoteCV and tc_redis stored under
+thumbor-detector-<url> into redis_detector_storage's packed bucket records,
+deleting each JSON key once its record is written. thumbor also rewrites a
+legacy result the first time it reads it; this moves the ones nobody has
+asked for yet, so their memory is reclaimed up front.
+
+Usage:
+    detector_migrate.py --dry-run
+    detector_migrate.py --batch-size 1000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import redis
+
+from thumbor_azure.storages.redis_detector_storage import LEGACY_KEY, DetectorLayout
+
+REDIS_HOST = os.environ.get('REDIS_SERVER_HOST', 'localhost')
+REDIS_PORT = int(os.environ.get('REDIS_SERVER_PORT', 6379))
+REDIS_DB = int(os.environ.get('REDIS_SERVER_DB', 0))
+
+BATCH_SIZE = int(os.environ.get('DETECTOR_MIGRATE_BATCH_SIZE', 500))
+LEGACY_PREFIX = LEGACY_KEY % {'key': ''}
+
+
+class Migration:
+    """Packs batches of legacy JSON detector results"""
+
+    def __init__(self, r, layout, dry_run=False, keep=False):
+        self.r = r
+        self.layout = layout
+        self.dry_run = dry_run
+        self.keep = keep
+        self.stats = {
+            'keys': 0, 'migrated': 0, 'bucketed': 0, 'unreadable': 0, 'vanished': 0,
+            'json_bytes': 0, 'packed_bytes': 0,
+        }
+
+    def process(self, keys):
+        pipe = self.r.pipeline(transaction=False)
+        for key in keys:
+            pipe.get(key)
+        values = pipe.execute()
+
+        pipe = self.r.pipeline(transaction=False)
+        for key, value in zip(keys, values):
+            self.stats['keys'] += 1
+            if value is None:
+                # Expired, or read and rewritten by thumbor since the scan
+                self.stats['vanished'] += 1
+                continue
+            try:
+                points = json.loads(value)
+            except ValueError:
+                self.stats['unreadable'] += 1
+                continue
+            url = key[len(LEGACY_PREFIX):].decode('utf-8')
+            size = self.layout.queue_put(pipe, url, points)
+            if self.keep:
+                # queue_put deletes the JSON key last; put it back
+                pipe.set(key, value)
+            self.stats['migrated'] += 1
+            self.stats['bucketed'] += size <= self.layout.max_bucket_value
+            self.stats['json_bytes'] += len(value)
+            self.stats['packed_bytes'] += size
+        if not self.dry_run:
+            pipe.execute()
+
+
+def used_memory(r):
+    return r.info('memory')['used_memory']
+
+
+def print_report(stats, before, after, elapsed, dry_run):
+    migrated = stats['migrated']
+    print("")
+    print("Detector migration report" + (" (dry run)" if dry_run else ""))
+    print("=" * 40)
+    print(f"Legacy keys scanned:  {stats['keys']}")
+    print(f"Migrated:             {migrated} ({stats['bucketed']} into buckets, "
+          f"{migrated - stats['bucketed']} as keys of their own)")
+    print(f"Unreadable:           {stats['unreadable']}")
+    print(f"Vanished:             {stats['vanished']}")
+    if migrated:
+        print(f"JSON bytes:           {stats['json_bytes']} ({stats['json_bytes'] / migrated:.0f} per result)")
+        print(f"Packed bytes:         {stats['packed_bytes']} ({stats['packed_bytes'] / migrated:.0f} per result)")
+    if not dry_run:
+        print(f"Redis used_memory:    {before / 1048576:.1f}MB -> {after / 1048576:.1f}MB")
+    print(f"Elapsed:              {elapsed:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pack legacy JSON detector results into redis_detector_storage buckets')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='keys read and rewritten per pipelined batch')
+    parser.add_argument('--dry-run', action='store_true', help='only report what would be migrated')
+    parser.add_argument('--keep', action='store_true', help='keep the JSON keys after writing the packed records')
+    args = parser.parse_args()
+    if args.batch_size < 1:
+        parser.error('--batch-size must be positive')
+
+    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB)
+    migration = Migration(r, DetectorLayout.from_env(), args.dry_run, args.keep)
+    before = used_memory(r)
+    started = time.time()
+    try:
+        batch = []
+        for key in r.scan_iter(match=f'{LEGACY_PREFIX}*', count=args.batch_size):
+            batch.append(key)
+            if len(batch) == args.batch_size:
+                migration.process(batch)
+                batch = []
+        if batch:
+            migration.process(batch)
+    except KeyboardInterrupt:
+        print("\nInterrupted", file=sys.stderr)
+    print_report(migration.stats, before, used_memory(r), time.time() - started, args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3.11
+"""
+Detector Warmup for Thumbor Smart Cropping
+Enqueues RemoteCV detection for image URLs that have no detector results in
+Redis yet, so the first smart request after a deploy or an eviction storm
+does not pay the detection latency.
+
+URLs are read one per line from files or stdin, in the form thumbor sees them
+after /smart/ (e.g. media.example.com/path/image.png).
+
+Usage:
+    detector_warmup.py urls.txt
+    cat urls.txt | detector_warmup.py --max-depth 500 --batch-size 200
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import fileinput
+import redis
+from remotecv.unique_queue import UniqueQueue
+
+from thumbor_azure.storages.redis_detector_storage import DetectorLayout
+
+REDIS_HOST = os.environ.get('REDIS_SERVER_HOST', 'localhost')
+REDIS_PORT = int(os.environ.get('REDIS_SERVER_PORT', 6379))
+REDIS_DB = int(os.environ.get('REDIS_SERVER_DB', 0))
+
+DETECTOR_QUEUE_NAME = os.environ.get('REMOTECV_DETECTOR_QUEUE_NAME', 'Detect')
+DETECTOR_TASK = 'remotecv.pyres_tasks.DetectTask'
+# Same detection type as thumbor's queued_complete_detector
+DETECTION_TYPE = 'all'
+
+# Detector results are looked up where redis_detector_storage keeps them: a
+# bucket field, a key of their own, or the thumbor-detector-<url> JSON key
+# RemoteCV and tc_redis wrote before it
+DETECTOR_LAYOUT = DetectorLayout.from_env()
+BATCH_SIZE = int(os.environ.get('DETECTOR_WARMUP_BATCH_SIZE', 500))
+MAX_DEPTH = int(os.environ.get('DETECTOR_WARMUP_MAX_DEPTH', 1000))
+
+
+def read_urls(paths):
+    """Yield stripped, non-empty, non-comment lines from files or stdin"""
+    for line in fileinput.input(paths or ['-']):
+        url = line.strip()
+        if url and not url.startswith('#'):
+            yield url
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class Warmup:
+    """Checks detector results and enqueues detection for the misses"""
+
+    def __init__(self, r, queue, max_depth, dry_run=False):
+        self.r = r
+        self.queue = queue
+        self.queue_key = f'resque:queue:{queue}'
+        self.max_depth = max_depth
+        self.dry_run = dry_run
+        self.stats = {
+            'urls': 0, 'duplicates': 0, 'hits': 0, 'enqueued': 0,
+            'already_queued': 0, 'throttled_seconds': 0.0,
+        }
+        self.seen = set()
+
+    def unique_key(self, url):
+        # Same dedup key as thumbor's UniqueQueue, so thumbor and RemoteCV agree
+        # _escape_for_key does not use its instance; a UniqueQueue would connect
+        return f'resque:unique:queue:{self.queue}:{UniqueQueue._escape_for_key(None, url)}'
+
+    def job(self, url):
+        """The payload UniqueQueue.enqueue_unique_from_string pushes for thumbor"""
+        # DetectTask.perform(detection_type, image_path, key): the key is
+        # appended to the arguments, and RemoteCV stores the result under it
+        return {
+            'class': DETECTOR_TASK,
+            'queue': self.queue,
+            'args': [DETECTION_TYPE, url, url],
+            'key': url,
+        }
+
+    def missing(self, urls):
+        """URLs of the batch that have no detector result stored"""
+        pipe = self.r.pipeline(transaction=False)
+        for url in urls:
+            DETECTOR_LAYOUT.queue_exists(pipe, url)
+        found = pipe.execute()
+        return [url for i, url in enumerate(urls) if not any(found[i * 2:(i + 1) * 2])]
+
+    def wait_for_room(self, needed):
+        """Block until the queue has room for `needed` jobs below max_depth"""
+        started = time.time()
+        while True:
+            depth = self.r.llen(self.queue_key)
+            if depth + needed <= self.max_depth:
+                break
+            time.sleep(0.5)
+        self.stats['throttled_seconds'] += time.time() - started
+
+    def enqueue(self, urls):
+        """Push DetectTask jobs, skipping URLs already queued by thumbor"""
+        pipe = self.r.pipeline(transaction=False)
+        for url in urls:
+            pipe.set(self.unique_key(url), '1', nx=True)
+        claimed = pipe.execute()
+
+        pipe = self.r.pipeline(transaction=False)
+        pipe.sadd('resque:queues', self.queue)
+        count = 0
+        for url, ok in zip(urls, claimed):
+            if not ok:
+                self.stats['already_queued'] += 1
+                continue
+            pipe.rpush(self.queue_key, json.dumps(self.job(url)))
+            count += 1
+        pipe.execute()
+        self.stats['enqueued'] += count
+
+    def process(self, urls):
+        fresh = []
+        for url in urls:
+            self.stats['urls'] += 1
+            if url in self.seen:
+                self.stats['duplicates'] += 1
+            else:
+                self.seen.add(url)
+                fresh.append(url)
+        if not fresh:
+            return
+        misses = self.missing(fresh)
+        self.stats['hits'] += len(fresh) - len(misses)
+        if self.dry_run:
+            self.stats['enqueued'] += len(misses)
+            return
+        for chunk in batches(misses, self.max_depth):
+            self.wait_for_room(len(chunk))
+            self.enqueue(chunk)
+
+
+def print_report(stats, elapsed, dry_run):
+    checked = stats['urls'] - stats['duplicates']
+    hit_rate = stats['hits'] / checked * 100 if checked else 0
+    print("")
+    print("Detector warmup report" + (" (dry run)" if dry_run else ""))
+    print("=" * 40)
+    print(f"URLs read:            {stats['urls']}")
+    print(f"Duplicates skipped:   {stats['duplicates']}")
+    print(f"Already detected:     {stats['hits']} ({hit_rate:.1f}% hit rate)")
+    print(f"Enqueued:             {stats['enqueued']}")
+    print(f"Already in queue:     {stats['already_queued']}")
+    print(f"Throttled:            {stats['throttled_seconds']:.1f}s")
+    print(f"Elapsed:              {elapsed:.1f}s")
+    if elapsed > 0:
+        print(f"Throughput:           {checked / elapsed:.0f} URLs/s checked, "
+              f"{stats['enqueued'] / elapsed:.0f} jobs/s enqueued")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Enqueue RemoteCV detection for URLs without detector results')
+    parser.add_argument('files', nargs='*', help='files with one image URL per line (default: stdin)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='URLs checked per pipelined batch')
+    parser.add_argument('--max-depth', type=int, default=MAX_DEPTH, help='pause while the queue is longer than this')
+    parser.add_argument('--queue', default=DETECTOR_QUEUE_NAME, help='RemoteCV queue name')
+    parser.add_argument('--dry-run', action='store_true', help='only report hits and misses')
+    args = parser.parse_args()
+    if args.batch_size < 1 or args.max_depth < 1:
+        parser.error('--batch-size and --max-depth must be positive')
+
+    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True)
+    warmup = Warmup(r, args.queue, args.max_depth, args.dry_run)
+    started = time.time()
+    try:
+        for batch in batches(read_urls(args.files), args.batch_size):
+            warmup.process(batch)
+    except KeyboardInterrupt:
+        print("\nInterrupted", file=sys.stderr)
+    print_report(warmup.stats, time.time() - started, args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
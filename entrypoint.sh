@@ -49,6 +49,7 @@ handle_permissions() {
     # Thumbor data directories
     fix_ownership "/data/thumbor/storage" "thumbor" "thumbor"
     fix_ownership "/data/thumbor/result_storage" "thumbor" "thumbor"
+    fix_ownership "/data/thumbor/source_cache" "thumbor" "thumbor"
     fix_ownership "/data/thumbor/cache" "thumbor" "thumbor"
 
     # Nginx directories
@@ -67,6 +68,7 @@ handle_permissions() {
     chmod 755 /app/logs 2>/dev/null || true
     chmod 755 /data/thumbor/storage 2>/dev/null || true
     chmod 755 /data/thumbor/result_storage 2>/dev/null || true
+    chmod 755 /data/thumbor/source_cache 2>/dev/null || true
     chmod 755 /data/thumbor/cache 2>/dev/null || true
     chmod 755 /var/cache/nginx 2>/dev/null || true
     chmod 755 /var/log/nginx 2>/dev/null || true
@@ -84,9 +86,7 @@ if [ -n "$WEBSITE_INSTANCE_ID" ]; then
 
         # Check if we have the template file
         if [ -f "/tmp/nginx-cache.conf.template" ]; then
-            envsubst '${NGINX_LISTEN_PORT} ${THUMBOR_PROXY_CACHE_SIZE} ${THUMBOR_PROXY_CACHE_MEMORY_SIZE} ${THUMBOR_PROXY_CACHE_INACTIVE} ${THUMBOR_PROXY_CACHE_DURATION}' \
-                < /tmp/nginx-cache.conf.template \
-                > /etc/nginx/nginx.conf
+            /app/render_nginx_conf.sh /tmp/nginx-cache.conf.template /etc/nginx/nginx.conf
         else
             echo "Warning: Cannot regenerate nginx config - template not found"
         fi
@@ -5,10 +5,31 @@ Provides web-based Redis management without external dependencies
 """
 
 import os
+
+# In the default gevent serving mode the stdlib must be patched before redis,
+# threading or socket are imported, so blocking Redis calls yield to other requests
+SERVER_MODE = os.environ.get('REDIS_ADMIN_SERVER', 'gevent').lower()
+if os.environ.get('REDIS_ADMIN_DEBUG', 'false').lower() == 'true':
+    # The Flask debugger and reloader need the development server
+    SERVER_MODE = 'dev'
+if __name__ == '__main__' and SERVER_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
 import json
+import math
+import logging
+import time
+import uuid
+import codecs
+import threading
+from array import array
+from collections import deque
 import redis
-from flask import Flask, jsonify, request, render_template_string
+from flask import Flask, Response, g, jsonify, request, render_template_string, stream_with_context
 from flask_cors import CORS
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 from datetime import datetime
 import traceback
 
@@ -16,22 +37,1226 @@ app = Flask(__name__)
 CORS(app)
 
 # Redis connection settings from environment
+logger = logging.getLogger(__name__)
+
 REDIS_HOST = os.environ.get('REDIS_SERVER_HOST', 'localhost')
 REDIS_PORT = int(os.environ.get('REDIS_SERVER_PORT', 6379))
 REDIS_DB = int(os.environ.get('REDIS_SERVER_DB', 0))
 
-# Create Redis connection pool
-redis_pool = redis.ConnectionPool(
+# Serving limits: concurrent requests, Redis connections shared by them, how long
+# a request waits for a free connection and how long a request may run
+MAX_CONCURRENT_REQUESTS = int(os.environ.get('REDIS_ADMIN_MAX_CONCURRENT_REQUESTS', 200))
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_ADMIN_REDIS_MAX_CONNECTIONS', 20))
+REDIS_POOL_TIMEOUT = float(os.environ.get('REDIS_ADMIN_REDIS_POOL_TIMEOUT', 5))
+REQUEST_TIMEOUT = float(os.environ.get('REDIS_ADMIN_REQUEST_TIMEOUT', 30))
+HEALTH_TIMEOUT = 2.0
+
+# Create Redis connection pool; requests wait up to REDIS_POOL_TIMEOUT for a free
+# connection instead of opening an unbounded number against production Redis
+redis_pool = redis.BlockingConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    decode_responses=True,
+    max_connections=REDIS_MAX_CONNECTIONS,
+    timeout=REDIS_POOL_TIMEOUT
+)
+
+# Separate pool without response decoding, used to read string values in
+# byte windows that may split multi-byte characters
+redis_raw_pool = redis.BlockingConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    decode_responses=False,
+    max_connections=max(REDIS_MAX_CONNECTIONS // 4, 2),
+    timeout=REDIS_POOL_TIMEOUT
+)
+
+# Dedicated pool for /redis-admin/health so liveness probes never queue behind
+# heavy admin requests holding the shared pool
+redis_health_pool = redis.BlockingConnectionPool(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    decode_responses=True,
+    max_connections=2,
+    timeout=HEALTH_TIMEOUT,
+    socket_timeout=HEALTH_TIMEOUT,
+    socket_connect_timeout=HEALTH_TIMEOUT
+)
+
+# Commands typed into the console run on their own pool with a socket timeout,
+# so a slow command fails fast instead of holding a request open
+EXECUTE_TIMEOUT = float(os.environ.get('REDIS_ADMIN_EXECUTE_TIMEOUT', 5))
+redis_execute_pool = redis.BlockingConnectionPool(
     host=REDIS_HOST,
     port=REDIS_PORT,
     db=REDIS_DB,
-    decode_responses=True
+    decode_responses=True,
+    max_connections=max(REDIS_MAX_CONNECTIONS // 4, 2),
+    timeout=REDIS_POOL_TIMEOUT,
+    socket_timeout=EXECUTE_TIMEOUT
 )
 
 def get_redis_connection():
     """Get Redis connection from pool"""
     return redis.Redis(connection_pool=redis_pool)
 
+def get_execute_redis_connection():
+    """Get Redis connection with a socket timeout for console commands"""
+    return redis.Redis(connection_pool=redis_execute_pool)
+
+def get_health_redis_connection():
+    """Get Redis connection reserved for health checks"""
+    return redis.Redis(connection_pool=redis_health_pool)
+
+def get_raw_redis_connection():
+    """Get Redis connection that returns raw bytes"""
+    return redis.Redis(connection_pool=redis_raw_pool)
+
+class TTLCache:
+    """Thread-safe in-process cache of computed values that expire after ttl seconds.
+
+    Concurrent callers asking for the same expired entry wait for a single
+    recomputation instead of each querying Redis.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, compute, ttl=None):
+        """Return the cached value for name, calling compute() if it expired"""
+        with self._lock:
+            lock = self._locks.setdefault(name, threading.Lock())
+        with lock:
+            entry = self._entries.get(name)
+            if entry is not None and time.monotonic() < entry[0]:
+                return entry[1]
+            value = compute()
+            self._entries[name] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            return value
+
+# Dashboard stats are computed at most once per interval and shared by all clients
+STATS_INTERVAL = float(os.environ.get('REDIS_ADMIN_STATS_INTERVAL', 5))
+# Only the INFO sections the dashboard reads from
+STATS_INFO_SECTIONS = ('server', 'clients', 'memory', 'stats')
+
+stats_cache = TTLCache(STATS_INTERVAL)
+
+class MetricsRing:
+    """Fixed-capacity ring buffer of numeric samples, stored as one array('d') per field.
+
+    Memory use is fixed at capacity * (len(fields) + 1) * 8 bytes regardless of
+    how long the process runs.
+    """
+
+    def __init__(self, fields, capacity):
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self._columns = {
+            name: array('d', bytes(8 * capacity)) for name in ('timestamp',) + self.fields
+        }
+        self._next = 0
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def append(self, timestamp, values):
+        """Store one sample, overwriting the oldest one when full"""
+        with self._lock:
+            self._columns['timestamp'][self._next] = timestamp
+            for name in self.fields:
+                self._columns[name][self._next] = values.get(name, 0)
+            self._next = (self._next + 1) % self.capacity
+            self._size = min(self._size + 1, self.capacity)
+
+    def snapshot(self, since=0):
+        """Return {field: [values]} in chronological order for samples at or after since"""
+        with self._lock:
+            start = (self._next - self._size) % self.capacity
+            order = [(start + i) % self.capacity for i in range(self._size)]
+            timestamps = self._columns['timestamp']
+            order = [i for i in order if timestamps[i] >= since]
+            return {name: [column[i] for i in order] for name, column in self._columns.items()}
+
+# Sampled INFO counters (cumulative) and gauges kept in the metrics history
+METRICS_INTERVAL = float(os.environ.get('REDIS_ADMIN_METRICS_INTERVAL', 10))
+METRICS_HOURS = float(os.environ.get('REDIS_ADMIN_METRICS_HOURS', 6))
+METRICS_COUNTERS = ('total_commands_processed', 'keyspace_hits', 'keyspace_misses',
+                    'evicted_keys', 'expired_keys')
+METRICS_GAUGES = ('used_memory', 'connected_clients')
+METRICS_MAX_POINTS = 1000
+# While Redis is down the sampler waits twice as long after each failure, up to this
+METRICS_MAX_BACKOFF = float(os.environ.get('REDIS_ADMIN_METRICS_MAX_BACKOFF', 300))
+
+metrics_history = MetricsRing(
+    METRICS_COUNTERS + METRICS_GAUGES,
+    max(int(METRICS_HOURS * 3600 / METRICS_INTERVAL), 2)
+)
+
+# RemoteCV detector queue (pyres list written by thumbor's queued detector).
+# pyres keeps processed/failed job counters and one key per busy worker
+# holding the job it is running.
+DETECTOR_QUEUE_NAME = os.environ.get('REMOTECV_DETECTOR_QUEUE_NAME', 'Detect')
+DETECTOR_QUEUE_KEY = f'resque:queue:{DETECTOR_QUEUE_NAME}'
+RESQUE_PROCESSED_KEY = 'resque:stat:processed'
+RESQUE_FAILED_KEY = 'resque:stat:failed'
+RESQUE_WORKERS_KEY = 'resque:workers'
+RESQUE_WORKER_KEY = 'resque:worker:%s'
+# Written by remotecv_pool.py, the autoscaling RemoteCV worker pool controller
+REMOTECV_POOL_STATE_KEY = 'remotecv:pool:state'
+REMOTECV_POOL_DECISIONS_KEY = 'remotecv:pool:decisions'
+REMOTECV_POOL_DECISIONS_SHOWN = 20
+REMOTECV_TIMEOUT_SEC = float(os.environ.get('REMOTECV_TIMEOUT_SEC', 20))
+# Window used to average enqueue/dequeue rates for the drain estimate
+QUEUE_RATE_WINDOW = 300
+
+queue_history = MetricsRing(('depth', 'processed', 'failed'), metrics_history.capacity)
+metrics_sampler = None
+metrics_sampler_lock = threading.Lock()
+
+def sample_metrics():
+    """Read the sampled INFO fields and append them to the metrics history"""
+    r = get_redis_connection()
+    pipe = r.pipeline(transaction=False)
+    pipe.info('stats')
+    pipe.info('memory')
+    pipe.info('clients')
+    pipe.llen(DETECTOR_QUEUE_KEY)
+    pipe.get(RESQUE_PROCESSED_KEY)
+    pipe.get(RESQUE_FAILED_KEY)
+    results = pipe.execute()
+    info = {}
+    for section in results[:3]:
+        info.update(section)
+    now = time.time()
+    metrics_history.append(now, info)
+    depth, processed, failed = results[3:]
+    queue_history.append(now, {
+        'depth': depth,
+        'processed': int(processed or 0),
+        'failed': int(failed or 0),
+    })
+
+def run_metrics_sampler():
+    """Sample metrics every METRICS_INTERVAL seconds until the process exits"""
+    delay = METRICS_INTERVAL
+    while True:
+        try:
+            sample_metrics()
+        except Exception:
+            logger.warning("Metrics sampling failed, retrying in %.0fs", delay, exc_info=True)
+            time.sleep(delay)
+            delay = min(delay * 2, max(METRICS_MAX_BACKOFF, METRICS_INTERVAL))
+            continue
+        if delay != METRICS_INTERVAL:
+            logger.info("Metrics sampling recovered")
+            delay = METRICS_INTERVAL
+        time.sleep(METRICS_INTERVAL)
+
+def start_metrics_sampler():
+    """Start the background metrics sampler once per process"""
+    global metrics_sampler
+    with metrics_sampler_lock:
+        if metrics_sampler is None:
+            metrics_sampler = threading.Thread(target=run_metrics_sampler, name='metrics-sampler', daemon=True)
+            metrics_sampler.start()
+
+def derive_rates(samples, max_points=METRICS_MAX_POINTS):
+    """Turn cumulative counter samples into per-interval rates.
+
+    Counters are cumulative, so samples are downsampled by taking every
+    stride-th one and the rate over the longer interval stays exact. A
+    counter that goes backwards (Redis restart) yields None for that interval.
+    """
+    timestamps = samples['timestamp']
+    stride = max(1, math.ceil((len(timestamps) - 1) / max_points))
+    picked = list(range(0, len(timestamps), stride))
+    if picked and picked[-1] != len(timestamps) - 1:
+        picked.append(len(timestamps) - 1)
+
+    def rate(field, prev, cur, elapsed):
+        delta = samples[field][cur] - samples[field][prev]
+        return round(delta / elapsed, 3) if delta >= 0 else None
+
+    series = {'timestamp': [], 'ops_per_sec': [], 'hit_ratio': [], 'evicted_per_sec': [],
+              'expired_per_sec': [], 'used_memory': [], 'connected_clients': []}
+    for prev, cur in zip(picked, picked[1:]):
+        elapsed = timestamps[cur] - timestamps[prev]
+        if elapsed <= 0:
+            continue
+        hits = samples['keyspace_hits'][cur] - samples['keyspace_hits'][prev]
+        misses = samples['keyspace_misses'][cur] - samples['keyspace_misses'][prev]
+        series['timestamp'].append(timestamps[cur])
+        series['ops_per_sec'].append(rate('total_commands_processed', prev, cur, elapsed))
+        series['hit_ratio'].append(
+            round(hits / (hits + misses), 4) if hits >= 0 and misses >= 0 and hits + misses > 0 else None
+        )
+        series['evicted_per_sec'].append(rate('evicted_keys', prev, cur, elapsed))
+        series['expired_per_sec'].append(rate('expired_keys', prev, cur, elapsed))
+        series['used_memory'].append(int(samples['used_memory'][cur]))
+        series['connected_clients'].append(int(samples['connected_clients'][cur]))
+    return series
+
+def queue_rates(samples):
+    """Per-interval enqueue and dequeue rates of the detector queue.
+
+    Dequeues are the growth of pyres' processed + failed counters; enqueues
+    are dequeues plus the growth of the queue length.
+    """
+    series = {'timestamp': [], 'depth': [], 'enqueue_rate': [], 'dequeue_rate': []}
+    timestamps = samples['timestamp']
+    for cur in range(1, len(timestamps)):
+        prev = cur - 1
+        elapsed = timestamps[cur] - timestamps[prev]
+        if elapsed <= 0:
+            continue
+        done = (samples['processed'][cur] + samples['failed'][cur]
+                - samples['processed'][prev] - samples['failed'][prev])
+        grown = samples['depth'][cur] - samples['depth'][prev]
+        series['timestamp'].append(timestamps[cur])
+        series['depth'].append(int(samples['depth'][cur]))
+        # Counters going backwards mean the pyres stats were reset
+        series['dequeue_rate'].append(round(done / elapsed, 3) if done >= 0 else None)
+        series['enqueue_rate'].append(round((done + grown) / elapsed, 3) if done >= 0 and done + grown >= 0 else None)
+    return series
+
+def average_rate(values):
+    """Mean of the non-null values, or None"""
+    values = [v for v in values if v is not None]
+    return sum(values) / len(values) if values else None
+
+def inspect_queue(r, now=None):
+    """Oldest pending job and the jobs RemoteCV workers are currently running"""
+    now = now or time.time()
+    pipe = r.pipeline(transaction=False)
+    pipe.llen(DETECTOR_QUEUE_KEY)
+    pipe.lindex(DETECTOR_QUEUE_KEY, 0)
+    pipe.smembers(RESQUE_WORKERS_KEY)
+    depth, oldest, workers = pipe.execute()
+
+    oldest_job = None
+    if oldest:
+        try:
+            payload = json.loads(oldest)
+            enqueued = payload.get('enqueue_timestamp')
+            oldest_job = {
+                'args': payload.get('args'),
+                'enqueued_at': enqueued,
+                'age': round(now - float(enqueued), 3) if enqueued else None,
+            }
+        except (ValueError, TypeError, AttributeError):
+            oldest_job = {'raw': oldest[:200], 'enqueued_at': None, 'age': None}
+
+    workers = sorted(workers)
+    in_flight = []
+    if workers:
+        pipe = r.pipeline(transaction=False)
+        for worker in workers:
+            pipe.get(RESQUE_WORKER_KEY % worker)
+            pipe.get(f'{RESQUE_PROCESSED_KEY}:{worker}')
+            pipe.get(f'{RESQUE_FAILED_KEY}:{worker}')
+        results = pipe.execute()
+        for worker, job, processed, failed in zip(workers, results[0::3], results[1::3], results[2::3]):
+            entry = {
+                'worker': worker, 'queue': None, 'args': None, 'running_for': None, 'stuck': False,
+                'processed': int(processed or 0), 'failed': int(failed or 0),
+            }
+            if job:
+                try:
+                    job = json.loads(job)
+                    payload = job.get('payload') or {}
+                    entry['queue'] = job.get('queue')
+                    entry['args'] = payload.get('args')
+                    run_at = job.get('run_at')
+                    if run_at:
+                        entry['running_for'] = round(now - float(run_at), 3)
+                        entry['stuck'] = entry['running_for'] > REMOTECV_TIMEOUT_SEC
+                except (ValueError, TypeError, AttributeError):
+                    pass
+            in_flight.append(entry)
+    return depth, oldest_job, in_flight
+
+def pool_status(r):
+    """Latest state and recent scale decisions of the RemoteCV worker pool controller"""
+    pipe = r.pipeline(transaction=False)
+    pipe.get(REMOTECV_POOL_STATE_KEY)
+    pipe.lrange(REMOTECV_POOL_DECISIONS_KEY, 0, REMOTECV_POOL_DECISIONS_SHOWN - 1)
+    state, decisions = pipe.execute()
+    if not state:
+        # The state key expires when the controller stops publishing
+        return None
+    state = json.loads(state)
+    state['decisions'] = [json.loads(d) for d in decisions]
+    return state
+
+def memory_trend(timestamps, used_memory):
+    """Least-squares slope of used_memory in bytes per second"""
+    n = len(timestamps)
+    if n < 2:
+        return 0.0
+    mean_t = sum(timestamps) / n
+    mean_m = sum(used_memory) / n
+    variance = sum((t - mean_t) ** 2 for t in timestamps)
+    if variance == 0:
+        return 0.0
+    covariance = sum((t - mean_t) * (m - mean_m) for t, m in zip(timestamps, used_memory))
+    return round(covariance / variance, 3)
+
+# Optional per-key details that can be fetched alongside TYPE when listing keys
+KEY_DETAIL_FIELDS = ('ttl', 'memory', 'encoding')
+
+# SCAN paging limits for the key browser
+SCAN_COUNT_DEFAULT = int(os.environ.get('REDIS_ADMIN_SCAN_COUNT', 100))
+SCAN_COUNT_MAX = 10000
+SCAN_MAX_PAGES = int(os.environ.get('REDIS_ADMIN_SCAN_MAX_PAGES', 50))
+KEY_TYPES = ('string', 'list', 'set', 'zset', 'hash', 'stream')
+
+# Server-side listing: SCAN one page and return key, type, TTL and the
+# requested details (ARGV[5], comma separated) in a single call
+SCAN_PAGE_LUA = """
+local page
+if ARGV[4] ~= '' then
+    page = redis.call('SCAN', ARGV[1], 'MATCH', ARGV[2], 'COUNT', ARGV[3], 'TYPE', ARGV[4])
+else
+    page = redis.call('SCAN', ARGV[1], 'MATCH', ARGV[2], 'COUNT', ARGV[3])
+end
+local memory = string.find(ARGV[5], 'memory', 1, true)
+local encoding = string.find(ARGV[5], 'encoding', 1, true)
+local described = {}
+for _, key in ipairs(page[2]) do
+    described[#described + 1] = key
+    described[#described + 1] = redis.call('TYPE', key)['ok']
+    described[#described + 1] = redis.call('TTL', key)
+    if memory then
+        described[#described + 1] = redis.call('MEMORY', 'USAGE', key) or false
+    end
+    if encoding then
+        described[#described + 1] = redis.call('OBJECT', 'ENCODING', key) or false
+    end
+end
+return {page[1], described}
+"""
+
+# Registered once; the script is loaded into Redis on first use and run by SHA
+scan_page_script = get_redis_connection().register_script(SCAN_PAGE_LUA)
+
+def parse_key_details(value):
+    """Parse a comma separated list of key detail fields"""
+    fields = [field.strip().lower() for field in (value or '').split(',') if field.strip()]
+    unknown = [field for field in fields if field not in KEY_DETAIL_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown key detail(s): {', '.join(unknown)}")
+    return tuple(field for field in KEY_DETAIL_FIELDS if field in fields)
+
+def describe_keys(r, keys, details=()):
+    """Fetch type and optional details for a batch of keys in one pipelined round-trip"""
+    if not keys:
+        return []
+
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.type(key)
+        if 'ttl' in details:
+            pipe.ttl(key)
+        if 'memory' in details:
+            pipe.memory_usage(key)
+        if 'encoding' in details:
+            pipe.object('encoding', key)
+
+    # Keys can expire between SCAN and the pipeline; report those details as None
+    results = iter(pipe.execute(raise_on_error=False))
+    described = []
+    for key in keys:
+        entry = {'key': key}
+        for field in ('type',) + tuple(details):
+            value = next(results)
+            entry[field] = None if isinstance(value, Exception) else value
+        described.append(entry)
+    return described
+
+def scan_page_lua(r, cursor, pattern, count, key_type=None, details=()):
+    """SCAN one page server-side and return (next_cursor, [{key, type, ttl, details...}])"""
+    next_cursor, flat = scan_page_script(
+        args=[cursor, pattern, count, key_type or '', ','.join(details)], client=r
+    )
+    # TTL always comes back from the script, whether or not it was asked for
+    fields = ('key', 'type', 'ttl') + tuple(field for field in details if field != 'ttl')
+    described = [
+        dict(zip(fields, flat[i:i + len(fields)]))
+        for i in range(0, len(flat), len(fields))
+    ]
+    return int(next_cursor), described
+
+# Value reading limits: collections are walked in windows of VALUE_WINDOW items
+# and never more than max_items are returned for a single request
+VALUE_WINDOW = int(os.environ.get('REDIS_ADMIN_VALUE_WINDOW', 500))
+VALUE_MAX_ITEMS = int(os.environ.get('REDIS_ADMIN_VALUE_MAX_ITEMS', 1000))
+VALUE_MAX_BYTES = int(os.environ.get('REDIS_ADMIN_VALUE_MAX_BYTES', 1024 * 1024))
+VALUE_STRING_CHUNK = 64 * 1024
+
+# Length command per key type, used to size a value before reading it
+VALUE_SIZE_COMMANDS = {
+    'string': 'STRLEN',
+    'list': 'LLEN',
+    'set': 'SCARD',
+    'zset': 'ZCARD',
+    'hash': 'HLEN',
+    'stream': 'XLEN',
+}
+
+def preflight_key(r, key):
+    """Get type, TTL, length and memory usage of a key without reading its value"""
+    pipe = r.pipeline(transaction=False)
+    pipe.type(key)
+    pipe.ttl(key)
+    pipe.memory_usage(key)
+    key_type, ttl, memory = pipe.execute(raise_on_error=False)
+    if isinstance(memory, Exception):
+        memory = None
+
+    size = None
+    if key_type in VALUE_SIZE_COMMANDS:
+        size = r.execute_command(VALUE_SIZE_COMMANDS[key_type], key)
+
+    return {'key': key, 'type': key_type, 'ttl': ttl, 'size': size, 'memory': memory}
+
+def key_sizes(r, keys):
+    """Length of each key in two pipelined round-trips, TYPE then the length command; 0 if missing"""
+    pipe = r.pipeline(transaction=False)
+    for key in keys:
+        pipe.type(key)
+    types = pipe.execute()
+
+    pipe = r.pipeline(transaction=False)
+    sized = [key_type in VALUE_SIZE_COMMANDS for key_type in types]
+    for key, key_type, has_size in zip(keys, types, sized):
+        if has_size:
+            pipe.execute_command(VALUE_SIZE_COMMANDS[key_type], key)
+    # A key can change type or disappear between the two pipelines
+    sizes = iter(pipe.execute(raise_on_error=False))
+    result = []
+    for has_size in sized:
+        size = next(sizes) if has_size else 0
+        result.append(0 if isinstance(size, Exception) else size)
+    return result
+
+def parse_value_range(value, size):
+    """Parse an inclusive 'start:stop' range (negative indexes allowed) against size"""
+    if not value:
+        return 0, size - 1
+    try:
+        start, stop = (int(part) if part else None for part in value.split(':', 1))
+    except ValueError:
+        raise ValueError(f'Invalid range: {value} (expected start:stop)')
+    start = 0 if start is None else start
+    stop = size - 1 if stop is None else stop
+    if start < 0:
+        start = max(size + start, 0)
+    if stop < 0:
+        stop = size + stop
+    return start, min(stop, size - 1)
+
+def iter_value_items(key, key_type, start, stop, max_items, window=VALUE_WINDOW):
+    """Yield a key's value in batches of items, never materializing it whole.
+
+    Strings are read with GETRANGE and lists with LRANGE windows between start
+    and stop; sets, hashes and sorted sets are walked with SSCAN, HSCAN and
+    ZSCAN (or ZRANGE windows when an explicit range is requested).
+    """
+    r = get_redis_connection()
+    remaining = max_items
+
+    if key_type == 'string':
+        raw = get_raw_redis_connection()
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        offset = start
+        end = min(stop, start + max_items - 1)
+        while offset <= end:
+            chunk_end = min(offset + VALUE_STRING_CHUNK - 1, end)
+            chunk = raw.getrange(key, offset, chunk_end)
+            if not chunk:
+                break
+            text = decoder.decode(chunk, final=chunk_end == end)
+            yield [{'offset': offset, 'chunk': text}]
+            offset += len(chunk)
+    elif key_type in ('list', 'zset') and (start, stop) != (0, -1):
+        index = start
+        while index <= stop and remaining > 0:
+            window_end = min(index + min(window, remaining) - 1, stop)
+            if key_type == 'list':
+                values = r.lrange(key, index, window_end)
+                batch = [{'index': index + i, 'value': v} for i, v in enumerate(values)]
+            else:
+                values = r.zrange(key, index, window_end, withscores=True)
+                batch = [{'index': index + i, 'member': m, 'score': sc} for i, (m, sc) in enumerate(values)]
+            if not batch:
+                break
+            yield batch
+            remaining -= len(batch)
+            index += len(batch)
+    elif key_type in ('set', 'hash', 'zset'):
+        scan = {'set': r.sscan, 'hash': r.hscan, 'zset': r.zscan}[key_type]
+        cursor = 0
+        while remaining > 0:
+            cursor, values = scan(key, cursor, count=window)
+            if key_type == 'set':
+                batch = [{'member': m} for m in values]
+            elif key_type == 'hash':
+                batch = [{'field': f, 'value': v} for f, v in values.items()]
+            else:
+                batch = [{'member': m, 'score': sc} for m, sc in values]
+            batch = batch[:remaining]
+            if batch:
+                yield batch
+                remaining -= len(batch)
+            if cursor == 0:
+                break
+
+def collect_value(key_type, batches):
+    """Rebuild the classic JSON value shape from item batches"""
+    items = [item for batch in batches for item in batch]
+    if key_type == 'string':
+        return ''.join(item['chunk'] for item in items)
+    if key_type == 'list':
+        return [item['value'] for item in items]
+    if key_type == 'set':
+        return [item['member'] for item in items]
+    if key_type == 'zset':
+        return [[item['member'], item['score']] for item in items]
+    if key_type == 'hash':
+        return {item['field']: item['value'] for item in items}
+    return None
+
+# Keyspace memory analyzer: keys are grouped by the longest matching configured
+# prefix, anything else by its first segment before ANALYZER_DELIMITER
+ANALYZER_PREFIXES = [
+    prefix.strip() for prefix in os.environ.get(
+        'REDIS_ADMIN_ANALYZER_PREFIXES',
+        'thumbor:detectors:,thumbor-detector-,resque:'
+    ).split(',') if prefix.strip()
+]
+ANALYZER_DELIMITER = ':'
+ANALYZER_SAMPLE_SIZE = int(os.environ.get('REDIS_ADMIN_ANALYZER_SAMPLE_SIZE', 10000))
+ANALYZER_SAMPLE_MAX = 100000
+ANALYZER_TIME_BUDGET = float(os.environ.get('REDIS_ADMIN_ANALYZER_TIME_BUDGET', 5))
+ANALYZER_SCAN_COUNT = 1000
+# z-score for the 95% confidence bounds of the extrapolated totals
+ANALYZER_Z = 1.96
+
+# TTL histogram buckets as (label, upper bound in seconds)
+TTL_BUCKETS = (
+    ('<1m', 60),
+    ('<10m', 600),
+    ('<1h', 3600),
+    ('<1d', 86400),
+    ('<7d', 7 * 86400),
+    ('>=7d', float('inf')),
+)
+
+def key_group(key, prefixes):
+    """Return the analyzer group for a key"""
+    matches = [prefix for prefix in prefixes if key.startswith(prefix)]
+    if matches:
+        return max(matches, key=len) + '*'
+    head, sep, _ = key.partition(ANALYZER_DELIMITER)
+    return head + sep + '*' if sep else '(no prefix)'
+
+def ttl_bucket(ttl):
+    """Return the TTL histogram bucket label for a TTL in seconds"""
+    for label, upper in TTL_BUCKETS:
+        if ttl < upper:
+            return label
+    return TTL_BUCKETS[-1][0]
+
+def sample_keyspace(r, sample_size, time_budget):
+    """Sample keys with SCAN and fetch MEMORY USAGE and TTL per SCAN page in one pipeline.
+
+    SCAN walks the hash table in bucket order, which is unrelated to key names,
+    so the first sample_size keys are a usable sample of the whole keyspace.
+    Stops at sample_size keys, at the end of the keyspace or when time_budget
+    seconds have elapsed, whichever comes first.
+    """
+    deadline = time.monotonic() + time_budget
+    sample = []
+    cursor = 0
+    while True:
+        cursor, keys = r.scan(cursor, count=ANALYZER_SCAN_COUNT)
+        keys = keys[:sample_size - len(sample)]
+        if keys:
+            pipe = r.pipeline(transaction=False)
+            for key in keys:
+                pipe.memory_usage(key)
+                pipe.ttl(key)
+            results = pipe.execute(raise_on_error=False)
+            for key, memory, ttl in zip(keys, results[::2], results[1::2]):
+                # Skip keys that expired between SCAN and the pipeline
+                if isinstance(memory, Exception) or memory is None or ttl == -2:
+                    continue
+                sample.append((key, memory, ttl))
+        if cursor == 0 or len(sample) >= sample_size or time.monotonic() >= deadline:
+            return sample, cursor == 0
+
+def estimate_total(values, population):
+    """Extrapolate a per-key sample to a population total with 95% bounds"""
+    n = len(values)
+    if n == 0:
+        return {'estimate': 0, 'low': 0, 'high': 0}
+    mean = sum(values) / n
+    variance = sum((v - mean) ** 2 for v in values) / (n - 1) if n > 1 else 0.0
+    # Finite population correction: the bounds collapse to zero when every key was sampled
+    fpc = math.sqrt(max(population - n, 0) / (population - 1)) if population > 1 else 0.0
+    margin = ANALYZER_Z * math.sqrt(variance / n) * fpc * population
+    estimate = mean * population
+    return {
+        'estimate': round(estimate),
+        'low': round(max(estimate - margin, 0)),
+        'high': round(estimate + margin),
+    }
+
+def analyze_sample(sample, population, prefixes):
+    """Group a key sample by prefix and extrapolate counts, bytes and TTL shape"""
+    groups = {}
+    for key, memory, ttl in sample:
+        groups.setdefault(key_group(key, prefixes), []).append((memory, ttl))
+
+    report = []
+    for name, members in groups.items():
+        # Per-key indicator and byte values over the whole sample (zero for keys
+        # outside the group), so estimates and bounds scale to the population
+        padding = [0] * (len(sample) - len(members))
+        counts = [1] * len(members) + padding
+        sizes = [memory for memory, _ in members] + padding
+        histogram = {label: 0 for label, _ in TTL_BUCKETS}
+        no_ttl = 0
+        for memory, ttl in members:
+            if ttl == -1:
+                no_ttl += 1
+            else:
+                histogram[ttl_bucket(ttl)] += 1
+        report.append({
+            'group': name,
+            'sampled_keys': len(members),
+            'sampled_bytes': sum(memory for memory, _ in members),
+            'keys': estimate_total(counts, population),
+            'bytes': estimate_total(sizes, population),
+            'no_ttl_ratio': round(no_ttl / len(members), 4),
+            'ttl_histogram': histogram,
+        })
+    report.sort(key=lambda group: group['bytes']['estimate'], reverse=True)
+    return report
+
+# Prometheus exporter: INFO and queue depth are cached for PROMETHEUS_TTL seconds
+# and per-prefix key counts (a keyspace sample) for PROMETHEUS_PREFIX_TTL seconds,
+# so any number of scrapers costs at most one query per interval
+PROMETHEUS_TTL = float(os.environ.get('REDIS_ADMIN_PROMETHEUS_TTL', 15))
+PROMETHEUS_PREFIX_TTL = float(os.environ.get('REDIS_ADMIN_PROMETHEUS_PREFIX_TTL', 300))
+PROMETHEUS_PREFIX_SAMPLE_SIZE = int(os.environ.get('REDIS_ADMIN_PROMETHEUS_PREFIX_SAMPLE_SIZE', 2000))
+PROMETHEUS_PREFIX_TIME_BUDGET = 1.0
+PROMETHEUS_INFO_SECTIONS = ('server', 'clients', 'memory', 'stats', 'keyspace')
+
+# INFO fields exported as (field, metric name, help)
+PROMETHEUS_INFO_COUNTERS = (
+    ('total_commands_processed', 'redis_commands_processed', 'Commands processed by the server'),
+    ('total_connections_received', 'redis_connections_received', 'Connections accepted by the server'),
+    ('rejected_connections', 'redis_rejected_connections', 'Connections rejected because of maxclients'),
+    ('keyspace_hits', 'redis_keyspace_hits', 'Successful key lookups'),
+    ('keyspace_misses', 'redis_keyspace_misses', 'Failed key lookups'),
+    ('evicted_keys', 'redis_evicted_keys', 'Keys evicted because of maxmemory'),
+    ('expired_keys', 'redis_expired_keys', 'Keys removed because their TTL expired'),
+)
+PROMETHEUS_INFO_GAUGES = (
+    ('uptime_in_seconds', 'redis_uptime_seconds', 'Seconds since the server started'),
+    ('connected_clients', 'redis_connected_clients', 'Connected clients'),
+    ('blocked_clients', 'redis_blocked_clients', 'Clients blocked on a blocking call'),
+    ('used_memory', 'redis_memory_used_bytes', 'Memory allocated by Redis'),
+    ('used_memory_rss', 'redis_memory_rss_bytes', 'Resident set size of the Redis process'),
+    ('maxmemory', 'redis_memory_max_bytes', 'Configured maxmemory'),
+    ('mem_fragmentation_ratio', 'redis_memory_fragmentation_ratio', 'RSS to used memory ratio'),
+    ('instantaneous_ops_per_sec', 'redis_instantaneous_ops_per_second', 'Ops/sec reported by Redis'),
+)
+
+prometheus_cache = TTLCache(PROMETHEUS_TTL)
+
+API_LATENCY = Histogram(
+    'redis_admin_request_duration_seconds',
+    'Latency of Redis Admin HTTP requests',
+    ['endpoint', 'method', 'status'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
+def collect_redis_info():
+    """Read the exported INFO sections and detector queue depth in one round-trip"""
+    r = get_redis_connection()
+    pipe = r.pipeline(transaction=False)
+    for section in PROMETHEUS_INFO_SECTIONS:
+        pipe.info(section)
+    pipe.llen(DETECTOR_QUEUE_KEY)
+    results = pipe.execute()
+    info = {}
+    for section in results[:-1]:
+        info.update(section)
+    return {'info': info, 'queue_depth': results[-1]}
+
+def collect_prefix_counts():
+    """Estimate key count and bytes per analyzer prefix from a small keyspace sample"""
+    r = get_redis_connection()
+    population = r.dbsize()
+    sample, _ = sample_keyspace(r, PROMETHEUS_PREFIX_SAMPLE_SIZE, PROMETHEUS_PREFIX_TIME_BUDGET)
+    return analyze_sample(sample, population, ANALYZER_PREFIXES)
+
+class RedisCollector:
+    """Prometheus collector for Redis INFO, detector queue depth and key prefixes"""
+
+    def describe(self):
+        # Nothing to describe up front, so registering doesn't query Redis at import
+        return []
+
+    def collect(self):
+        up = GaugeMetricFamily('redis_up', 'Whether the last Redis query succeeded')
+        try:
+            snapshot = prometheus_cache.get('info', collect_redis_info)
+            groups = prometheus_cache.get('prefixes', collect_prefix_counts, ttl=PROMETHEUS_PREFIX_TTL)
+        except Exception:
+            # redis_up 0 is what alerts on this; the log says why
+            logger.warning("Prometheus collection failed", exc_info=True)
+            up.add_metric([], 0)
+            yield up
+            return
+        up.add_metric([], 1)
+        yield up
+
+        info = snapshot['info']
+        for field, name, help_text in PROMETHEUS_INFO_COUNTERS:
+            if field in info:
+                yield CounterMetricFamily(name, help_text, value=info[field])
+        for field, name, help_text in PROMETHEUS_INFO_GAUGES:
+            if field in info:
+                yield GaugeMetricFamily(name, help_text, value=info[field])
+
+        db_keys = GaugeMetricFamily('redis_db_keys', 'Keys per database', labels=['db'])
+        db_expires = GaugeMetricFamily('redis_db_keys_expiring', 'Keys with a TTL per database', labels=['db'])
+        for db, stats in info.items():
+            if db.startswith('db') and isinstance(stats, dict):
+                db_keys.add_metric([db], stats.get('keys', 0))
+                db_expires.add_metric([db], stats.get('expires', 0))
+        yield db_keys
+        yield db_expires
+
+        queue = GaugeMetricFamily('remotecv_queue_depth', 'Jobs waiting in the RemoteCV queue', labels=['queue'])
+        queue.add_metric([DETECTOR_QUEUE_NAME], snapshot['queue_depth'])
+        yield queue
+
+        prefix_keys = GaugeMetricFamily(
+            'redis_prefix_keys_estimate', 'Estimated keys per prefix from a keyspace sample', labels=['prefix']
+        )
+        prefix_bytes = GaugeMetricFamily(
+            'redis_prefix_memory_bytes_estimate', 'Estimated memory per prefix from a keyspace sample', labels=['prefix']
+        )
+        for group in groups:
+            prefix_keys.add_metric([group['group']], group['keys']['estimate'])
+            prefix_bytes.add_metric([group['group']], group['bytes']['estimate'])
+        yield prefix_keys
+        yield prefix_bytes
+
+REGISTRY.register(RedisCollector())
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.monotonic()
+
+@app.after_request
+def record_request_latency(response):
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        # Label by route rule rather than URL so key names don't explode cardinality
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        API_LATENCY.labels(endpoint, request.method, str(response.status_code)).observe(
+            time.monotonic() - started
+        )
+    return response
+
+# Bulk pattern jobs: SCAN the keyspace and apply an action to matching keys in
+# pipelined batches, throttled to max_ops_per_sec keys scanned
+BULK_ACTIONS = ('unlink', 'expire', 'persist')
+BULK_BATCH_SIZE = int(os.environ.get('REDIS_ADMIN_BULK_BATCH_SIZE', 500))
+BULK_MAX_OPS_PER_SEC = int(os.environ.get('REDIS_ADMIN_BULK_MAX_OPS_PER_SEC', 5000))
+BULK_JOBS_KEPT = 20
+
+bulk_jobs = {}
+bulk_jobs_lock = threading.Lock()
+
+class BulkJob:
+    """Background SCAN + pipelined UNLINK/EXPIRE/PERSIST over keys matching a pattern"""
+
+    def __init__(self, pattern, action, seconds=None, dry_run=False,
+                 max_ops_per_sec=BULK_MAX_OPS_PER_SEC, batch_size=BULK_BATCH_SIZE):
+        self.id = uuid.uuid4().hex[:12]
+        self.pattern = pattern
+        self.action = action
+        self.seconds = seconds
+        self.dry_run = dry_run
+        self.max_ops_per_sec = max_ops_per_sec
+        self.batch_size = batch_size
+        self.status = 'pending'
+        self.error = None
+        self.scanned_pages = 0
+        self.matched = 0
+        self.applied = 0
+        self.bytes = 0
+        self.created = time.time()
+        self.finished = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.status = 'running'
+        self._thread = threading.Thread(target=self.run, name=f'bulk-{self.id}', daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def apply_batch(self, r, keys):
+        """Apply the action (or measure keys in dry-run mode) for one SCAN page"""
+        pipe = r.pipeline(transaction=False)
+        if self.dry_run:
+            for key in keys:
+                pipe.memory_usage(key)
+            results = pipe.execute(raise_on_error=False)
+            self.bytes += sum(v for v in results if isinstance(v, int))
+            return
+        if self.action == 'unlink':
+            pipe.unlink(*keys)
+        else:
+            for key in keys:
+                if self.action == 'expire':
+                    pipe.expire(key, self.seconds)
+                else:
+                    pipe.persist(key)
+        results = pipe.execute(raise_on_error=False)
+        self.applied += sum(int(v) for v in results if not isinstance(v, Exception))
+
+    def run(self):
+        try:
+            r = get_redis_connection()
+            started = time.monotonic()
+            processed = 0
+            cursor = 0
+            while not self._cancel.is_set():
+                cursor, keys = r.scan(cursor, match=self.pattern, count=self.batch_size)
+                self.scanned_pages += 1
+                if keys:
+                    self.matched += len(keys)
+                    self.apply_batch(r, keys)
+                # A page costs Redis the ~batch_size keys SCAN walked, matched
+                # or not, so selective patterns are throttled as well
+                processed += max(len(keys), self.batch_size)
+                if cursor == 0:
+                    break
+                # Throttle: wait until processed / elapsed drops to max_ops_per_sec
+                delay = started + processed / self.max_ops_per_sec - time.monotonic()
+                if delay > 0 and self._cancel.wait(delay):
+                    break
+            self.status = 'cancelled' if self._cancel.is_set() else 'completed'
+        except Exception as e:
+            self.status = 'failed'
+            self.error = str(e)
+        finally:
+            self.finished = time.time()
+
+    def to_dict(self):
+        end = self.finished or time.time()
+        return {
+            'id': self.id,
+            'pattern': self.pattern,
+            'action': self.action,
+            'seconds': self.seconds,
+            'dry_run': self.dry_run,
+            'max_ops_per_sec': self.max_ops_per_sec,
+            'status': self.status,
+            'error': self.error,
+            'scanned_pages': self.scanned_pages,
+            'matched': self.matched,
+            'applied': self.applied,
+            'bytes': self.bytes,
+            'created': self.created,
+            'finished': self.finished,
+            'elapsed': round(end - self.created, 3),
+        }
+
+def register_bulk_job(job):
+    """Track a job, dropping the oldest finished jobs beyond BULK_JOBS_KEPT"""
+    with bulk_jobs_lock:
+        bulk_jobs[job.id] = job
+        finished = sorted(
+            (j for j in bulk_jobs.values() if j.finished), key=lambda j: j.created
+        )
+        for old_job in finished[:max(len(bulk_jobs) - BULK_JOBS_KEPT, 0)]:
+            del bulk_jobs[old_job.id]
+
+# Console command cost model: O(N) commands are checked against the size of
+# the keys they touch and rejected, or rewritten into a bounded SCAN, when
+# they would read more than EXECUTE_MAX_ITEMS items
+EXECUTE_MAX_ITEMS = int(os.environ.get('REDIS_ADMIN_EXECUTE_MAX_ITEMS', 10000))
+EXECUTE_AUDIT_SIZE = int(os.environ.get('REDIS_ADMIN_EXECUTE_AUDIT_SIZE', 500))
+EXECUTE_AUDIT_ARG_LENGTH = 100
+
+# Never safe from the console: they block the connection or the server
+EXECUTE_DENIED_COMMANDS = ('DEBUG', 'MONITOR', 'SUBSCRIBE', 'PSUBSCRIBE', 'SSUBSCRIBE', 'SYNC', 'PSYNC')
+# Whole-collection reads and the (size command, SCAN command) used to bound them
+EXECUTE_SCAN_REWRITES = {
+    'SMEMBERS': ('SCARD', 'SSCAN'),
+    'HGETALL': ('HLEN', 'HSCAN'),
+    'HKEYS': ('HLEN', 'HSCAN'),
+    'HVALS': ('HLEN', 'HSCAN'),
+}
+# Index range reads and the command sizing their key
+EXECUTE_RANGE_COMMANDS = {'LRANGE': 'LLEN', 'ZRANGE': 'ZCARD', 'ZREVRANGE': 'ZCARD'}
+EXECUTE_SCORE_RANGE_COMMANDS = ('ZRANGEBYSCORE', 'ZREVRANGEBYSCORE', 'ZRANGEBYLEX', 'ZREVRANGEBYLEX')
+EXECUTE_SET_ALGEBRA_COMMANDS = ('SINTER', 'SUNION', 'SDIFF', 'SINTERSTORE', 'SUNIONSTORE', 'SDIFFSTORE')
+
+execute_audit = deque(maxlen=EXECUTE_AUDIT_SIZE)
+
+class CommandRejected(Exception):
+    """Raised when the cost model refuses to run a console command"""
+
+def scan_rewrite(r, cmd, key, limit):
+    """Run a bounded SSCAN/HSCAN in place of SMEMBERS/HGETALL/HKEYS/HVALS"""
+    if cmd == 'SMEMBERS':
+        items = []
+        for member in r.sscan_iter(key, count=1000):
+            if len(items) >= limit:
+                break
+            items.append(member)
+        return items
+    fields = {}
+    for field, value in r.hscan_iter(key, count=1000):
+        if len(fields) >= limit:
+            break
+        fields[field] = value
+    if cmd == 'HKEYS':
+        return list(fields)
+    if cmd == 'HVALS':
+        return list(fields.values())
+    return fields
+
+def scan_keys(r, pattern, limit):
+    """Run a bounded SCAN MATCH in place of KEYS"""
+    keys = []
+    for key in r.scan_iter(match=pattern, count=1000):
+        if len(keys) >= limit:
+            break
+        keys.append(key)
+    return keys
+
+def plan_command(r, cmd, args, limit=EXECUTE_MAX_ITEMS):
+    """Check a console command against the cost model.
+
+    Returns (None, None) when the command can run as typed, or
+    (description, run) when it must be replaced by the bounded callable run.
+    Raises CommandRejected when it would read more than limit items.
+    """
+    if cmd in EXECUTE_DENIED_COMMANDS:
+        raise CommandRejected(f'{cmd} is not allowed from the console')
+
+    if cmd == 'KEYS' and len(args) == 1:
+        if r.dbsize() > limit:
+            return (f'SCAN MATCH {args[0]} (first {limit} keys)',
+                    lambda: scan_keys(r, args[0], limit))
+        return None, None
+
+    if cmd in EXECUTE_SCAN_REWRITES and len(args) == 1:
+        size_command, scan_command = EXECUTE_SCAN_REWRITES[cmd]
+        if r.execute_command(size_command, args[0]) > limit:
+            return (f'{scan_command} {args[0]} (first {limit} items)',
+                    lambda: scan_rewrite(r, cmd, args[0], limit))
+        return None, None
+
+    if cmd in EXECUTE_RANGE_COMMANDS and len(args) >= 3:
+        flags = [arg.upper() for arg in args[3:]]
+        size = r.execute_command(EXECUTE_RANGE_COMMANDS[cmd], args[0])
+        if 'BYSCORE' in flags or 'BYLEX' in flags:
+            if 'LIMIT' not in flags and size > limit:
+                raise CommandRejected(f'{cmd} on {size} items without LIMIT exceeds {limit}; add LIMIT')
+            return None, None
+        try:
+            start, stop = parse_value_range(f'{args[1]}:{args[2]}', size)
+        except ValueError:
+            return None, None
+        if stop - start + 1 > limit:
+            raise CommandRejected(
+                f'{cmd} would return {stop - start + 1} items (limit {limit}); narrow the range'
+            )
+        return None, None
+
+    if cmd in EXECUTE_SCORE_RANGE_COMMANDS and len(args) >= 3:
+        if 'LIMIT' not in [arg.upper() for arg in args[3:]]:
+            size = r.zcard(args[0])
+            if size > limit:
+                raise CommandRejected(f'{cmd} on {size} items without LIMIT exceeds {limit}; add LIMIT')
+        return None, None
+
+    if cmd in EXECUTE_SET_ALGEBRA_COMMANDS and args:
+        keys = args[1:] if cmd.endswith('STORE') else args
+        pipe = r.pipeline(transaction=False)
+        for key in keys:
+            pipe.scard(key)
+        total = sum(pipe.execute())
+        if total > limit:
+            raise CommandRejected(f'{cmd} over {total} members exceeds {limit}')
+        return None, None
+
+    if cmd == 'DEL' and args:
+        # Freeing a large collection blocks Redis; UNLINK frees it in the background
+        if max(key_sizes(r, args)) > limit:
+            return (f"UNLINK {' '.join(args)}", lambda: r.unlink(*args))
+        return None, None
+
+    return None, None
+
+def audit_command(command, args, status, duration, detail=None):
+    """Record a console command in the audit ring buffer"""
+    shown = [arg if len(arg) <= EXECUTE_AUDIT_ARG_LENGTH else arg[:EXECUTE_AUDIT_ARG_LENGTH] + '...'
+             for arg in args]
+    execute_audit.append({
+        'time': time.time(),
+        'command': ' '.join([command] + shown),
+        'status': status,
+        'duration_ms': round(duration * 1000, 3),
+        'detail': detail,
+        'client': request.headers.get('X-Real-IP', request.remote_addr),
+    })
+
+# SLOWLOG / LATENCY explorer: new slowlog entries are pulled incrementally
+# (tracked by slowlog ID) into a bounded local history and aggregated by shape
+SLOWLOG_FETCH = int(os.environ.get('REDIS_ADMIN_SLOWLOG_FETCH', 128))
+SLOWLOG_HISTORY = int(os.environ.get('REDIS_ADMIN_SLOWLOG_HISTORY', 5000))
+LATENCY_HISTORY = 160
+# Commands whose first argument is a subcommand rather than a key
+SUBCOMMAND_COMMANDS = ('ACL', 'CLIENT', 'CLUSTER', 'COMMAND', 'CONFIG', 'DEBUG', 'FUNCTION',
+                       'LATENCY', 'MEMORY', 'MODULE', 'OBJECT', 'SCRIPT', 'SLOWLOG', 'XINFO', 'XGROUP')
+# Commands without a key argument
+KEYLESS_COMMANDS = ('PING', 'INFO', 'DBSIZE', 'SCAN', 'KEYS', 'EVAL', 'EVALSHA', 'FCALL', 'FLUSHDB',
+                    'FLUSHALL', 'SELECT', 'AUTH', 'HELLO', 'MULTI', 'EXEC', 'DISCARD', 'PUBLISH',
+                    'TIME', 'LASTSAVE', 'BGSAVE', 'SAVE', 'BGREWRITEAOF', 'SWAPDB', 'WAIT')
+
+def key_shape(key, prefixes=None):
+    """Collapse a key into its pattern, e.g. thumbor:detectors:abc -> thumbor:detectors:*"""
+    for prefix in sorted(prefixes if prefixes is not None else ANALYZER_PREFIXES, key=len, reverse=True):
+        if key.startswith(prefix):
+            return prefix + '*'
+    # Keep leading identifier segments, replace the first variable one and the rest
+    segments = key.split(ANALYZER_DELIMITER)
+    kept = []
+    for segment in segments:
+        if not segment or not segment.replace('_', '').replace('-', '').isalpha():
+            return ANALYZER_DELIMITER.join(kept + ['*'])
+        kept.append(segment)
+    return key if len(segments) == 1 else ANALYZER_DELIMITER.join(kept[:-1] + ['*'])
+
+def command_shape(args):
+    """Normalize a command's arguments into a shape such as 'HGETALL thumbor:detectors:*'"""
+    if not args:
+        return '(empty)'
+    cmd = args[0].upper()
+    if cmd in SUBCOMMAND_COMMANDS and len(args) > 1:
+        return f'{cmd} {args[1].upper()}'
+    if cmd in KEYLESS_COMMANDS or len(args) == 1:
+        return cmd
+    return f'{cmd} {key_shape(args[1])}'
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, max(math.ceil(fraction * len(sorted_values)) - 1, 0))]
+
+class SlowlogTracker:
+    """Incrementally collects SLOWLOG and LATENCY HISTORY entries from Redis"""
+
+    def __init__(self, capacity=SLOWLOG_HISTORY):
+        self.entries = deque(maxlen=capacity)
+        self.latency = {}
+        self.last_id = None
+        self.missed = 0
+        self._lock = threading.Lock()
+
+    def refresh(self, r):
+        """Pull slowlog entries newer than the last seen ID and new latency samples"""
+        raw = r.execute_command('SLOWLOG', 'GET', SLOWLOG_FETCH)
+        latest = r.execute_command('LATENCY', 'LATEST')
+        history = {}
+        for event, *_ in latest:
+            event = event.decode() if isinstance(event, bytes) else event
+            history[event] = r.execute_command('LATENCY', 'HISTORY', event)
+
+        with self._lock:
+            # SLOWLOG GET returns newest first
+            ids = [item[0] for item in raw]
+            if ids and self.last_id is not None and max(ids) < self.last_id:
+                # SLOWLOG RESET or a Redis restart: IDs start over
+                self.last_id = None
+            new = [item for item in raw if self.last_id is None or item[0] > self.last_id]
+            if new and self.last_id is not None:
+                self.missed += max(min(item[0] for item in new) - self.last_id - 1, 0)
+            for item in reversed(new):
+                args = item[3] if isinstance(item[3], list) else item[4]
+                args = [a.decode('utf-8', errors='replace') if isinstance(a, bytes) else str(a) for a in args]
+                client = item[4] if len(item) > 4 and isinstance(item[3], list) else None
+                self.entries.append({
+                    'id': item[0],
+                    'time': int(item[1]),
+                    'duration_us': int(item[2]),
+                    'command': ' '.join(args),
+                    'shape': command_shape(args),
+                    'client': client.decode('utf-8', errors='replace') if isinstance(client, bytes) else client,
+                })
+            if ids:
+                self.last_id = max(ids + ([self.last_id] if self.last_id is not None else []))
+
+            for event, samples in history.items():
+                known = self.latency.setdefault(event, deque(maxlen=LATENCY_HISTORY))
+                last_seen = known[-1][0] if known else 0
+                for timestamp, latency_ms in samples:
+                    if timestamp > last_seen:
+                        known.append((int(timestamp), int(latency_ms)))
+        return [
+            {'event': (e[0].decode() if isinstance(e[0], bytes) else e[0]), 'time': int(e[1]),
+             'latest_ms': int(e[2]), 'max_ms': int(e[3])}
+            for e in latest
+        ]
+
+    def shapes(self):
+        """Aggregate the collected slowlog entries into count, p50, p99 and max per shape"""
+        with self._lock:
+            entries = list(self.entries)
+        grouped = {}
+        for entry in entries:
+            grouped.setdefault(entry['shape'], []).append(entry)
+        report = []
+        for shape, items in grouped.items():
+            durations = sorted(item['duration_us'] for item in items)
+            report.append({
+                'shape': shape,
+                'count': len(items),
+                'p50_us': percentile(durations, 0.5),
+                'p99_us': percentile(durations, 0.99),
+                'max_us': durations[-1],
+                'total_us': sum(durations),
+                'last_seen': max(item['time'] for item in items),
+            })
+        report.sort(key=lambda shape: shape['total_us'], reverse=True)
+        return report
+
+slowlog_tracker = SlowlogTracker()
+
 # HTML template for the web interface
 HTML_TEMPLATE = """
 <!DOCTYPE html>
@@ -99,7 +1324,7 @@ HTML_TEMPLATE = """
             gap: 10px;
             margin-bottom: 20px;
         }
-        input[type="text"], textarea {
+        input[type="text"], textarea, select {
             flex: 1;
             padding: 10px;
             border: 1px solid #ddd;
@@ -140,6 +1365,7 @@ HTML_TEMPLATE = """
             transition: background 0.2s;
         }
         .key-item:hover { background: #e8e8e8; }
+        .keys-status { margin-top: 8px; font-size: 12px; color: #666; }
         .key-name {
             font-family: 'Courier New', monospace;
             font-size: 13px;
@@ -164,6 +1390,21 @@ HTML_TEMPLATE = """
             max-height: 300px;
             overflow-y: auto;
         }
+        .charts-grid {
+            display: grid;
+            grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
+            gap: 15px;
+        }
+        .chart { border: 1px solid #eee; border-radius: 4px; padding: 10px; }
+        .chart h3 { font-size: 0.8em; color: #666; text-transform: uppercase; margin-bottom: 6px; }
+        .chart svg { width: 100%; height: 80px; background: #fafafa; }
+        .chart polyline { fill: none; stroke: #667eea; stroke-width: 1.5; vector-effect: non-scaling-stroke; }
+        .chart-value { font-size: 13px; font-weight: bold; }
+        .report-table { width: 100%; border-collapse: collapse; font-size: 13px; margin-top: 10px; }
+        .report-table th, .report-table td { padding: 6px 8px; border-bottom: 1px solid #eee; text-align: left; }
+        .report-table th { color: #666; font-weight: 600; }
+        .report-table .key-name { font-size: 12px; }
+        .bounds { color: #999; font-size: 11px; }
         .error { color: #e53e3e; }
         .success { color: #38a169; }
         .loading { opacity: 0.5; }
@@ -202,12 +1443,75 @@ HTML_TEMPLATE = """
             <h2>🔍 Browse Keys</h2>
             <div class="search-box">
                 <input type="text" id="keyPattern" placeholder="Enter pattern (e.g., *, user:*, *cache*)" value="*">
+                <select id="keyType">
+                    <option value="">All types</option>
+                    <option value="string">string</option>
+                    <option value="list">list</option>
+                    <option value="set">set</option>
+                    <option value="zset">zset</option>
+                    <option value="hash">hash</option>
+                    <option value="stream">stream</option>
+                </select>
                 <button onclick="searchKeys()">Search</button>
                 <button onclick="refreshKeys()">Refresh</button>
             </div>
-            <div id="keysResult" class="keys-list">
+            <div id="keysResult" class="keys-list" onscroll="onKeysScroll()">
                 <p>Enter a pattern and click Search to list keys</p>
             </div>
+            <p id="keysStatus" class="keys-status"></p>
+        </div>
+
+        <div class="section">
+            <h2>🧵 RemoteCV Queue</h2>
+            <div class="stats-grid">
+                <div class="stat-card"><h3>Queue Depth</h3><div class="value" id="queueDepth">-</div></div>
+                <div class="stat-card"><h3>Enqueue / Dequeue per sec</h3><div class="value" id="queueRates">-</div></div>
+                <div class="stat-card"><h3>Oldest Job Age</h3><div class="value" id="queueOldest">-</div></div>
+                <div class="stat-card"><h3>Time to Drain</h3><div class="value" id="queueEta">-</div></div>
+            </div>
+            <div class="charts-grid">
+                <div class="chart"><h3>Queue depth</h3><svg id="chartQueueDepth" viewBox="0 0 300 80" preserveAspectRatio="none"></svg></div>
+                <div class="chart"><h3>Dequeue rate</h3><svg id="chartQueueDequeue" viewBox="0 0 300 80" preserveAspectRatio="none"></svg></div>
+            </div>
+            <div id="queueWorkers"></div>
+            <div id="queuePool"></div>
+        </div>
+
+        <div class="section">
+            <h2>📈 Metrics History</h2>
+            <div class="search-box">
+                <select id="metricsRange" onchange="loadMetrics()" style="flex: 0 0 160px;">
+                    <option value="15">Last 15 minutes</option>
+                    <option value="60" selected>Last hour</option>
+                    <option value="360">Last 6 hours</option>
+                </select>
+                <span id="metricsSummary" class="keys-status"></span>
+            </div>
+            <div class="charts-grid">
+                <div class="chart"><h3>Ops/sec</h3><svg id="chartOps" viewBox="0 0 300 80" preserveAspectRatio="none"></svg><span class="chart-value" id="valueOps">-</span></div>
+                <div class="chart"><h3>Hit ratio</h3><svg id="chartHits" viewBox="0 0 300 80" preserveAspectRatio="none"></svg><span class="chart-value" id="valueHits">-</span></div>
+                <div class="chart"><h3>Evicted keys/sec</h3><svg id="chartEvicted" viewBox="0 0 300 80" preserveAspectRatio="none"></svg><span class="chart-value" id="valueEvicted">-</span></div>
+                <div class="chart"><h3>Used memory</h3><svg id="chartMemory" viewBox="0 0 300 80" preserveAspectRatio="none"></svg><span class="chart-value" id="valueMemory">-</span></div>
+            </div>
+        </div>
+
+        <div class="section">
+            <h2>🐢 Slow Log &amp; Latency</h2>
+            <div class="search-box">
+                <button onclick="loadSlowlog()">Refresh</button>
+                <span id="slowlogSummary" class="keys-status"></span>
+            </div>
+            <div id="slowlogResult"></div>
+        </div>
+
+        <div class="section">
+            <h2>📊 Memory Analyzer</h2>
+            <div class="search-box">
+                <input type="text" id="analyzerPrefixes" placeholder="Prefixes, comma separated (default: server configuration)">
+                <input type="text" id="analyzerSampleSize" placeholder="Sample size" value="10000" style="flex: 0 0 140px;">
+                <button onclick="analyzeMemory()">Analyze</button>
+            </div>
+            <div id="analyzerResult"></div>
         </div>
 
         <div class="section">
@@ -215,8 +1519,10 @@ HTML_TEMPLATE = """
             <div class="search-box">
                 <input type="text" id="command" placeholder="Enter Redis command (e.g., GET mykey, INFO server)">
                 <button onclick="executeCommand()">Execute</button>
+                <button onclick="loadAudit()">Audit Log</button>
             </div>
             <div id="commandResult"></div>
+            <div id="auditResult"></div>
         </div>
 
         <div class="section">
@@ -229,6 +1535,24 @@ HTML_TEMPLATE = """
             <div id="setResult"></div>
         </div>
 
+        <div class="section">
+            <h2>🧹 Bulk Delete / Expire</h2>
+            <div class="search-box">
+                <input type="text" id="bulkPattern" placeholder="Pattern (e.g., thumbor:detectors:bucket:* or thumbor-detector-*example.com*)">
+                <select id="bulkAction" style="flex: 0 0 120px;">
+                    <option value="unlink">UNLINK</option>
+                    <option value="expire">EXPIRE</option>
+                    <option value="persist">PERSIST</option>
+                </select>
+                <input type="text" id="bulkSeconds" placeholder="EXPIRE seconds" style="flex: 0 0 130px;">
+                <input type="text" id="bulkRate" placeholder="Max ops/sec" value="5000" style="flex: 0 0 110px;">
+            </div>
+            <button onclick="startBulkJob(true)">Dry Run</button>
+            <button class="danger" onclick="startBulkJob(false)">Run</button>
+            <button onclick="cancelBulkJob()">Cancel</button>
+            <div id="bulkResult"></div>
+        </div>
+
         <div class="section">
             <h2>⚠️ Danger Zone</h2>
             <p style="margin-bottom: 15px; color: #666;">Use these operations with caution</p>
@@ -258,7 +1582,10 @@ HTML_TEMPLATE = """
         }
 
         async function loadStats() {
-            const stats = await fetchAPI('/stats');
+            renderStats(await fetchAPI('/stats'));
+        }
+
+        function renderStats(stats) {
             if (!stats.error) {
                 document.getElementById('status').textContent = 'Connected';
                 document.getElementById('status').style.color = '#38a169';
@@ -271,33 +1598,79 @@ HTML_TEMPLATE = """
             }
         }
 
-        async function searchKeys() {
+        // Key browser state: SCAN cursor of the next page (0 when the scan is complete)
+        let keysCursor = 0;
+        let keysLoaded = 0;
+        let keysLoading = false;
+        let keysComplete = true;
+
+        function renderKeyItem(key) {
+            return `
+                <div class="key-item">
+                    <span class="key-name">${key.key}</span>
+                    <div>
+                        <span class="key-type">${key.type}</span>
+                        <button onclick="getKey('${key.key}')">View</button>
+                        <button class="danger" onclick="deleteKey('${key.key}')">Delete</button>
+                    </div>
+                </div>
+            `;
+        }
+
+        async function loadKeysPage() {
+            if (keysLoading || keysComplete) return;
+            keysLoading = true;
+
             const pattern = document.getElementById('keyPattern').value || '*';
+            const keyType = document.getElementById('keyType').value;
             const result = document.getElementById('keysResult');
-            result.innerHTML = '<p class="loading">Searching...</p>';
+            const status = document.getElementById('keysStatus');
 
-            const response = await fetchAPI('/keys?pattern=' + encodeURIComponent(pattern));
+            let query = '/keys?pattern=' + encodeURIComponent(pattern) + '&cursor=' + keysCursor;
+            if (keyType) query += '&type=' + encodeURIComponent(keyType);
+            const response = await fetchAPI(query);
 
             if (!response.error) {
-                if (response.keys.length === 0) {
+                if (keysLoaded === 0) result.innerHTML = '';
+                result.insertAdjacentHTML('beforeend', response.keys.map(renderKeyItem).join(''));
+                keysLoaded += response.keys.length;
+                keysCursor = response.cursor;
+                keysComplete = response.complete;
+                if (keysLoaded === 0 && keysComplete) {
                     result.innerHTML = '<p>No keys found</p>';
-                } else {
-                    result.innerHTML = response.keys.map(key => `
-                        <div class="key-item">
-                            <span class="key-name">${key.key}</span>
-                            <div>
-                                <span class="key-type">${key.type}</span>
-                                <button onclick="getKey('${key.key}')">View</button>
-                                <button class="danger" onclick="deleteKey('${key.key}')">Delete</button>
-                            </div>
-                        </div>
-                    `).join('');
                 }
+                status.textContent = `${keysLoaded} keys loaded` + (keysComplete ? ' (scan complete)' : ' (scroll for more)');
             } else {
+                keysComplete = true;
                 result.innerHTML = `<p class="error">Error: ${response.error}</p>`;
+                status.textContent = '';
+            }
+            keysLoading = false;
+
+            // Keep fetching while the list is too short to scroll
+            if (!keysComplete && result.scrollHeight <= result.clientHeight) {
+                loadKeysPage();
+            }
+        }
+
+        function onKeysScroll() {
+            const result = document.getElementById('keysResult');
+            if (result.scrollTop + result.clientHeight >= result.scrollHeight - 50) {
+                loadKeysPage();
             }
         }
 
+        async function searchKeys() {
+            const result = document.getElementById('keysResult');
+            result.innerHTML = '<p class="loading">Searching...</p>';
+            document.getElementById('keysStatus').textContent = '';
+
+            keysCursor = 0;
+            keysLoaded = 0;
+            keysComplete = false;
+            await loadKeysPage();
+        }
+
         async function refreshKeys() {
             searchKeys();
         }
@@ -320,6 +1693,211 @@ HTML_TEMPLATE = """
             }
         }
 
+        function drawChart(id, values) {
+            const points = values.map((v, i) => [i, v]).filter(([, v]) => v !== null);
+            const svg = document.getElementById(id);
+            if (points.length < 2) {
+                svg.innerHTML = '';
+                return;
+            }
+            const max = Math.max(...points.map(([, v]) => v));
+            const min = Math.min(...points.map(([, v]) => v));
+            const span = (max - min) || 1;
+            const last = values.length - 1 || 1;
+            const coords = points.map(([i, v]) =>
+                `${(i / last * 300).toFixed(1)},${(78 - (v - min) / span * 76).toFixed(1)}`
+            ).join(' ');
+            svg.innerHTML = `<polyline points="${coords}"></polyline>`;
+        }
+
+        function lastValue(values) {
+            for (let i = values.length - 1; i >= 0; i--) {
+                if (values[i] !== null) return values[i];
+            }
+            return null;
+        }
+
+        async function loadMetrics() {
+            const minutes = document.getElementById('metricsRange').value;
+            const history = await fetchAPI('/metrics/history?minutes=' + minutes);
+            const summary = document.getElementById('metricsSummary');
+            if (history.error) {
+                summary.innerHTML = `<span class="error">Error: ${history.error}</span>`;
+                return;
+            }
+            const s = history.series;
+            drawChart('chartOps', s.ops_per_sec);
+            drawChart('chartHits', s.hit_ratio);
+            drawChart('chartEvicted', s.evicted_per_sec);
+            drawChart('chartMemory', s.used_memory);
+
+            const ops = lastValue(s.ops_per_sec);
+            const hits = lastValue(s.hit_ratio);
+            const evicted = lastValue(s.evicted_per_sec);
+            const memory = lastValue(s.used_memory);
+            document.getElementById('valueOps').textContent = ops === null ? '-' : ops.toFixed(1);
+            document.getElementById('valueHits').textContent = hits === null ? '-' : (hits * 100).toFixed(1) + '%';
+            document.getElementById('valueEvicted').textContent = evicted === null ? '-' : evicted.toFixed(2);
+            document.getElementById('valueMemory').textContent = memory === null ? '-' : formatBytes(memory);
+            const trend = history.used_memory_trend * 3600;
+            summary.textContent = `${history.samples} samples every ${history.interval}s, memory trend ${trend >= 0 ? '+' : '-'}${formatBytes(Math.abs(trend))}/h`;
+        }
+
+        function formatSeconds(seconds) {
+            if (seconds === null || seconds === undefined) return '-';
+            if (seconds < 60) return seconds.toFixed(0) + 's';
+            if (seconds < 3600) return (seconds / 60).toFixed(1) + 'm';
+            return (seconds / 3600).toFixed(1) + 'h';
+        }
+
+        async function loadQueue() {
+            const queue = await fetchAPI('/queue');
+            const workers = document.getElementById('queueWorkers');
+            if (queue.error) {
+                workers.innerHTML = `<p class="error">Error: ${queue.error}</p>`;
+                return;
+            }
+            const rate = v => v === null ? '-' : v.toFixed(2);
+            document.getElementById('queueDepth').textContent = queue.depth;
+            document.getElementById('queueRates').textContent = `${rate(queue.enqueue_rate)} / ${rate(queue.dequeue_rate)}`;
+            document.getElementById('queueOldest').textContent = queue.oldest_job ? formatSeconds(queue.oldest_job.age) : '-';
+            document.getElementById('queueEta').textContent = queue.eta_seconds === null ? 'growing' : formatSeconds(queue.eta_seconds);
+            drawChart('chartQueueDepth', queue.series.depth);
+            drawChart('chartQueueDequeue', queue.series.dequeue_rate);
+
+            const rows = queue.workers.map(w => `
+                <tr>
+                    <td class="key-name">${w.worker}</td>
+                    <td class="key-name">${w.args ? JSON.stringify(w.args) : 'idle'}</td>
+                    <td>${formatSeconds(w.running_for)}</td>
+                    <td>${w.processed}</td>
+                    <td>${w.failed}</td>
+                    <td>${w.stuck ? `<span class="error">stuck (&gt; ${queue.timeout_seconds}s)</span>` : ''}</td>
+                </tr>
+            `).join('');
+            workers.innerHTML = `
+                <p class="keys-status">${queue.busy_workers} busy of ${queue.workers.length} workers, ${queue.stuck_jobs} stuck</p>
+                <table class="report-table">
+                    <tr><th>Worker</th><th>Job</th><th>Running for</th><th>Processed</th><th>Failed</th><th></th></tr>
+                    ${rows || '<tr><td colspan="6">No registered workers</td></tr>'}
+                </table>
+            `;
+
+            const pool = document.getElementById('queuePool');
+            if (!queue.pool) {
+                pool.innerHTML = '<p class="keys-status">Worker pool controller not running</p>';
+                return;
+            }
+            const throughput = queue.pool.workers.map(w => `
+                <tr><td class="key-name">${w.worker || w.pid}</td><td>${formatSeconds(w.uptime)}</td><td>${rate(w.jobs_per_sec)}</td></tr>
+            `).join('');
+            const decisions = queue.pool.decisions.map(d => `
+                <tr>
+                    <td>${new Date(d.timestamp * 1000).toLocaleTimeString()}</td>
+                    <td>${d.from} → ${d.to}</td>
+                    <td>${d.reason}</td>
+                    <td>${d.depth}</td>
+                    <td>${rate(d.enqueue_rate)} / ${rate(d.dequeue_rate)}</td>
+                </tr>
+            `).join('');
+            pool.innerHTML = `
+                <p class="keys-status">Pool: ${queue.pool.size} workers (target ${queue.pool.target}, min ${queue.pool.min}, max ${queue.pool.max}), ${queue.pool.restarts} restarts</p>
+                <table class="report-table">
+                    <tr><th>Pool worker</th><th>Uptime</th><th>Jobs/sec</th></tr>
+                    ${throughput}
+                </table>
+                <table class="report-table">
+                    <tr><th>Time</th><th>Scale</th><th>Reason</th><th>Depth</th><th>Enqueue / Dequeue per sec</th></tr>
+                    ${decisions || '<tr><td colspan="5">No scale decisions yet</td></tr>'}
+                </table>
+            `;
+        }
+
+        function formatBytes(bytes) {
+            const units = ['B', 'KB', 'MB', 'GB'];
+            let i = 0;
+            while (bytes >= 1024 && i < units.length - 1) { bytes /= 1024; i++; }
+            return bytes.toFixed(i ? 1 : 0) + units[i];
+        }
+
+        async function loadSlowlog() {
+            const report = await fetchAPI('/slowlog');
+            const result = document.getElementById('slowlogResult');
+            const summary = document.getElementById('slowlogSummary');
+            if (report.error) {
+                result.innerHTML = `<p class="error">Error: ${report.error}</p>`;
+                return;
+            }
+            summary.textContent = `${report.collected} slowlog entries collected` +
+                (report.missed ? `, ${report.missed} missed between refreshes` : '') +
+                (report.latency_monitor_threshold_ms === 0 ? ' (latency monitor disabled: CONFIG SET latency-monitor-threshold <ms>)' : '');
+
+            const shapes = report.shapes.map(s => `
+                <tr>
+                    <td class="key-name">${s.shape}</td>
+                    <td>${s.count}</td>
+                    <td>${(s.p50_us / 1000).toFixed(2)} ms</td>
+                    <td>${(s.p99_us / 1000).toFixed(2)} ms</td>
+                    <td>${(s.max_us / 1000).toFixed(2)} ms</td>
+                    <td>${new Date(s.last_seen * 1000).toLocaleString()}</td>
+                </tr>
+            `).join('');
+            const events = report.latency_latest.map(e => `
+                <tr>
+                    <td>${e.event}</td>
+                    <td>${e.latest_ms} ms</td>
+                    <td>${e.max_ms} ms</td>
+                    <td>${new Date(e.time * 1000).toLocaleString()}</td>
+                </tr>
+            `).join('');
+            result.innerHTML = `
+                <table class="report-table">
+                    <tr><th>Command shape</th><th>Count</th><th>p50</th><th>p99</th><th>Max</th><th>Last seen</th></tr>
+                    ${shapes || '<tr><td colspan="6">No slowlog entries</td></tr>'}
+                </table>
+                <table class="report-table">
+                    <tr><th>Latency event</th><th>Latest</th><th>Max</th><th>Time</th></tr>
+                    ${events || '<tr><td colspan="4">No latency events</td></tr>'}
+                </table>
+            `;
+        }
+
+        async function analyzeMemory() {
+            const prefixes = document.getElementById('analyzerPrefixes').value;
+            const sampleSize = document.getElementById('analyzerSampleSize').value || '10000';
+            const result = document.getElementById('analyzerResult');
+            result.innerHTML = '<p class="loading">Sampling keyspace...</p>';
+
+            let query = '/memory/analyze?sample_size=' + encodeURIComponent(sampleSize);
+            if (prefixes) query += '&prefixes=' + encodeURIComponent(prefixes);
+            const report = await fetchAPI(query);
+
+            if (report.error) {
+                result.innerHTML = `<p class="error">Error: ${report.error}</p>`;
+                return;
+            }
+
+            const rows = report.groups.map(g => `
+                <tr>
+                    <td class="key-name">${g.group}</td>
+                    <td>${g.keys.estimate}<br><span class="bounds">${g.keys.low} – ${g.keys.high}</span></td>
+                    <td>${formatBytes(g.bytes.estimate)}<br><span class="bounds">${formatBytes(g.bytes.low)} – ${formatBytes(g.bytes.high)}</span></td>
+                    <td>${(g.no_ttl_ratio * 100).toFixed(1)}%</td>
+                    <td>${Object.entries(g.ttl_histogram).filter(([, n]) => n).map(([b, n]) => `${b}: ${n}`).join(', ') || '-'}</td>
+                </tr>
+            `).join('');
+
+            result.innerHTML = `
+                <p>Sampled ${report.sampled} of ${report.population} keys in ${report.elapsed}s${report.complete ? ' (full scan)' : ''}.
+                   Memory ${report.used_memory_human} / ${report.maxmemory ? formatBytes(report.maxmemory) : 'unlimited'}
+                   (${report.maxmemory_policy}), evicted keys: ${report.evicted_keys}</p>
+                <table class="report-table">
+                    <tr><th>Group</th><th>Keys (95% bounds)</th><th>Memory (95% bounds)</th><th>No TTL</th><th>Sampled TTL histogram</th></tr>
+                    ${rows}
+                </table>
+            `;
+        }
+
         async function executeCommand() {
             const command = document.getElementById('command').value;
             if (!command) return;
@@ -330,12 +1908,39 @@ HTML_TEMPLATE = """
             const response = await fetchAPI('/execute', 'POST', { command });
 
             if (!response.error) {
-                result.innerHTML = `<div class="result-box">${JSON.stringify(response.result, null, 2)}</div>`;
+                const note = response.rewritten
+                    ? `<p class="keys-status">Rewritten to ${response.rewritten} to protect Redis</p>` : '';
+                result.innerHTML = note + `<div class="result-box">${JSON.stringify(response.result, null, 2)}</div>` +
+                    `<p class="keys-status">${response.duration_ms} ms</p>`;
             } else {
                 result.innerHTML = `<p class="error">Error: ${response.error}</p>`;
             }
         }
 
+        async function loadAudit() {
+            const audit = await fetchAPI('/execute/audit?limit=50');
+            const result = document.getElementById('auditResult');
+            if (audit.error) {
+                result.innerHTML = `<p class="error">Error: ${audit.error}</p>`;
+                return;
+            }
+            const rows = audit.entries.map(e => `
+                <tr>
+                    <td>${new Date(e.time * 1000).toLocaleTimeString()}</td>
+                    <td class="key-name">${e.command}</td>
+                    <td>${e.status}</td>
+                    <td>${e.duration_ms} ms</td>
+                    <td>${e.detail || ''}</td>
+                </tr>
+            `).join('');
+            result.innerHTML = `
+                <table class="report-table">
+                    <tr><th>Time</th><th>Command</th><th>Status</th><th>Duration</th><th>Detail</th></tr>
+                    ${rows}
+                </table>
+            `;
+        }
+
         async function setKeyValue() {
             const key = document.getElementById('setKey').value;
             const value = document.getElementById('setValue').value;
@@ -359,6 +1964,60 @@ HTML_TEMPLATE = """
             }
         }
 
+        let bulkJobId = null;
+        let bulkTimer = null;
+
+        function renderBulkJob(job) {
+            const result = document.getElementById('bulkResult');
+            if (job.error) {
+                result.innerHTML = `<p class="error">Error: ${job.error}</p>`;
+                return;
+            }
+            const outcome = job.dry_run
+                ? `${job.matched} keys matched, ${formatBytes(job.bytes)}`
+                : `${job.matched} keys matched, ${job.applied} ${job.action} applied`;
+            result.innerHTML = `<div class="result-box">Job ${job.id} (${job.action}${job.dry_run ? ', dry run' : ''}): ${job.status}
+${outcome}
+${job.scanned_pages} SCAN pages in ${job.elapsed}s</div>`;
+        }
+
+        async function pollBulkJob() {
+            const job = await fetchAPI('/bulk/' + bulkJobId);
+            renderBulkJob(job);
+            if (job.error || job.status !== 'running') {
+                clearInterval(bulkTimer);
+                bulkTimer = null;
+                loadStats();
+            }
+        }
+
+        async function startBulkJob(dryRun) {
+            const pattern = document.getElementById('bulkPattern').value;
+            const action = document.getElementById('bulkAction').value;
+            const seconds = document.getElementById('bulkSeconds').value;
+            const rate = document.getElementById('bulkRate').value || '5000';
+            if (!pattern) {
+                alert('Please enter a pattern');
+                return;
+            }
+            if (!dryRun && !confirm(`Apply ${action.toUpperCase()} to every key matching ${pattern}?`)) return;
+
+            const body = { pattern, action, dry_run: dryRun, max_ops_per_sec: parseInt(rate, 10) };
+            if (seconds) body.seconds = parseInt(seconds, 10);
+            const job = await fetchAPI('/bulk', 'POST', body);
+            renderBulkJob(job);
+            if (!job.error) {
+                bulkJobId = job.id;
+                if (bulkTimer) clearInterval(bulkTimer);
+                bulkTimer = setInterval(pollBulkJob, 1000);
+            }
+        }
+
+        async function cancelBulkJob() {
+            if (!bulkJobId) return;
+            renderBulkJob(await fetchAPI('/bulk/' + bulkJobId + '/cancel', 'POST'));
+        }
+
         async function flushDB() {
             if (!confirm('Are you sure you want to flush the current database? This cannot be undone!')) return;
 
@@ -388,9 +2047,24 @@ HTML_TEMPLATE = """
             }
         }
 
-        // Load stats on page load and refresh every 5 seconds
-        loadStats();
-        setInterval(loadStats, 5000);
+        // Stats are pushed by the server with Server-Sent Events; fall back to
+        // polling every 5 seconds when EventSource is not available
+        function startStats() {
+            if (!window.EventSource) {
+                loadStats();
+                setInterval(loadStats, 5000);
+                return;
+            }
+            const source = new EventSource(API_BASE + '/stats/stream');
+            source.onmessage = event => renderStats(JSON.parse(event.data));
+            source.onerror = () => renderStats({ error: 'Stats stream disconnected' });
+        }
+
+        startStats();
+        loadMetrics();
+        setInterval(loadMetrics, 10000);
+        loadQueue();
+        setInterval(loadQueue, 10000);
     </script>
 </body>
 </html>
@@ -402,87 +2076,280 @@ def index():
     """Serve the main HTML interface"""
     return render_template_string(HTML_TEMPLATE)
 
+def compute_stats():
+    """Query the INFO sections used by the dashboard and DBSIZE in one round-trip"""
+    r = get_redis_connection()
+    pipe = r.pipeline(transaction=False)
+    for section in STATS_INFO_SECTIONS:
+        pipe.info(section)
+    pipe.dbsize()
+    results = pipe.execute()
+
+    info = {}
+    for section in results[:-1]:
+        info.update(section)
+
+    # Extract key statistics
+    return {
+        'redis_version': info.get('redis_version', 'Unknown'),
+        'uptime_days': info.get('uptime_in_days', 0),
+        'connected_clients': info.get('connected_clients', 0),
+        'used_memory': info.get('used_memory', 0),
+        'used_memory_human': info.get('used_memory_human', '0B'),
+        'memory_human': info.get('used_memory_human', '0B'),
+        'db_keys': results[-1],
+        'total_commands_processed': info.get('total_commands_processed', 0),
+        'sampled_at': time.time(),
+    }
+
+def get_cached_stats():
+    """Get dashboard stats, shared across clients for STATS_INTERVAL seconds"""
+    return stats_cache.get('stats', compute_stats)
+
 @app.route('/redis-admin/api/stats')
 def get_stats():
     """Get Redis server statistics"""
     try:
+        return jsonify(get_cached_stats())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/redis-admin/api/stats/stream')
+def stream_stats():
+    """Push Redis server statistics to the client with Server-Sent Events"""
+    def generate():
+        yield f'retry: {int(STATS_INTERVAL * 1000)}\n\n'
+        while True:
+            try:
+                payload = get_cached_stats()
+            except Exception as e:
+                payload = {'error': str(e)}
+            yield f'data: {json.dumps(payload)}\n\n'
+            time.sleep(STATS_INTERVAL)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/redis-admin/api/metrics/history')
+def get_metrics_history():
+    """Get ops/sec, hit ratio, eviction rate and memory trend from the metrics history"""
+    try:
+        start_metrics_sampler()
+        minutes = float(request.args.get('minutes', 60))
+        max_points = min(int(request.args.get('points', 300)), METRICS_MAX_POINTS)
+        if minutes <= 0 or max_points < 1:
+            return jsonify({'error': 'minutes and points must be positive'}), 400
+
+        samples = metrics_history.snapshot(since=time.time() - minutes * 60)
+        series = derive_rates(samples, max_points)
+        return jsonify({
+            'interval': METRICS_INTERVAL,
+            'capacity': metrics_history.capacity,
+            'samples': len(samples['timestamp']),
+            'series': series,
+            'used_memory_trend': memory_trend(samples['timestamp'], samples['used_memory']),
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/redis-admin/api/slowlog')
+def get_slowlog():
+    """Get slowlog entries aggregated by command shape and latency monitor events"""
+    try:
+        latest = stats_cache.get(
+            'slowlog', lambda: slowlog_tracker.refresh(get_raw_redis_connection())
+        )
+        try:
+            threshold = get_redis_connection().config_get('latency-monitor-threshold')
+            threshold = int(threshold.get('latency-monitor-threshold', 0))
+        except redis.ResponseError:
+            # CONFIG can be renamed or disabled on managed Redis
+            threshold = None
+        recent = list(slowlog_tracker.entries)[::-1][:int(request.args.get('limit', 50))]
+        return jsonify({
+            'shapes': slowlog_tracker.shapes(),
+            'recent': recent,
+            'collected': len(slowlog_tracker.entries),
+            'last_id': slowlog_tracker.last_id,
+            'missed': slowlog_tracker.missed,
+            'latency_latest': latest,
+            'latency_history': {
+                event: [list(sample) for sample in samples]
+                for event, samples in slowlog_tracker.latency.items()
+            },
+            'latency_monitor_threshold_ms': threshold,
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/redis-admin/api/queue')
+def get_queue_status():
+    """Get RemoteCV detector queue depth, rates, drain estimate and stuck jobs"""
+    try:
+        start_metrics_sampler()
+        minutes = float(request.args.get('minutes', 60))
+        now = time.time()
+        r = get_redis_connection()
+        depth, oldest_job, workers = inspect_queue(r, now)
+        pool = pool_status(r)
+
+        series = queue_rates(queue_history.snapshot(since=now - minutes * 60))
+        recent = [i for i, t in enumerate(series['timestamp']) if t >= now - QUEUE_RATE_WINDOW]
+        enqueue_rate = average_rate([series['enqueue_rate'][i] for i in recent])
+        dequeue_rate = average_rate([series['dequeue_rate'][i] for i in recent])
+
+        # Time to drain at the current net rate; None while the queue is growing
+        eta = None
+        if depth == 0:
+            eta = 0
+        elif enqueue_rate is not None and dequeue_rate is not None and dequeue_rate > enqueue_rate:
+            eta = round(depth / (dequeue_rate - enqueue_rate), 1)
+
+        detector_workers = [w for w in workers if w['queue'] in (None, DETECTOR_QUEUE_NAME)]
+        return jsonify({
+            'queue': DETECTOR_QUEUE_NAME,
+            'key': DETECTOR_QUEUE_KEY,
+            'depth': depth,
+            'oldest_job': oldest_job,
+            'enqueue_rate': enqueue_rate,
+            'dequeue_rate': dequeue_rate,
+            'eta_seconds': eta,
+            'timeout_seconds': REMOTECV_TIMEOUT_SEC,
+            'workers': detector_workers,
+            'busy_workers': sum(1 for w in detector_workers if w['running_for'] is not None),
+            'stuck_jobs': sum(1 for w in detector_workers if w['stuck']),
+            'pool': pool,
+            'series': series,
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/redis-admin/api/memory/analyze')
+def analyze_memory():
+    """Estimate per-prefix key count, memory and TTL distribution from a keyspace sample"""
+    try:
+        prefixes = request.args.get('prefixes')
+        prefixes = [p.strip() for p in prefixes.split(',') if p.strip()] if prefixes else ANALYZER_PREFIXES
+        sample_size = min(int(request.args.get('sample_size', ANALYZER_SAMPLE_SIZE)), ANALYZER_SAMPLE_MAX)
+        time_budget = min(float(request.args.get('time_budget', ANALYZER_TIME_BUDGET)), 60.0)
+        if sample_size < 1 or time_budget <= 0:
+            return jsonify({'error': 'sample_size and time_budget must be positive'}), 400
+
         r = get_redis_connection()
-        info = r.info()
+        started = time.monotonic()
+        population = r.dbsize()
+        sample, complete = sample_keyspace(r, sample_size, time_budget)
+        info = r.info('memory')
+        evicted = r.info('stats').get('evicted_keys', 0)
 
-        # Extract key statistics
-        stats = {
-            'redis_version': info.get('redis_version', 'Unknown'),
-            'uptime_days': info.get('uptime_in_days', 0),
-            'connected_clients': info.get('connected_clients', 0),
+        return jsonify({
+            'population': population,
+            'sampled': len(sample),
+            'complete': complete,
+            'elapsed': round(time.monotonic() - started, 3),
+            'prefixes': prefixes,
             'used_memory': info.get('used_memory', 0),
             'used_memory_human': info.get('used_memory_human', '0B'),
-            'memory_human': info.get('used_memory_human', '0B'),
-            'db_keys': r.dbsize(),
-            'total_commands_processed': info.get('total_commands_processed', 0),
-        }
-        return jsonify(stats)
+            'maxmemory': info.get('maxmemory', 0),
+            'maxmemory_policy': info.get('maxmemory_policy', ''),
+            'evicted_keys': evicted,
+            'groups': analyze_sample(sample, population, prefixes),
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/redis-admin/api/keys')
 def get_keys():
-    """Get list of keys matching pattern"""
+    """Get one page of keys matching pattern, resumable through the SCAN cursor"""
     try:
         pattern = request.args.get('pattern', '*')
         limit = int(request.args.get('limit', 100))
+        cursor = int(request.args.get('cursor', 0))
+        count = min(int(request.args.get('count', SCAN_COUNT_DEFAULT)), SCAN_COUNT_MAX)
+        key_type = request.args.get('type', '').lower() or None
+        mode = request.args.get('mode', 'pipeline').lower()
+        try:
+            details = parse_key_details(request.args.get('details'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if mode not in ('pipeline', 'lua'):
+            return jsonify({'error': f'Unknown listing mode: {mode}'}), 400
+        if key_type and key_type not in KEY_TYPES:
+            return jsonify({'error': f'Unknown key type: {key_type}'}), 400
+        if cursor < 0 or count < 1 or limit < 1:
+            return jsonify({'error': 'cursor must be >= 0, count and limit must be >= 1'}), 400
 
         r = get_redis_connection()
         keys = []
 
-        # Use SCAN for better performance with large datasets
-        cursor = 0
-        count = 0
+        # Continue SCAN from the caller's cursor and stop once `limit` keys or
+        # SCAN_MAX_PAGES pages have been read. SCAN pages are never split, so the
+        # returned cursor resumes exactly after the last key in this response.
+        pages = 0
         while True:
-            cursor, partial_keys = r.scan(cursor, match=pattern, count=100)
-            for key in partial_keys:
-                if count >= limit:
-                    break
-                key_type = r.type(key)
-                keys.append({
-                    'key': key,
-                    'type': key_type
-                })
-                count += 1
-            if cursor == 0 or count >= limit:
+            if mode == 'lua':
+                cursor, page = scan_page_lua(r, cursor, pattern, count, key_type, details)
+                keys.extend(page)
+            else:
+                cursor, partial_keys = r.scan(cursor, match=pattern, count=count, _type=key_type)
+                keys.extend(describe_keys(r, partial_keys, details))
+            pages += 1
+            if cursor == 0 or len(keys) >= limit or pages >= SCAN_MAX_PAGES:
                 break
 
-        return jsonify({'keys': keys, 'total': len(keys)})
+        return jsonify({
+            'keys': keys,
+            'total': len(keys),
+            'cursor': cursor,
+            'complete': cursor == 0,
+            'mode': mode
+        })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/redis-admin/api/key/<path:key>')
 def get_key_value(key):
-    """Get value of a specific key"""
+    """Get value of a specific key, bounded by range/max_items and optionally streamed as NDJSON"""
     try:
-        r = get_redis_connection()
-        key_type = r.type(key)
-
-        if key_type == 'string':
-            value = r.get(key)
-        elif key_type == 'list':
-            value = r.lrange(key, 0, -1)
-        elif key_type == 'set':
-            value = list(r.smembers(key))
-        elif key_type == 'zset':
-            value = r.zrange(key, 0, -1, withscores=True)
-        elif key_type == 'hash':
-            value = r.hgetall(key)
-        else:
-            value = None
+        stream = request.args.get('stream', 'false').lower() in ('1', 'true', 'ndjson')
+        max_items = int(request.args.get('max_items', VALUE_MAX_ITEMS))
+        if max_items < 1:
+            return jsonify({'error': 'max_items must be >= 1'}), 400
 
-        ttl = r.ttl(key)
-
-        return jsonify({
-            'key': key,
-            'type': key_type,
-            'value': value,
-            'ttl': ttl
-        })
+        r = get_redis_connection()
+        meta = preflight_key(r, key)
+        key_type = meta['type']
+        size = meta['size'] or 0
+
+        # Strings are bounded in bytes, collections in items
+        if key_type == 'string' and 'max_items' not in request.args:
+            max_items = VALUE_MAX_BYTES
+        if request.args.get('range') and key_type not in ('string', 'list', 'zset'):
+            return jsonify({'error': f'range is not supported for {key_type} keys'}), 400
+        try:
+            start, stop = parse_value_range(request.args.get('range'), size)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        # Without an explicit range sorted sets are walked with ZSCAN
+        if key_type == 'zset' and not request.args.get('range'):
+            start, stop = 0, -1
+
+        selected = size if (start, stop) == (0, -1) else max(stop - start + 1, 0)
+        meta['truncated'] = min(size, selected) > max_items
+        batches = iter_value_items(key, key_type, start, stop, max_items)
+
+        if stream:
+            def generate():
+                yield json.dumps(meta) + '\n'
+                for batch in batches:
+                    yield ''.join(json.dumps(item) + '\n' for item in batch)
+            return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+        meta['value'] = collect_value(key_type, batches)
+        return jsonify(meta)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -549,21 +2416,105 @@ def execute_command():
         # Block dangerous commands in production
         dangerous_commands = ['FLUSHALL', 'FLUSHDB', 'CONFIG', 'SHUTDOWN', 'BGREWRITEAOF', 'BGSAVE', 'SAVE']
         if cmd in dangerous_commands and os.environ.get('REDIS_ADMIN_SAFE_MODE', 'false').lower() == 'true':
+            audit_command(cmd, args, 'rejected', 0, 'blocked in safe mode')
             return jsonify({'error': f'Command {cmd} is blocked in safe mode'}), 403
 
-        r = get_redis_connection()
+        r = get_execute_redis_connection()
+
+        started = time.monotonic()
+        try:
+            rewritten, run = plan_command(r, cmd, args)
+        except CommandRejected as e:
+            audit_command(cmd, args, 'rejected', time.monotonic() - started, str(e))
+            return jsonify({'error': str(e)}), 403
 
         # Execute command
-        result = r.execute_command(cmd, *args)
+        try:
+            result = run() if run else r.execute_command(cmd, *args)
+        except Exception as e:
+            audit_command(cmd, args, 'error', time.monotonic() - started, str(e))
+            raise
+        duration = time.monotonic() - started
+        audit_command(cmd, args, 'rewritten' if rewritten else 'ok', duration, rewritten)
 
         # Format result for display
         if isinstance(result, bytes):
             result = result.decode('utf-8')
+        elif isinstance(result, set):
+            result = list(result)
+
+        response = {'result': result, 'command': command, 'duration_ms': round(duration * 1000, 3)}
+        if rewritten:
+            response['rewritten'] = rewritten
+        return jsonify(response)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        return jsonify({'result': result, 'command': command})
+@app.route('/redis-admin/api/execute/audit')
+def get_execute_audit():
+    """Get the most recent console commands, newest first"""
+    limit = int(request.args.get('limit', 100))
+    entries = list(execute_audit)[::-1][:limit]
+    return jsonify({'entries': entries, 'capacity': EXECUTE_AUDIT_SIZE})
+
+@app.route('/redis-admin/api/bulk', methods=['POST'])
+def create_bulk_job():
+    """Start a bulk UNLINK/EXPIRE/PERSIST job (or a dry run) for keys matching a pattern"""
+    try:
+        data = request.json or {}
+        pattern = (data.get('pattern') or '').strip()
+        action = (data.get('action') or '').lower()
+        dry_run = bool(data.get('dry_run', False))
+        seconds = data.get('seconds')
+        max_ops_per_sec = int(data.get('max_ops_per_sec', BULK_MAX_OPS_PER_SEC))
+        batch_size = int(data.get('batch_size', BULK_BATCH_SIZE))
+
+        if not pattern:
+            return jsonify({'error': 'No pattern provided'}), 400
+        if action not in BULK_ACTIONS:
+            return jsonify({'error': f"action must be one of: {', '.join(BULK_ACTIONS)}"}), 400
+        if action == 'expire':
+            if seconds is None or int(seconds) < 1:
+                return jsonify({'error': 'expire requires seconds >= 1'}), 400
+            seconds = int(seconds)
+        if max_ops_per_sec < 1 or batch_size < 1:
+            return jsonify({'error': 'max_ops_per_sec and batch_size must be >= 1'}), 400
+        # A match-everything UNLINK is a FLUSHDB, which safe mode blocks
+        if (action == 'unlink' and not dry_run and pattern.strip('*') == ''
+                and os.environ.get('REDIS_ADMIN_SAFE_MODE', 'false').lower() == 'true'):
+            return jsonify({'error': 'Unlinking every key is blocked in safe mode'}), 403
+
+        job = BulkJob(pattern, action, seconds, dry_run, max_ops_per_sec, batch_size)
+        register_bulk_job(job)
+        job.start()
+        return jsonify(job.to_dict()), 202
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/redis-admin/api/bulk')
+def list_bulk_jobs():
+    """List recent bulk jobs"""
+    with bulk_jobs_lock:
+        jobs = sorted(bulk_jobs.values(), key=lambda j: j.created, reverse=True)
+    return jsonify({'jobs': [job.to_dict() for job in jobs]})
+
+@app.route('/redis-admin/api/bulk/<job_id>')
+def get_bulk_job(job_id):
+    """Get progress of a bulk job"""
+    job = bulk_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown job: {job_id}'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/redis-admin/api/bulk/<job_id>/cancel', methods=['POST'])
+def cancel_bulk_job(job_id):
+    """Cancel a running bulk job after its current batch"""
+    job = bulk_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': f'Unknown job: {job_id}'}), 404
+    job.cancel()
+    return jsonify(job.to_dict())
+
 @app.route('/redis-admin/api/flush-db', methods=['POST'])
 def flush_db():
     """Flush current database"""
@@ -584,21 +2535,72 @@ def flush_all():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/metrics')
+@app.route('/redis-admin/metrics')
+def prometheus_metrics():
+    """Prometheus metrics endpoint"""
+    return Response(generate_latest(REGISTRY), mimetype=CONTENT_TYPE_LATEST)
+
 @app.route('/redis-admin/health')
 def health_check():
     """Health check endpoint"""
     try:
-        r = get_redis_connection()
+        r = get_health_redis_connection()
         r.ping()
         return jsonify({'status': 'healthy', 'redis': 'connected'})
     except Exception as e:
         return jsonify({'status': 'unhealthy', 'error': str(e)}), 500
 
+class RequestTimeoutMiddleware:
+    """WSGI middleware that aborts requests running longer than timeout seconds.
+
+    Only effective under gevent, where the timeout interrupts blocking Redis
+    reads. Streaming bodies (SSE, NDJSON) are produced after the application
+    returns and are not cut off.
+    """
+
+    def __init__(self, wsgi_app, timeout):
+        self.wsgi_app = wsgi_app
+        self.timeout = timeout
+
+    def __call__(self, environ, start_response):
+        import gevent
+
+        try:
+            with gevent.Timeout(self.timeout):
+                return self.wsgi_app(environ, start_response)
+        except gevent.Timeout:
+            body = json.dumps({'error': f'Request exceeded {self.timeout:g}s timeout'}).encode()
+            start_response('504 Gateway Timeout', [
+                ('Content-Type', 'application/json'),
+                ('Content-Length', str(len(body)))
+            ])
+            return [body]
+
+def serve_gevent(port):
+    """Serve the app with gevent: one greenlet per request, bounded by MAX_CONCURRENT_REQUESTS"""
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIServer
+
+    server = WSGIServer(
+        ('0.0.0.0', port),
+        RequestTimeoutMiddleware(app.wsgi_app, REQUEST_TIMEOUT),
+        spawn=Pool(MAX_CONCURRENT_REQUESTS)
+    )
+    server.serve_forever()
+
 if __name__ == '__main__':
     port = int(os.environ.get('REDIS_ADMIN_PORT', 8888))
     debug = os.environ.get('REDIS_ADMIN_DEBUG', 'false').lower() == 'true'
 
-    print(f"Starting Redis Admin on port {port}")
+    start_metrics_sampler()
+
+    print(f"Starting Redis Admin on port {port} ({SERVER_MODE} server)")
     print(f"Redis connection: {REDIS_HOST}:{REDIS_PORT} DB:{REDIS_DB}")
 
-    app.run(host='0.0.0.0', port=port, debug=debug)
\ No newline at end of file
+    if SERVER_MODE == 'gevent':
+        print(f"Max concurrent requests: {MAX_CONCURRENT_REQUESTS}, "
+              f"Redis connections: {REDIS_MAX_CONNECTIONS}, request timeout: {REQUEST_TIMEOUT:g}s")
+        serve_gevent(port)
+    else:
+        app.run(host='0.0.0.0', port=port, debug=debug, threaded=True)
\ No newline at end of file
@@ -0,0 +1,360 @@
+#!/usr/bin/env python3.11
+"""
+RemoteCV Worker Pool Controller
+Runs several remotecv.worker processes under one supervisor program and
+scales them between a minimum and a maximum from the Detect queue depth
+and drain rate. Scale decisions are published to Redis for redis_admin.
+
+Usage:
+    remotecv_pool.py [--min N] [--max N] [--workers N] -- python3.11 -m remotecv.worker ...
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import signal
+import socket
+import argparse
+import subprocess
+from collections import deque
+import redis
+
+REDIS_HOST = os.environ.get('REDIS_SERVER_HOST', 'localhost')
+REDIS_PORT = int(os.environ.get('REDIS_SERVER_PORT', 6379))
+REDIS_DB = int(os.environ.get('REDIS_SERVER_DB', 0))
+
+DETECTOR_QUEUE_NAME = os.environ.get('REMOTECV_DETECTOR_QUEUE_NAME', 'Detect')
+DETECTOR_QUEUE_KEY = f'resque:queue:{DETECTOR_QUEUE_NAME}'
+RESQUE_PROCESSED_KEY = 'resque:stat:processed'
+RESQUE_FAILED_KEY = 'resque:stat:failed'
+RESQUE_WORKERS_KEY = 'resque:workers'
+
+# Keys read by redis_admin (/redis-admin/api/queue)
+POOL_STATE_KEY = 'remotecv:pool:state'
+POOL_DECISIONS_KEY = 'remotecv:pool:decisions'
+POOL_DECISIONS_KEEP = 200
+
+
+def available_cpus():
+    """CPUs this container may use: the affinity mask, capped by the cgroup
+    CPU quota (docker --cpus, Azure container limits), rounded up"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = period = None
+    try:
+        # cgroup v2: "<quota> <period>", quota "max" when unlimited
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            fields = f.read().split()
+        if fields[0] != 'max':
+            quota, period = int(fields[0]), int(fields[1])
+    except (OSError, ValueError, IndexError):
+        try:
+            # cgroup v1: quota -1 when unlimited
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+                quota = int(f.read())
+            with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+                period = int(f.read())
+        except (OSError, ValueError):
+            quota = period = None
+    if quota and quota > 0 and period and period > 0:
+        cpus = min(cpus, math.ceil(quota / period))
+    return max(cpus, 1)
+
+
+CPU_COUNT = available_cpus()
+POOL_MIN = int(os.environ.get('REMOTECV_POOL_MIN', 1))
+POOL_MAX = int(os.environ.get('REMOTECV_POOL_MAX', CPU_COUNT))
+POOL_WORKERS = int(os.environ.get('REMOTECV_POOL_WORKERS', CPU_COUNT))
+POOL_INTERVAL = float(os.environ.get('REMOTECV_POOL_INTERVAL', 5))
+# Seconds of samples the enqueue/dequeue rates are averaged over
+POOL_RATE_WINDOW = float(os.environ.get('REMOTECV_POOL_RATE_WINDOW', 30))
+# The backlog should drain within this many seconds, so queued smart crops
+# are detected before thumbor gives up on them after REMOTECV_TIMEOUT_SEC
+POOL_TARGET_DRAIN = float(os.environ.get('REMOTECV_POOL_TARGET_DRAIN',
+                                         os.environ.get('REMOTECV_TIMEOUT_SEC', 20)))
+# Seconds the pool must be oversized before one worker is removed
+POOL_SCALE_DOWN_DELAY = float(os.environ.get('REMOTECV_POOL_SCALE_DOWN_DELAY', 60))
+# Seconds a worker is given to finish its job before it is killed
+POOL_STOP_GRACE = float(os.environ.get('REMOTECV_POOL_STOP_GRACE', 30))
+
+DEFAULT_WORKER_COMMAND = [
+    sys.executable, '-m', 'remotecv.worker',
+    '--host', REDIS_HOST, '--port', str(REDIS_PORT), '--database', str(REDIS_DB),
+]
+
+
+def log(message):
+    """Print a timestamped log line"""
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} remotecv-pool: {message}", flush=True)
+
+
+class QueueSampler:
+    """Tracks queue depth and pyres job counters over a sliding window"""
+
+    def __init__(self, r, window):
+        self.r = r
+        self.window = window
+        self.samples = deque()
+
+    def sample(self, now=None):
+        """Read the queue length and job counters; returns the latest sample"""
+        now = now or time.time()
+        pipe = self.r.pipeline(transaction=False)
+        pipe.llen(DETECTOR_QUEUE_KEY)
+        pipe.get(RESQUE_PROCESSED_KEY)
+        pipe.get(RESQUE_FAILED_KEY)
+        depth, processed, failed = pipe.execute()
+        done = int(processed or 0) + int(failed or 0)
+        if self.samples and done < self.samples[-1][2]:
+            # pyres stats were reset; rates restart from here
+            self.samples.clear()
+        self.samples.append((now, depth, done))
+        while len(self.samples) > 2 and now - self.samples[0][0] > self.window:
+            self.samples.popleft()
+        return now, depth, done
+
+    def rates(self):
+        """Return (enqueue_rate, dequeue_rate) in jobs per second, or (None, None)"""
+        if len(self.samples) < 2:
+            return None, None
+        start, start_depth, start_done = self.samples[0]
+        end, end_depth, end_done = self.samples[-1]
+        elapsed = end - start
+        if elapsed <= 0:
+            return None, None
+        dequeue_rate = (end_done - start_done) / elapsed
+        enqueue_rate = max(dequeue_rate + (end_depth - start_depth) / elapsed, 0.0)
+        return enqueue_rate, dequeue_rate
+
+
+def desired_workers(current, busy, depth, enqueue_rate, dequeue_rate, min_workers, max_workers,
+                    target_drain):
+    """Number of workers needed to keep up with arrivals and drain the backlog
+
+    Per-worker throughput is estimated from the observed dequeue rate divided
+    by the workers that were busy; the pool needs enough workers to absorb the
+    arrival rate plus the backlog spread over `target_drain` seconds.
+    """
+    if depth == 0 and not enqueue_rate:
+        return min_workers
+    if not dequeue_rate or not busy:
+        # No throughput measured yet: grow only while jobs are waiting
+        needed = current + 1 if depth else current
+    else:
+        per_worker = dequeue_rate / busy
+        needed = math.ceil((enqueue_rate + depth / target_drain) / per_worker)
+    return max(min_workers, min(max_workers, needed))
+
+
+class WorkerPool:
+    """Starts, stops and restarts remotecv.worker child processes"""
+
+    def __init__(self, command):
+        self.command = command
+        self.workers = {}
+        self.stopping = {}
+        self.restarts = 0
+
+    @property
+    def size(self):
+        return len(self.workers)
+
+    def start_worker(self):
+        proc = subprocess.Popen(self.command)
+        self.workers[proc.pid] = {'proc': proc, 'started': time.time()}
+        log(f"started worker pid={proc.pid}")
+
+    def stop_worker(self):
+        """Ask the most recently started worker to exit after its current job"""
+        pid = max(self.workers, key=lambda p: self.workers[p]['started'])
+        entry = self.workers.pop(pid)
+        # pyres workers finish the running job on SIGQUIT
+        entry['proc'].send_signal(signal.SIGQUIT)
+        self.stopping[pid] = (entry['proc'], time.time())
+        log(f"stopping worker pid={pid}")
+
+    def resize(self, size):
+        while self.size < size:
+            self.start_worker()
+        while self.size > size:
+            self.stop_worker()
+
+    def reap(self):
+        """Restart workers that died and kill stopping workers past the grace period"""
+        for pid, entry in list(self.workers.items()):
+            code = entry['proc'].poll()
+            if code is not None:
+                log(f"worker pid={pid} exited with code {code}, restarting")
+                del self.workers[pid]
+                self.restarts += 1
+                self.start_worker()
+        for pid, (proc, since) in list(self.stopping.items()):
+            if proc.poll() is not None:
+                del self.stopping[pid]
+            elif time.time() - since > POOL_STOP_GRACE:
+                log(f"worker pid={pid} did not stop in {POOL_STOP_GRACE}s, killing")
+                proc.kill()
+
+    def shutdown(self):
+        for pid in list(self.workers):
+            self.stop_worker()
+        deadline = time.time() + POOL_STOP_GRACE
+        while self.stopping and time.time() < deadline:
+            self.reap()
+            time.sleep(0.2)
+        for proc, _ in self.stopping.values():
+            proc.kill()
+
+
+def worker_ids(r, pids):
+    """Map child pids to their pyres worker ids (host:pid:queues)"""
+    hostname = socket.gethostname()
+    ids = {}
+    for worker in r.smembers(RESQUE_WORKERS_KEY):
+        parts = worker.split(':')
+        if len(parts) >= 3 and parts[0] == hostname and parts[1].isdigit() and int(parts[1]) in pids:
+            ids[int(parts[1])] = worker
+    return ids
+
+
+def worker_throughput(r, pool, previous, elapsed):
+    """Jobs processed per worker since the previous tick"""
+    ids = worker_ids(r, set(pool.workers))
+    pids = sorted(ids)
+    counts = {}
+    if pids:
+        pipe = r.pipeline(transaction=False)
+        for pid in pids:
+            pipe.get(f'{RESQUE_PROCESSED_KEY}:{ids[pid]}')
+            pipe.get(f'{RESQUE_FAILED_KEY}:{ids[pid]}')
+        values = pipe.execute()
+        for i, pid in enumerate(pids):
+            counts[pid] = (int(values[2 * i] or 0), int(values[2 * i + 1] or 0))
+
+    workers = []
+    for pid, entry in sorted(pool.workers.items()):
+        processed, failed = counts.get(pid, (0, 0))
+        before = previous.get(pid)
+        rate = None
+        if before is not None and elapsed > 0:
+            rate = round((processed + failed - before) / elapsed, 3)
+        workers.append({
+            'pid': pid,
+            'worker': ids.get(pid),
+            'uptime': round(time.time() - entry['started'], 1),
+            'processed': processed,
+            'failed': failed,
+            'jobs_per_sec': rate,
+        })
+    return workers, {pid: sum(c) for pid, c in counts.items()}
+
+
+def publish(r, state, decision=None):
+    """Store pool state (expiring if the controller dies) and the decision log"""
+    pipe = r.pipeline(transaction=False)
+    pipe.set(POOL_STATE_KEY, json.dumps(state), ex=max(int(POOL_INTERVAL * 3), 10))
+    if decision:
+        pipe.lpush(POOL_DECISIONS_KEY, json.dumps(decision))
+        pipe.ltrim(POOL_DECISIONS_KEY, 0, POOL_DECISIONS_KEEP - 1)
+    pipe.execute()
+
+
+def run(args):
+    r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True,
+                    socket_timeout=5, socket_connect_timeout=5)
+    pool = WorkerPool(args.command or DEFAULT_WORKER_COMMAND)
+    sampler = QueueSampler(r, POOL_RATE_WINDOW)
+
+    stop = []
+    signal.signal(signal.SIGTERM, lambda *_: stop.append(True))
+    signal.signal(signal.SIGINT, lambda *_: stop.append(True))
+
+    pool.resize(max(args.min, min(args.max, args.workers)))
+    log(f"pool started with {pool.size} workers (min={args.min}, max={args.max})")
+
+    oversized_since = None
+    previous_counts = {}
+    last_tick = time.time()
+    while not stop:
+        time.sleep(args.interval)
+        pool.reap()
+        now = time.time()
+        try:
+            _, depth, _ = sampler.sample(now)
+            enqueue_rate, dequeue_rate = sampler.rates()
+            workers, previous_counts = worker_throughput(r, pool, previous_counts, now - last_tick)
+        except redis.RedisError as e:
+            log(f"redis unavailable, keeping {pool.size} workers: {e}")
+            continue
+        last_tick = now
+
+        # With jobs waiting every worker is busy; otherwise count those that did work
+        busy = pool.size if depth else sum(1 for w in workers if w['jobs_per_sec'])
+        target = desired_workers(pool.size, busy, depth, enqueue_rate, dequeue_rate,
+                                 args.min, args.max, POOL_TARGET_DRAIN)
+
+        # Scale up at once, scale down one worker at a time after a quiet period
+        decision = None
+        if target > pool.size:
+            oversized_since = None
+            decision = {'from': pool.size, 'to': target, 'reason': 'backlog'}
+        elif target < pool.size:
+            oversized_since = oversized_since or now
+            if now - oversized_since >= POOL_SCALE_DOWN_DELAY:
+                decision = {'from': pool.size, 'to': pool.size - 1, 'reason': 'idle'}
+                oversized_since = now
+        else:
+            oversized_since = None
+
+        if decision:
+            decision.update({
+                'timestamp': now,
+                'depth': depth,
+                'enqueue_rate': enqueue_rate,
+                'dequeue_rate': dequeue_rate,
+            })
+            log(f"scaling {decision['from']} -> {decision['to']} ({decision['reason']}, depth={depth})")
+            pool.resize(decision['to'])
+
+        try:
+            publish(r, {
+                'timestamp': now,
+                'host': socket.gethostname(),
+                'size': pool.size,
+                'target': target,
+                'min': args.min,
+                'max': args.max,
+                'depth': depth,
+                'enqueue_rate': enqueue_rate,
+                'dequeue_rate': dequeue_rate,
+                'restarts': pool.restarts,
+                'workers': workers,
+            }, decision)
+        except redis.RedisError as e:
+            log(f"could not publish pool state: {e}")
+
+    log("shutting down workers")
+    pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Autoscaling RemoteCV worker pool')
+    parser.add_argument('--min', type=int, default=POOL_MIN, help='minimum number of workers')
+    parser.add_argument('--max', type=int, default=POOL_MAX, help='maximum number of workers (default: one per core)')
+    parser.add_argument('--workers', type=int, default=POOL_WORKERS, help='workers started initially (default: one per core)')
+    parser.add_argument('--interval', type=float, default=POOL_INTERVAL, help='seconds between scaling decisions')
+    parser.add_argument('command', nargs=argparse.REMAINDER, help='worker command, after --')
+    args = parser.parse_args()
+    if args.command and args.command[0] == '--':
+        args.command = args.command[1:]
+    if args.min < 1 or args.max < args.min:
+        parser.error('expected 1 <= --min <= --max')
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+#!/bin/bash
+# Render the nginx config from nginx-cache.conf.template.
+# The thumbor upstream gets one server per thumbor process (ports 8001, 8002, ...),
+# matching numprocs=%(ENV_THUMBOR_NUM_PROCESSES)s in supervisord.conf.
+set -e
+
+TEMPLATE=${1:-/tmp/nginx-cache.conf.template}
+OUTPUT=${2:-/etc/nginx/nginx.conf}
+THUMBOR_NUM_PROCESSES=${THUMBOR_NUM_PROCESSES:-4}
+
+if ! [[ "$THUMBOR_NUM_PROCESSES" =~ ^[0-9]+$ ]] || [ "$THUMBOR_NUM_PROCESSES" -lt 1 ] || [ "$THUMBOR_NUM_PROCESSES" -gt 99 ]; then
+    echo "THUMBOR_NUM_PROCESSES must be between 1 and 99 (got: $THUMBOR_NUM_PROCESSES)" >&2
+    exit 1
+fi
+
+THUMBOR_UPSTREAM_SERVERS=""
+for i in $(seq 1 "$THUMBOR_NUM_PROCESSES"); do
+    THUMBOR_UPSTREAM_SERVERS+="        server localhost:$(printf '80%02d' "$i") max_fails=3 fail_timeout=30s;"$'\n'
+done
+export THUMBOR_UPSTREAM_SERVERS
+
+envsubst '${NGINX_LISTEN_PORT} ${THUMBOR_PROXY_CACHE_SIZE} ${THUMBOR_PROXY_CACHE_MEMORY_SIZE} ${THUMBOR_PROXY_CACHE_INACTIVE} ${THUMBOR_PROXY_CACHE_DURATION} ${THUMBOR_UPSTREAM_SERVERS}' \
+    < "$TEMPLATE" \
+    > "$OUTPUT"
@@ -42,6 +42,14 @@ export THUMBOR_PROXY_CACHE_DURATION=${THUMBOR_PROXY_CACHE_DURATION:-1m}
 # Note: Thumbor configuration uses os.environ.get() so it reads environment variables directly
 echo "Thumbor will use environment variables for configuration"
 
+# The nginx upstream must list one server per thumbor process started by supervisord
+echo "Rendering nginx upstream for $THUMBOR_NUM_PROCESSES thumbor processes..."
+if [ -f "/tmp/nginx-cache.conf.template" ]; then
+    /app/render_nginx_conf.sh /tmp/nginx-cache.conf.template /etc/nginx/nginx.conf || {
+        echo "WARNING: Could not render /etc/nginx/nginx.conf, keeping the build-time upstream"
+    }
+fi
+
 # Test nginx configuration
 echo "Testing Nginx configuration..."
 # When running as non-root, nginx -t might fail due to permission issues
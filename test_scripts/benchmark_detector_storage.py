@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Detector Storage Benchmark
+Writes the same synthetic RemoteCV detector results to Redis as one JSON key
+per image (RemoteCV's redis_store and tc_redis) and as packed records in hash
+buckets (thumbor_azure.storages.redis_detector_storage), with and without
+lz4, and reports the used_memory each layout costs, the results per MB and
+the pipelined read time. Everything it writes is deleted again.
+
+Run it where thumbor_azure is importable, against the Redis to size, e.g.:
+    docker cp test_scripts/benchmark_detector_storage.py thumbor-dev:/tmp/
+    docker exec -w /app thumbor-dev python3.11 /tmp/benchmark_detector_storage.py --count 200000
+"""
+
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import redis
+
+from benchmark_stack import Colors, print_colored
+from thumbor_azure.storages.redis_detector_storage import LARGE, LEGACY_KEY, DetectorLayout, unpack
+
+REDIS_HOST = 'localhost'
+REDIS_PORT = 6379
+REDIS_DB = 0
+RESULTS_SEED = 1234
+URL_PREFIX = 'detector-benchmark.invalid/images/'
+BENCHMARK_PREFIX = 'benchmark:detectors'
+BATCH_SIZE = 1000
+
+
+def remotecv_point(x, y, width, height):
+    # RemoteCV's BaseStore.serialize of one [x, y, width, height] detection
+    return {
+        'x': x + width / 2, 'y': y + height / 2,
+        'z': width * height, 'height': height, 'width': width, 'origin': '',
+    }
+
+
+def synthetic_results(count, seed):
+    """(url, points) pairs shaped like RemoteCV's 'all' detection: a few
+    faces when it finds any, otherwise a cloud of 1x1 feature points"""
+    rng = random.Random(seed)
+    for i in range(count):
+        width, height = rng.choice([(800, 600), (1600, 1200), (1200, 1800), (3000, 2000)])
+        if rng.random() < 0.4:
+            points = []
+            for _ in range(rng.choice([1, 1, 1, 2, 2, 3])):
+                size = rng.randint(40, min(width, height) // 2)
+                points.append(remotecv_point(rng.randint(0, width - size), rng.randint(0, height - size), size, size))
+        else:
+            points = [remotecv_point(rng.randint(0, width - 1), rng.randint(0, height - 1), 1, 1)
+                      for _ in range(rng.randint(1, 20))]
+        yield f'{URL_PREFIX}{i:08d}.jpg', points
+
+
+def used_memory(r):
+    return r.info('memory')['used_memory']
+
+
+def delete_matching(r, pattern):
+    pipe = r.pipeline(transaction=False)
+    for i, key in enumerate(r.scan_iter(match=pattern, count=BATCH_SIZE), 1):
+        pipe.unlink(key)
+        if i % BATCH_SIZE == 0:
+            pipe.execute()
+    pipe.execute()
+
+
+def cleanup(r):
+    delete_matching(r, LEGACY_KEY % {'key': URL_PREFIX + '*'})
+    delete_matching(r, f'{BENCHMARK_PREFIX}*')
+
+
+def write_json(r, results):
+    pipe = r.pipeline(transaction=False)
+    for i, (url, points) in enumerate(results, 1):
+        pipe.set(LEGACY_KEY % {'key': url}, json.dumps(points))
+        if i % BATCH_SIZE == 0:
+            pipe.execute()
+    pipe.execute()
+
+
+def read_json(r, results):
+    pipe = r.pipeline(transaction=False)
+    for i, (url, _) in enumerate(results, 1):
+        pipe.get(LEGACY_KEY % {'key': url})
+        if i % BATCH_SIZE == 0:
+            for value in pipe.execute():
+                json.loads(value)
+    for value in pipe.execute():
+        json.loads(value)
+
+
+def write_packed(r, layout, results):
+    pipe = r.pipeline(transaction=False)
+    for i, (url, points) in enumerate(results, 1):
+        layout.queue_put(pipe, url, points)
+        if i % BATCH_SIZE == 0:
+            pipe.execute()
+    pipe.execute()
+
+
+def read_packed(r, layout, results):
+    # What Storage.get_detector_data does, a batch at a time: HGET the
+    # buckets, then GET the records their LARGE markers point to
+    def decode(urls):
+        pipe = r.pipeline(transaction=False)
+        for url in urls:
+            pipe.hget(*layout.bucket(url))
+        values = pipe.execute()
+        large = [url for url, value in zip(urls, values) if value == LARGE]
+        for url in large:
+            pipe.get(layout.large_key(url))
+        values += pipe.execute()
+        for value in values:
+            if value != LARGE:
+                unpack(value)
+
+    urls = [url for url, _ in results]
+    for i in range(0, len(urls), BATCH_SIZE):
+        decode(urls[i:i + BATCH_SIZE])
+
+
+def bucket_encoding(r, layout, results):
+    key, _ = layout.bucket(results[0][0])
+    encoding = r.object('encoding', key)
+    return encoding.decode() if isinstance(encoding, bytes) else encoding
+
+
+def measure(r, name, results, write, read):
+    cleanup(r)
+    before = used_memory(r)
+    started = time.perf_counter()
+    write()
+    write_seconds = time.perf_counter() - started
+    size = used_memory(r) - before
+    started = time.perf_counter()
+    read()
+    read_seconds = time.perf_counter() - started
+    count = len(results)
+    phase = {
+        'used_memory_bytes': size,
+        'bytes_per_result': round(size / count, 1),
+        'results_per_mb': round(count / (size / 1048576)) if size > 0 else None,
+        'write_seconds': round(write_seconds, 3),
+        'read_us_per_result': round(read_seconds / count * 1e6, 2),
+    }
+    print(f"   {name:<14} {size / 1048576:8.1f}MB  {phase['bytes_per_result']:7.1f} B/result  "
+          f"{phase['results_per_mb'] or 0:8} results/MB  {phase['read_us_per_result']:6.2f}µs/read")
+    return phase
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare Redis memory of JSON and packed detector results')
+    parser.add_argument('--redis-host', default=REDIS_HOST)
+    parser.add_argument('--redis-port', type=int, default=REDIS_PORT)
+    parser.add_argument('--redis-db', type=int, default=REDIS_DB)
+    parser.add_argument('--count', type=int, default=100000, help='synthetic detector results')
+    parser.add_argument('--buckets', type=int, help='packed hash buckets (default: count / 100)')
+    parser.add_argument('--max-bucket-value', type=int,
+                        help="largest record kept in a bucket (default: the server's hash-max-ziplist-value)")
+    parser.add_argument('--output', default='detector-storage-benchmark.json')
+    args = parser.parse_args()
+    if args.count < 1:
+        parser.error('--count must be positive')
+    buckets = args.buckets or max(1, args.count // 100)
+
+    print_colored("\n" + "=" * 50, Colors.BLUE)
+    print_colored("Detector Storage Benchmark", Colors.BLUE)
+    print_colored("=" * 50, Colors.BLUE)
+
+    r = redis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db)
+    server = r.info('server')
+    memory = r.info('memory')
+    max_bucket_value = args.max_bucket_value or int(
+        r.config_get('hash-max-ziplist-value')['hash-max-ziplist-value'])
+    results = list(synthetic_results(args.count, RESULTS_SEED))
+    print(f"   {args.count} results, {buckets} buckets of values up to {max_bucket_value} bytes, "
+          f"Redis {server['redis_version']} ({memory.get('mem_allocator', 'unknown')})")
+
+    layouts = {
+        'packed': DetectorLayout(BENCHMARK_PREFIX, buckets, f'{BENCHMARK_PREFIX}:%(key)s',
+                                 max_bucket_value, compress=False),
+        'packed+lz4': DetectorLayout(BENCHMARK_PREFIX, buckets, f'{BENCHMARK_PREFIX}:%(key)s',
+                                     max_bucket_value, compress=True),
+    }
+    report = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'count': args.count,
+        'buckets': buckets,
+        'max_bucket_value': max_bucket_value,
+        'environment': {
+            'hostname': platform.node(),
+            'python': platform.python_version(),
+            'redis': server['redis_version'],
+            'mem_allocator': memory.get('mem_allocator'),
+        },
+        'layouts': {},
+    }
+
+    try:
+        report['layouts']['json'] = measure(
+            r, 'json', results, lambda: write_json(r, results), lambda: read_json(r, results))
+        for name, layout in layouts.items():
+            report['layouts'][name] = measure(
+                r, name, results,
+                lambda layout=layout: write_packed(r, layout, results),
+                lambda layout=layout: read_packed(r, layout, results))
+            report['layouts'][name]['bucket_encoding'] = bucket_encoding(r, layout, results)
+    except KeyboardInterrupt:
+        print("\nInterrupted", file=sys.stderr)
+    finally:
+        cleanup(r)
+
+    baseline = report['layouts'].get('json', {}).get('used_memory_bytes')
+    for name, phase in report['layouts'].items():
+        if name != 'json' and baseline and phase['used_memory_bytes'] > 0:
+            phase['memory_ratio'] = round(baseline / phase['used_memory_bytes'], 2)
+            print_colored(f"   {name}: x{phase['memory_ratio']} results per MB of JSON keys "
+                          f"(buckets are {phase['bucket_encoding']})", Colors.GREEN)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"\n   Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Thumbor Engine Benchmark
+Runs the same decode, resize, filter and encode pipelines through thumbor's
+PIL engine and the thumbor_azure OpenCV engine, in process, on the fixed
+benchmark corpus. Reports the median time per pipeline, the speedup, and the
+PSNR between both engines' output so a faster result that looks different is
+caught.
+
+Run it where thumbor and thumbor_azure are importable, e.g. in the container:
+    docker cp test_scripts/benchmark_engines.py thumbor-dev:/tmp/
+    docker cp test_scripts/benchmark_stack.py thumbor-dev:/tmp/
+    docker exec -w /app thumbor-dev python3.11 /tmp/benchmark_engines.py --output /tmp/engines.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+from statistics import median
+
+import numpy as np
+from PIL import Image
+
+from benchmark_stack import CORPUS_SPEC, Colors, build_corpus, print_colored
+
+ENGINES = {
+    'pil': 'thumbor.engines.pil',
+    'opencv': 'thumbor_azure.engines.opencv',
+}
+
+FILTERS = [
+    'thumbor.filters.grayscale',
+    'thumbor_azure.filters.brightness',
+    'thumbor_azure.filters.contrast',
+    'thumbor_azure.filters.blur',
+    'thumbor_azure.filters.sharpen',
+]
+
+# (width, height, filters) per scenario; a 0 dimension keeps the aspect ratio
+SCENARIOS = {
+    'resize': (300, 200, ''),
+    'resize-large': (1600, 0, ''),
+    'grayscale': (400, 300, 'grayscale()'),
+    'brightness': (400, 300, 'brightness(20)'),
+    'contrast': (400, 300, 'contrast(20)'),
+    'blur': (400, 300, 'blur(7)'),
+    'sharpen': (400, 300, 'sharpen(2,1,true)'),
+    'filter-chain': (500, 0, 'grayscale():contrast(20):sharpen(2,1,true)'),
+}
+
+# Flag outputs that differ more than the resampling kernels alone explain;
+# Lanczos4 against Pillow's Lanczos3 stays above this on the corpus
+PSNR_WARNING = 27
+
+def build_context(engine):
+    from thumbor.config import Config
+    from thumbor.context import Context
+    from thumbor.importer import Importer
+
+    config = Config(ENGINE=ENGINES[engine], FILTERS=FILTERS)
+    config.PILLOW_RESAMPLING_CV2_EQUIV = {'LANCZOS': 'INTER_LANCZOS4'}
+    importer = Importer(config)
+    importer.import_modules()
+    return Context(None, config, importer)
+
+def target_size(source, width, height):
+    """Requested size, filling a 0 dimension from the source aspect ratio"""
+    source_width, source_height = source
+    if not width:
+        width = round(source_width * height / source_height)
+    if not height:
+        height = round(source_height * width / source_width)
+    return width, height
+
+async def run_pipeline(context, buffer, extension, scenario, quality):
+    """Decode, resize to cover and center crop like thumbor, filter, encode"""
+    from thumbor.filters import FiltersFactory, PHASE_POST_TRANSFORM
+
+    engine = context.modules.importer.engine(context)
+    context.modules.engine = engine
+    engine.load(buffer, extension)
+
+    width, height, filters = SCENARIOS[scenario]
+    width, height = target_size(engine.size, width, height)
+    source_width, source_height = engine.size
+    scale = max(width / source_width, height / source_height)
+    resized = (max(width, round(source_width * scale)), max(height, round(source_height * scale)))
+    engine.resize(*resized)
+    left, top = (resized[0] - width) // 2, (resized[1] - height) // 2
+    engine.crop(left, top, left + width, top + height)
+
+    runner = FiltersFactory(context.modules.importer.filters).create_instances(context, filters)
+    await runner.apply_filters(PHASE_POST_TRANSFORM)
+    return engine.read(extension, quality)
+
+def psnr(first, second):
+    a = np.asarray(Image.open(io.BytesIO(first)).convert('RGBA'), dtype=np.float64)
+    b = np.asarray(Image.open(io.BytesIO(second)).convert('RGBA'), dtype=np.float64)
+    if a.shape != b.shape:
+        return None
+    mse = ((a - b) ** 2).mean()
+    return 99.0 if mse == 0 else round(float(10 * np.log10(255 ** 2 / mse)), 2)
+
+def benchmark(contexts, path, scenario, repeat, quality):
+    with open(path, 'rb') as f:
+        buffer = f.read()
+    extension = os.path.splitext(path)[1]
+    result = {}
+    outputs = {}
+    for engine, context in contexts.items():
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            outputs[engine] = asyncio.run(run_pipeline(context, buffer, extension, scenario, quality))
+            timings.append(time.perf_counter() - start)
+        result[f'{engine}_seconds'] = round(median(timings), 5)
+    result['speedup'] = round(result['pil_seconds'] / result['opencv_seconds'], 2)
+    result['psnr'] = psnr(outputs['pil'], outputs['opencv'])
+    result['output_bytes'] = {engine: len(output) for engine, output in outputs.items()}
+    return result
+
+def print_result(image, result):
+    color = Colors.GREEN if result['speedup'] >= 1 else Colors.YELLOW
+    if result['psnr'] is None or result['psnr'] < PSNR_WARNING:
+        color = Colors.RED
+    print_colored(
+        f"   {image:<22} pil {result['pil_seconds'] * 1000:8.1f}ms  "
+        f"opencv {result['opencv_seconds'] * 1000:8.1f}ms  "
+        f"x{result['speedup']:<5}  psnr {result['psnr'] if result['psnr'] is not None else 'size differs'}",
+        color
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the PIL and OpenCV thumbor engines')
+    parser.add_argument('--corpus', default='/tmp/thumbor-benchmark-corpus',
+                        help='image directory (generated when empty)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated scenarios to run')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per image and engine; the median is kept')
+    parser.add_argument('--quality', type=int, default=80)
+    parser.add_argument('--output', default='engine-benchmark-results.json')
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    print_colored("\n" + "=" * 50, Colors.BLUE)
+    print_colored("Thumbor Engine Benchmark", Colors.BLUE)
+    print_colored("=" * 50, Colors.BLUE)
+
+    images = build_corpus(args.corpus)
+    known = {name for name, _, _, _ in CORPUS_SPEC}
+    print(f"   Corpus: {len(images)} images from {args.corpus}"
+          + ('' if known.issuperset(images) else ' (not the generated corpus)'))
+    contexts = {engine: build_context(engine) for engine in ENGINES}
+
+    report = {
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'repeat': args.repeat,
+        'quality': args.quality,
+        'corpus': images,
+        'environment': {
+            'hostname': platform.node(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'pillow': Image.__version__,
+            'numpy': np.__version__,
+            'opencv': __import__('cv2').__version__,
+        },
+        'scenarios': {},
+    }
+
+    for scenario in scenarios:
+        width, height, filters = SCENARIOS[scenario]
+        print_colored(f"\n{scenario}: {width}x{height}" + (f" filters:{filters}" if filters else ''),
+                      Colors.YELLOW)
+        results = {}
+        for image in images:
+            results[image] = benchmark(contexts, os.path.join(args.corpus, image), scenario,
+                                       args.repeat, args.quality)
+            print_result(image, results[image])
+        total_pil = sum(r['pil_seconds'] for r in results.values())
+        total_opencv = sum(r['opencv_seconds'] for r in results.values())
+        report['scenarios'][scenario] = {
+            'images': results,
+            'speedup': round(total_pil / total_opencv, 2),
+            'min_psnr': min((r['psnr'] for r in results.values() if r['psnr'] is not None), default=None),
+        }
+        print_colored(f"   {'total':<22} x{report['scenarios'][scenario]['speedup']}", Colors.BLUE)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print_colored(f"\nResults written to {args.output}", Colors.GREEN)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print_colored("\n\nBenchmark interrupted by user", Colors.YELLOW)
+        sys.exit(1)
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Thumbor Stack Benchmark
+Drives nginx/thumbor/RemoteCV/Redis with a fixed image corpus served by a
+local origin stand-in, and writes throughput, latency percentiles, CPU/RSS
+per process and Redis ops per scenario to a JSON file that can be diffed
+between configuration changes.
+
+Run it inside the container (or any host sharing its PID namespace) to get
+per-process CPU and RSS:
+    docker cp test_scripts/benchmark_stack.py thumbor-dev:/tmp/
+    docker exec thumbor-dev python3.11 /tmp/benchmark_stack.py --output /tmp/before.json
+    ... change the configuration ...
+    docker exec thumbor-dev python3.11 /tmp/benchmark_stack.py --output /tmp/after.json --compare /tmp/before.json
+"""
+
+import os
+import sys
+import hmac
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import platform
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import redis
+import requests
+
+# Configuration
+THUMBOR_URL = 'http://localhost:8080'
+REDIS_HOST = 'localhost'
+REDIS_PORT = 6379
+REDIS_DB = 0
+# Outside 8001-8099, which supervisord gives the thumbor processes
+ORIGIN_PORT = 8190
+CORPUS_SEED = 1234
+
+# Corpus generated when no --corpus directory is given: (name, width, height, format)
+CORPUS_SPEC = [
+    ('landscape-small.jpg', 800, 600, 'JPEG'),
+    ('landscape-large.jpg', 3000, 2000, 'JPEG'),
+    ('portrait.jpg', 1200, 1800, 'JPEG'),
+    ('square.png', 1024, 1024, 'PNG'),
+    ('alpha.png', 640, 480, 'PNG'),
+    ('photo.webp', 1600, 1200, 'WEBP'),
+]
+WATERMARK_NAME = 'watermark.png'
+
+# Thumbor options per scenario; {origin} is replaced by the origin base URL
+SCENARIOS = {
+    'resize': '300x200',
+    'fit-in': 'fit-in/800x800',
+    'smart': '300x300/smart',
+    'grayscale': '400x300/filters:grayscale()',
+    'blur': '400x300/filters:blur(7)',
+    'watermark': '400x300/filters:watermark({origin}/' + WATERMARK_NAME + ',10,10,50)',
+    'filter-chain': '500x0/filters:grayscale():contrast(20):sharpen(2,1,true):quality(80)',
+}
+# AUTO_WEBP negotiation: browsers advertising WebP vs clients that do not
+ACCEPT_VARIANTS = {
+    'webp': 'image/webp,image/apng,image/*,*/*;q=0.8',
+    'default': 'image/*,*/*;q=0.8',
+}
+# Processes sampled for CPU/RSS, matched against /proc/<pid>/cmdline
+PROCESS_GROUPS = {
+    'thumbor': 'thumbor',
+    'remotecv': 'remotecv',
+    'redis': 'redis-server',
+    'nginx': 'nginx',
+}
+
+class Colors:
+    """ANSI color codes for terminal output"""
+    RED = '\033[0;31m'
+    GREEN = '\033[0;32m'
+    YELLOW = '\033[1;33m'
+    BLUE = '\033[0;34m'
+    NC = '\033[0m'  # No Color
+
+def print_colored(message, color=Colors.NC):
+    """Print message with color"""
+    print(f"{color}{message}{Colors.NC}")
+
+def build_corpus(path):
+    """Write a deterministic synthetic image corpus (gradients and shapes) to path"""
+    from PIL import Image, ImageDraw
+
+    os.makedirs(path, exist_ok=True)
+    rng = random.Random(CORPUS_SEED)
+    for name, width, height, fmt in CORPUS_SPEC + [(WATERMARK_NAME, 120, 40, 'PNG')]:
+        target = os.path.join(path, name)
+        if os.path.exists(target):
+            continue
+        mode = 'RGBA' if name.endswith('.png') else 'RGB'
+        image = Image.linear_gradient('L').resize((width, height)).convert(mode)
+        draw = ImageDraw.Draw(image)
+        for _ in range(40):
+            x, y = rng.randrange(width), rng.randrange(height)
+            r = rng.randrange(10, max(width, height) // 6)
+            color = tuple(rng.randrange(256) for _ in range(len(mode)))
+            draw.ellipse((x - r, y - r, x + r, y + r), fill=color)
+        if fmt == 'PNG':
+            image.save(target, fmt)
+        else:
+            image.save(target, fmt, quality=90)
+    return sorted(n for n in os.listdir(path) if n != WATERMARK_NAME)
+
+def start_origin(corpus, port):
+    """Serve the corpus directory over HTTP in a background thread
+
+    /<cache buster>/<image> serves <image>, so a run can put its id in the
+    image path, which thumbor signs and keys its storages on.
+    """
+    class Handler(SimpleHTTPRequestHandler):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=corpus, **kwargs)
+
+        def translate_path(self, path):
+            name = path.split('?', 1)[0].split('#', 1)[0].rsplit('/', 1)[-1]
+            return super().translate_path('/' + name)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def thumbor_path(options, image_url, security_key):
+    """Build a signed (HMAC-SHA1, as thumbor does) or unsafe thumbor path"""
+    path = f"{options}/{image_url}"
+    if not security_key:
+        return f"/unsafe/{path}"
+    digest = hmac.new(security_key.encode(), path.encode(), hashlib.sha1).digest()
+    return f"/{base64.urlsafe_b64encode(digest).decode()}/{path}"
+
+class ProcessSampler:
+    """Samples CPU time and RSS of the stack processes from /proc"""
+
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.clock_ticks = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+        self.available = os.path.isdir('/proc/self')
+        self.peak_rss = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def processes(self):
+        """Map pid -> group for the processes of each PROCESS_GROUPS entry"""
+        found = {}
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            try:
+                with open(f'/proc/{pid}/cmdline', 'rb') as f:
+                    cmdline = f.read().replace(b'\0', b' ').decode(errors='replace')
+            except OSError:
+                continue
+            for group, needle in PROCESS_GROUPS.items():
+                if needle in cmdline:
+                    found[int(pid)] = group
+                    break
+        return found
+
+    def read(self, pid):
+        """Return (cpu seconds, rss bytes) of a process, or None if it is gone"""
+        try:
+            with open(f'/proc/{pid}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            with open(f'/proc/{pid}/statm') as f:
+                rss_pages = int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            return None
+        cpu = (int(fields[11]) + int(fields[12])) / self.clock_ticks
+        return cpu, rss_pages * os.sysconf('SC_PAGE_SIZE')
+
+    def snapshot(self):
+        """CPU seconds and RSS per group"""
+        groups = {}
+        for pid, group in self.processes().items():
+            sample = self.read(pid)
+            if sample is None:
+                continue
+            entry = groups.setdefault(group, {'processes': 0, 'cpu_seconds': 0.0, 'rss_bytes': 0})
+            entry['processes'] += 1
+            entry['cpu_seconds'] += sample[0]
+            entry['rss_bytes'] += sample[1]
+        return groups
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            for group, entry in self.snapshot().items():
+                self.peak_rss[group] = max(self.peak_rss.get(group, 0), entry['rss_bytes'])
+
+    def __enter__(self):
+        self.peak_rss = {}
+        self.start = self.snapshot() if self.available else {}
+        if self.available:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if not self.available:
+            self.result = None
+            return
+        self.stop_event.set()
+        self.thread.join()
+        end = self.snapshot()
+        self.result = {}
+        for group, entry in end.items():
+            before = self.start.get(group, {}).get('cpu_seconds', 0.0)
+            self.result[group] = {
+                'processes': entry['processes'],
+                'cpu_seconds': round(max(entry['cpu_seconds'] - before, 0.0), 3),
+                'rss_bytes': entry['rss_bytes'],
+                'peak_rss_bytes': max(self.peak_rss.get(group, 0), entry['rss_bytes']),
+            }
+
+def redis_counters(r):
+    """Total commands processed and per-command call counts"""
+    if r is None:
+        return None
+    stats = r.info('stats')
+    commands = {name.replace('cmdstat_', ''): value['calls']
+                for name, value in r.info('commandstats').items()}
+    return {'total': stats.get('total_commands_processed', 0), 'commands': commands}
+
+def redis_delta(before, after):
+    if before is None or after is None:
+        return None
+    commands = {name: calls - before['commands'].get(name, 0)
+                for name, calls in after['commands'].items()
+                if calls - before['commands'].get(name, 0) > 0}
+    return {'total': after['total'] - before['total'], 'commands': dict(sorted(commands.items()))}
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(int(len(values) * pct / 100), len(values) - 1)], 4)
+
+def fetch(session, url, accept, timeout):
+    """GET a URL; returns (seconds, status, content type, bytes, error)"""
+    started = time.perf_counter()
+    try:
+        response = session.get(url, headers={'Accept': accept}, timeout=timeout)
+        elapsed = time.perf_counter() - started
+        error = None if response.status_code == 200 else f'HTTP {response.status_code}'
+        return elapsed, response.status_code, response.headers.get('Content-Type'), len(response.content), error
+    except requests.RequestException as e:
+        return time.perf_counter() - started, None, None, 0, type(e).__name__
+
+def run_phase(urls, accept, concurrency, timeout, r):
+    """Request every URL with the given concurrency and collect measurements"""
+    local = threading.local()
+
+    def worker(url):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return fetch(local.session, url, accept, timeout)
+
+    sampler = ProcessSampler()
+    redis_before = redis_counters(r)
+    with sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(worker, urls))
+        elapsed = time.perf_counter() - started
+    redis_after = redis_counters(r)
+
+    latencies = [res[0] for res in results if res[4] is None]
+    errors = {}
+    content_types = {}
+    for res in results:
+        if res[4]:
+            errors[res[4]] = errors.get(res[4], 0) + 1
+        if res[2]:
+            content_types[res[2]] = content_types.get(res[2], 0) + 1
+    return {
+        'requests': len(results),
+        'succeeded': len(latencies),
+        'errors': errors,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'latency': {
+            'p50': percentile(latencies, 50),
+            'p95': percentile(latencies, 95),
+            'p99': percentile(latencies, 99),
+            'max': round(max(latencies), 4) if latencies else None,
+        },
+        'bytes': sum(res[3] for res in results),
+        'content_types': content_types,
+        'processes': sampler.result,
+        'redis': redis_delta(redis_before, redis_after),
+    }
+
+def environment_snapshot():
+    """Settings that explain differences between two benchmark files"""
+    keys = ['THUMBOR_NUM_PROCESSES', 'ENGINE_THREADPOOL_SIZE', 'THREADPOOL_SIZE',
+            'HTTP_LOADER_MAX_CONN_PER_HOST', 'AUTO_WEBP', 'QUALITY', 'WEBP_QUALITY',
+            'REMOTECV_POOL_MIN', 'REMOTECV_POOL_MAX']
+    return {
+        'hostname': platform.node(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'env': {key: os.environ.get(key) for key in keys if os.environ.get(key) is not None},
+    }
+
+def print_phase(name, phase):
+    lat = phase['latency']
+    color = Colors.GREEN if not phase['errors'] else Colors.YELLOW
+    print_colored(
+        f"   {name:<28} {phase['throughput_rps'] or 0:>8.1f} req/s  "
+        f"p50 {lat['p50'] or 0:.3f}s  p95 {lat['p95'] or 0:.3f}s  p99 {lat['p99'] or 0:.3f}s"
+        + (f"  errors {sum(phase['errors'].values())}" if phase['errors'] else ''),
+        color
+    )
+
+def compare(previous_path, report):
+    """Print throughput and p95 changes against an earlier benchmark file"""
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print_colored(f"\nComparison with {previous_path}", Colors.BLUE)
+    for name, phases in report['scenarios'].items():
+        for phase_name, phase in phases.items():
+            old = previous.get('scenarios', {}).get(name, {}).get(phase_name)
+            if not old or not old.get('throughput_rps') or not phase.get('throughput_rps'):
+                continue
+            rps = (phase['throughput_rps'] / old['throughput_rps'] - 1) * 100
+            p95_old, p95_new = old['latency']['p95'], phase['latency']['p95']
+            p95 = (p95_new / p95_old - 1) * 100 if p95_old and p95_new else 0
+            color = Colors.GREEN if rps >= 0 else Colors.RED
+            print_colored(f"   {name + ' ' + phase_name:<28} throughput {rps:+6.1f}%  p95 {p95:+6.1f}%", color)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the thumbor container stack')
+    parser.add_argument('--thumbor-url', default=THUMBOR_URL, help='nginx or thumbor base URL')
+    parser.add_argument('--origin-host', default='localhost',
+                        help='host name thumbor uses to reach the origin stand-in')
+    parser.add_argument('--origin-port', type=int, default=ORIGIN_PORT)
+    parser.add_argument('--corpus', default='/tmp/thumbor-benchmark-corpus',
+                        help='image directory (generated when empty)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated scenarios to run')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--repeat', type=int, default=5, help='requests per image in the warm phase')
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('--security-key', default=os.environ.get('BENCHMARK_SECURITY_KEY'),
+                        help='sign URLs with this key instead of using /unsafe/')
+    parser.add_argument('--no-redis', action='store_true', help='do not collect Redis command counts')
+    parser.add_argument('--output', default='benchmark-results.json')
+    parser.add_argument('--compare', help='earlier result file to compare against')
+    args = parser.parse_args()
+
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+
+    print_colored("\n" + "=" * 50, Colors.BLUE)
+    print_colored("Thumbor Stack Benchmark", Colors.BLUE)
+    print_colored("=" * 50, Colors.BLUE)
+
+    images = build_corpus(args.corpus)
+    server = start_origin(args.corpus, args.origin_port)
+    origin = f"{args.origin_host}:{args.origin_port}"
+    print(f"   Origin: http://{origin} serving {len(images)} images from {args.corpus}")
+
+    r = None
+    if not args.no_redis:
+        try:
+            r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=REDIS_DB, decode_responses=True)
+            r.ping()
+        except redis.RedisError as e:
+            print_colored(f"   ⚠ Redis unavailable, skipping Redis ops: {e}", Colors.YELLOW)
+            r = None
+
+    # Every run and Accept variant uses a fresh cache-busting path segment, so
+    # the cold phase misses the file storage, detector storage and nginx
+    # cache. Thumbor ignores query strings when routing, signing and keying.
+    run_id = f"{int(time.time())}-{random.randrange(1 << 30):x}"
+    report = {
+        'run_id': run_id,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'thumbor_url': args.thumbor_url,
+        'concurrency': args.concurrency,
+        'repeat': args.repeat,
+        'corpus': images,
+        'environment': environment_snapshot(),
+        'scenarios': {},
+    }
+
+    try:
+        for name in scenarios:
+            options = SCENARIOS[name].format(origin=origin)
+            print_colored(f"\n{name}: {options}", Colors.YELLOW)
+            report['scenarios'][name] = {}
+            for variant, accept in ACCEPT_VARIANTS.items():
+                urls = [
+                    args.thumbor_url + thumbor_path(options, f"{origin}/{run_id}-{variant}/{image}",
+                                                    args.security_key)
+                    for image in images
+                ]
+                cold = run_phase(urls, accept, args.concurrency, args.timeout, r)
+                print_phase(f"{variant} cold", cold)
+                if name == 'smart':
+                    # Let RemoteCV finish so the warm phase measures stored detections
+                    time.sleep(3)
+                warm = run_phase(urls * args.repeat, accept, args.concurrency, args.timeout, r)
+                print_phase(f"{variant} warm", warm)
+                report['scenarios'][name][f'{variant}_cold'] = cold
+                report['scenarios'][name][f'{variant}_warm'] = warm
+    finally:
+        server.shutdown()
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print_colored(f"\nResults written to {args.output}", Colors.GREEN)
+
+    if args.compare:
+        compare(args.compare, report)
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print_colored("\n\nBenchmark interrupted by user", Colors.YELLOW)
+        sys.exit(1)
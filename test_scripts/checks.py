@@ -0,0 +1,46 @@
+"""
+Check helpers for the test_*.py scripts
+Colored output, a ✓/✗ line per check and the summary the scripts end with.
+Standard library only, so a test imports nothing beyond what it checks.
+"""
+
+import sys
+
+results = {}
+
+
+class Colors:
+    """ANSI color codes for terminal output"""
+    RED = '\033[0;31m'
+    GREEN = '\033[0;32m'
+    YELLOW = '\033[1;33m'
+    BLUE = '\033[0;34m'
+    NC = '\033[0m'  # No Color
+
+
+def print_colored(message, color=Colors.NC):
+    """Print message with color"""
+    print(f"{color}{message}{Colors.NC}")
+
+
+def print_banner(title):
+    print_colored("\n" + "=" * 50, Colors.BLUE)
+    print_colored(title, Colors.BLUE)
+    print_colored("=" * 50, Colors.BLUE)
+
+
+def check(name, condition, detail=''):
+    """Record a named check and print it, with detail when it failed"""
+    results[name] = bool(condition)
+    if condition:
+        print_colored(f"   ✓ {name}", Colors.GREEN)
+    else:
+        print_colored(f"   ✗ {name}" + (f": {detail}" if detail else ''), Colors.RED)
+
+
+def finish():
+    """Print how many checks passed and exit non-zero if any failed"""
+    failed = [name for name, ok in results.items() if not ok]
+    print_colored(f"\n{len(results) - len(failed)}/{len(results)} checks passed",
+                  Colors.RED if failed else Colors.GREEN)
+    sys.exit(1 if failed else 0)
@@ -265,7 +265,7 @@ generate_summary() {
     echo ""
     echo -e "${BLUE}Configuration Details:${NC}"
     echo "  - Redis Host: localhost:6379 (DB 0)"
-    echo "  - Storage: tc_redis.storages.redis_storage"
+    echo "  - Storage: thumbor_azure.storages.redis_detector_storage"
     echo "  - Detector: thumbor.detectors.queued_detector"
     echo "  - RemoteCV: Running as supervisord service"
 
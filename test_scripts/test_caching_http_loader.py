@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Caching HTTP Loader Test
+Runs thumbor_azure.loaders.caching_http_loader against an in-process origin
+that counts requests and honours If-None-Match, and checks fresh hits, 304
+revalidation, collapsed concurrent fetches, stale copies while the origin
+fails, no-store responses, content-addressed blobs, and that the blob sweep
+runs in the background without losing a blob another fetch is storing.
+
+Run it where thumbor and thumbor_azure are importable, e.g. in the container:
+    docker cp test_scripts/test_caching_http_loader.py thumbor-dev:/tmp/
+    docker cp test_scripts/checks.py thumbor-dev:/tmp/
+    docker exec -w /app thumbor-dev python3.11 /tmp/test_caching_http_loader.py
+"""
+
+import os
+import time
+import asyncio
+import hashlib
+import tempfile
+import threading
+
+from tornado.httpserver import HTTPServer
+from tornado.httputil import HTTPHeaders
+from tornado.testing import bind_unused_port
+from tornado.web import Application, RequestHandler
+
+from thumbor.config import Config
+from thumbor.context import Context
+
+from checks import Colors, check, finish, print_banner, print_colored
+from thumbor_azure.loaders import caching_http_loader
+from thumbor_azure.loaders.caching_http_loader import SOURCE_CACHE_STATS, BlobStore
+
+ORIGIN_DELAY = 0.2
+
+
+class Origin:
+    """What the origin serves and what it was asked"""
+
+    def __init__(self):
+        self.requests = []
+        self.status = 200
+        self.cache_control = {}
+
+
+class OriginHandler(RequestHandler):
+    def initialize(self, origin):
+        self.origin = origin
+
+    async def get(self, name):
+        self.origin.requests.append((name, self.request.headers.get('If-None-Match')))
+        await asyncio.sleep(ORIGIN_DELAY)
+        if self.origin.status != 200:
+            self.set_status(self.origin.status)
+            return
+        # shared-a and shared-b serve the same bytes
+        body = f'original {name.split("-")[0]}'.encode()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        self.set_header('ETag', etag)
+        self.set_header('Content-Type', 'image/jpeg')
+        if name in self.origin.cache_control:
+            self.set_header('Cache-Control', self.origin.cache_control[name])
+        if self.request.headers.get('If-None-Match') == etag:
+            self.set_status(304)
+            return
+        self.write(body)
+
+
+class Request:
+    headers = HTTPHeaders()
+
+
+class RequestHandlerStub:
+    request = Request()
+
+
+def make_context(root):
+    config = Config(
+        CACHING_LOADER_ROOT_PATH=root,
+        CACHING_LOADER_MAX_BYTES=0,
+        CACHING_LOADER_FRESH_SECONDS=60,
+        HTTP_LOADER_REQUEST_TIMEOUT=5,
+    )
+    return Context(config=config, request_handler=RequestHandlerStub())
+
+
+def reset_stats():
+    for event in SOURCE_CACHE_STATS:
+        SOURCE_CACHE_STATS[event] = 0
+
+
+async def test_loader(root, base, origin):
+    context = make_context(root)
+
+    print_colored("\n1. Fresh hits...", Colors.YELLOW)
+    reset_stats()
+    first = await caching_http_loader.load(context, f'{base}/fresh.jpg')
+    second = await caching_http_loader.load(context, f'{base}/fresh.jpg')
+    check("the first load fetches the original", first.successful and first.buffer == b'original fresh',
+          repr(first.buffer))
+    check("a fresh entry is served without the origin",
+          second.buffer == first.buffer and len(origin.requests) == 1, str(origin.requests))
+    check("counted as fetched then hit",
+          SOURCE_CACHE_STATS['fetched'] == 1 and SOURCE_CACHE_STATS['hit'] == 1, str(SOURCE_CACHE_STATS))
+
+    print_colored("\n2. Revalidation...", Colors.YELLOW)
+    origin.requests.clear()
+    origin.cache_control['expiring'] = 'max-age=0'
+    reset_stats()
+    await caching_http_loader.load(context, f'{base}/expiring.jpg')
+    revalidated = await caching_http_loader.load(context, f'{base}/expiring.jpg')
+    check("a stale entry is revalidated with its ETag",
+          len(origin.requests) == 2 and origin.requests[1][1] is not None, str(origin.requests))
+    check("a 304 serves the stored bytes", revalidated.buffer == b'original expiring'
+          and SOURCE_CACHE_STATS['revalidated'] == 1, str(SOURCE_CACHE_STATS))
+
+    origin.status = 503
+    reset_stats()
+    stale = await caching_http_loader.load(context, f'{base}/expiring.jpg')
+    check("a stale copy is served while the origin fails",
+          stale.buffer == b'original expiring' and SOURCE_CACHE_STATS['stale'] == 1, str(SOURCE_CACHE_STATS))
+    failed = await caching_http_loader.load(context, f'{base}/missing.jpg')
+    check("without a copy the origin's failure is returned", not failed.successful)
+    origin.status = 200
+
+    print_colored("\n3. Collapsed fetches...", Colors.YELLOW)
+    origin.requests.clear()
+    reset_stats()
+    loads = await asyncio.gather(*(caching_http_loader.load(context, f'{base}/burst.jpg') for _ in range(5)))
+    check("five concurrent loads fetch once", len(origin.requests) == 1, str(origin.requests))
+    check("every load gets the original", all(result.buffer == b'original burst' for result in loads))
+    check("four loads are coalesced", SOURCE_CACHE_STATS['coalesced'] == 4, str(SOURCE_CACHE_STATS))
+    check("finished fetches are forgotten", not caching_http_loader.in_flight)
+
+    print_colored("\n4. What is stored...", Colors.YELLOW)
+    origin.requests.clear()
+    origin.cache_control['private'] = 'no-store'
+    await caching_http_loader.load(context, f'{base}/private.jpg')
+    await caching_http_loader.load(context, f'{base}/private.jpg')
+    check("no-store responses are fetched every time", len(origin.requests) == 2, str(origin.requests))
+
+    await caching_http_loader.load(context, f'{base}/shared-a.jpg')
+    await caching_http_loader.load(context, f'{base}/shared-b.jpg')
+    digest = hashlib.sha256(b'original shared').hexdigest()
+    blobs = [name for _, _, names in os.walk(f'{root}/blobs') for name in names if name == digest]
+    check("URLs serving the same bytes share one blob", len(blobs) == 1, str(blobs))
+
+    cache = caching_http_loader.source_cache
+    entry = cache.index.get(hashlib.sha1(f'{base}/fresh.jpg'.encode()).hexdigest())
+    os.remove(cache.blobs.path(entry['digest']))
+    origin.requests.clear()
+    refetched = await caching_http_loader.load(context, f'{base}/fresh.jpg')
+    check("an evicted blob is fetched again", refetched.buffer == b'original fresh'
+          and len(origin.requests) == 1, str(origin.requests))
+
+
+def test_blob_sweep(root):
+    print_colored("\n5. Blob sweep...", Colors.YELLOW)
+    max_bytes = 40 * 1024
+    blobs = BlobStore(root, max_bytes)
+
+    started = threading.Event()
+    release = threading.Event()
+    sweep = BlobStore.sweep
+
+    def slow_sweep(self):
+        started.set()
+        release.wait(5)
+        sweep(self)
+
+    BlobStore.sweep = slow_sweep
+    try:
+        for i in range(30):
+            blobs.put(hashlib.sha256(str(i).encode()).hexdigest(), b'x' * 4096)
+        check("the sweep starts once enough is written", started.wait(5))
+        check("put does not wait for the sweep", not release.is_set())
+        release.set()
+        for _ in range(500):
+            if not blobs.sweeping:
+                break
+            time.sleep(0.01)
+    finally:
+        BlobStore.sweep = sweep
+
+    total = sum(
+        os.path.getsize(os.path.join(dirpath, name))
+        for dirpath, _, names in os.walk(root) for name in names if not name.startswith('.')
+    )
+    check("the sweep trims blobs to the budget", total <= max_bytes, f"{total} bytes left")
+
+    # The sweep removes a blob between the dedup check and the write
+    key = hashlib.sha256(b'raced').hexdigest()
+    blobs.put(key, b'raced')
+    os.remove(blobs.path(key))
+    try:
+        blobs.put(key, b'raced')
+        stored = blobs.get(key)
+    except OSError as e:
+        stored = e
+    check("a blob swept from under a put is written again",
+          stored is not None and not isinstance(stored, OSError) and stored[0] == b'raced', repr(stored))
+
+
+def main():
+    print_banner("Caching HTTP Loader Test")
+
+    async def run(root):
+        sock, port = bind_unused_port()
+        origin = Origin()
+        server = HTTPServer(Application([(r'/(.+)\.jpg', OriginHandler, {'origin': origin})]))
+        server.add_sockets([sock])
+        try:
+            await test_loader(root, f'http://127.0.0.1:{port}', origin)
+        finally:
+            server.stop()
+
+    with tempfile.TemporaryDirectory() as root:
+        caching_http_loader.source_cache = None
+        caching_http_loader.FetchLock.fd = None
+        asyncio.run(run(f'{root}/source_cache'))
+        test_blob_sweep(f'{root}/sweep')
+
+    finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Detector Warmup Test
+Checks that the jobs detector_warmup.py enqueues are the ones thumbor's
+queued detector enqueues: the same payload, the same dedup key, and
+arguments RemoteCV's DetectTask accepts. A generated job is run through
+pyres with the image loader, detector and result store stubbed out. With
+Redis reachable it also warms up a few URLs on a queue of its own and checks
+hits, dedup against thumbor and the jobs a worker reserves. Everything it
+writes is deleted again.
+
+Run it where thumbor, remotecv and thumbor_azure are importable, e.g. in the container:
+    docker cp test_scripts/test_detector_warmup.py thumbor-dev:/tmp/
+    docker cp test_scripts/checks.py thumbor-dev:/tmp/
+    docker exec -w /app -e PYTHONPATH=/app thumbor-dev python3.11 /tmp/test_detector_warmup.py
+"""
+
+import os
+import json
+import inspect
+import argparse
+from types import SimpleNamespace
+
+import redis
+from pyres import ResQ
+from pyres.job import Job
+from remotecv import utils as remotecv_utils
+from remotecv.pyres_tasks import DetectTask
+from remotecv.unique_queue import UniqueQueue
+
+from checks import Colors, check, finish, print_banner, print_colored
+from detector_warmup import DETECTION_TYPE, DETECTOR_TASK, Warmup
+from thumbor_azure.storages.redis_detector_storage import LEGACY_KEY
+
+REDIS_HOST = 'localhost'
+REDIS_PORT = 6379
+REDIS_DB = 0
+TEST_QUEUE = f'WarmupTest{os.getpid()}'
+URL_PREFIX = 'warmup-test.invalid/images/'
+
+
+class StubRemoteCV:
+    """Stands in for the loader, detector, result store and metrics of a RemoteCV worker"""
+
+    def __init__(self):
+        self.loaded = []
+        self.stored = {}
+
+    def __enter__(self):
+        stub = self
+        self.saved = {name: getattr(remotecv_utils.config, name, None) for name in ('loader', 'store')}
+        self.saved_metrics = getattr(remotecv_utils.context, 'metrics', None)
+        self.saved_processor = DetectTask.processor
+
+        class ResultStore:
+            def __init__(self, config):
+                pass
+
+            def store(self, key, points):
+                stub.stored[key] = points
+
+        remotecv_utils.config.loader = SimpleNamespace(load_sync=lambda path: self.loaded.append(path) or b'image')
+        remotecv_utils.config.store = SimpleNamespace(ResultStore=ResultStore)
+        remotecv_utils.context.metrics = SimpleNamespace(timing=lambda *args: None, incr=lambda *args: None)
+        DetectTask.processor = SimpleNamespace(detect=lambda detection_type, data: [[1, 2, 3, 4]])
+        return self
+
+    def __exit__(self, *exc):
+        for name, value in self.saved.items():
+            setattr(remotecv_utils.config, name, value)
+        remotecv_utils.context.metrics = self.saved_metrics
+        DetectTask.processor = self.saved_processor
+
+
+def offline_queue():
+    """A UniqueQueue that is not connected; creating one normally connects to Redis"""
+    return UniqueQueue.__new__(UniqueQueue)
+
+
+def thumbor_job(queue, url):
+    """The payload thumbor's QueuedDetector pushes for url"""
+    pushed = []
+    unique_queue = offline_queue()
+    unique_queue.add_unique_key = lambda queue, key: True
+    unique_queue.push = lambda queue, item: pushed.append(item)
+    unique_queue.enqueue_unique_from_string(DETECTOR_TASK, queue, args=[DETECTION_TYPE, url], key=url)
+    return pushed[0]
+
+
+def test_payload():
+    print_colored("\n1. Job payload...", Colors.YELLOW)
+    url = 'media.example.com/path/image.png'
+    warmup = Warmup(redis.Redis(), 'Detect', 100)
+    job = warmup.job(url)
+    check("the job is the one thumbor enqueues", job == thumbor_job('Detect', url),
+          f"{job} != {thumbor_job('Detect', url)}")
+    try:
+        inspect.signature(DetectTask.perform).bind(*job['args'])
+        bound = True
+    except TypeError as e:
+        bound = e
+    check("its arguments fit DetectTask.perform", bound is True, str(bound))
+
+    spaced = 'media.example.com/path/my image.png'
+    check("the dedup key is escaped like UniqueQueue's",
+          warmup.unique_key(spaced) == offline_queue()._create_unique_key('Detect', spaced),
+          warmup.unique_key(spaced))
+
+    with StubRemoteCV() as remotecv:
+        Job('Detect', json.loads(json.dumps(job)), ResQ.__new__(ResQ)).perform()
+    check("pyres runs it through DetectTask", remotecv.loaded == [url], str(remotecv.loaded))
+    check("the result is stored under the URL", remotecv.stored == {url: [[1, 2, 3, 4]]}, str(remotecv.stored))
+
+
+def test_redis(r):
+    print_colored("\n2. Through Redis...", Colors.YELLOW)
+    urls = [f'{URL_PREFIX}{i}.jpg' for i in range(5)]
+    r.set(LEGACY_KEY % {'key': urls[0]}, '[]')
+    # thumbor and RemoteCV read bytes; UniqueQueue compares the dedup key to b'1'
+    raw = redis.Redis(connection_pool=redis.ConnectionPool(**dict(r.connection_pool.connection_kwargs,
+                                                                  decode_responses=False)))
+    thumbor_queue = UniqueQueue(server=raw)
+    thumbor_queue.enqueue_unique_from_string(DETECTOR_TASK, TEST_QUEUE, args=[DETECTION_TYPE, urls[1]], key=urls[1])
+
+    warmup = Warmup(r, TEST_QUEUE, 100)
+    warmup.process(urls + urls[2:3])
+    stats = warmup.stats
+    check("detected URLs are skipped", stats['hits'] == 1, str(stats))
+    check("URLs thumbor already queued are skipped", stats['already_queued'] == 1, str(stats))
+    check("duplicates are skipped", stats['duplicates'] == 1, str(stats))
+    check("the other URLs are enqueued once", stats['enqueued'] == 3 and r.llen(warmup.queue_key) == 4,
+          f"{stats['enqueued']} enqueued, {r.llen(warmup.queue_key)} queued")
+
+    thumbor_queue.enqueue_unique_from_string(DETECTOR_TASK, TEST_QUEUE, args=[DETECTION_TYPE, urls[2]], key=urls[2])
+    check("thumbor does not enqueue them again", r.llen(warmup.queue_key) == 4)
+
+    resq = ResQ(server=raw)
+    with StubRemoteCV() as remotecv:
+        while True:
+            job = Job.reserve(TEST_QUEUE, resq)
+            if job is None:
+                break
+            job.perform()
+    check("a worker runs every queued job", sorted(remotecv.stored) == sorted(urls[1:]), str(sorted(remotecv.stored)))
+
+
+def cleanup(r):
+    keys = [f'resque:queue:{TEST_QUEUE}', LEGACY_KEY % {'key': URL_PREFIX + '0.jpg'}]
+    keys += list(r.scan_iter(match=f'resque:unique:queue:{TEST_QUEUE}:*'))
+    r.delete(*keys)
+    r.srem('resque:queues', TEST_QUEUE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the jobs detector_warmup.py enqueues')
+    parser.add_argument('--redis-host', default=REDIS_HOST)
+    parser.add_argument('--redis-port', type=int, default=REDIS_PORT)
+    parser.add_argument('--redis-db', type=int, default=REDIS_DB)
+    parser.add_argument('--no-redis', action='store_true', help='only check the job payload')
+    args = parser.parse_args()
+
+    print_banner("Detector Warmup Test")
+
+    test_payload()
+
+    if not args.no_redis:
+        r = redis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db, decode_responses=True)
+        try:
+            r.ping()
+        except redis.RedisError as e:
+            print_colored(f"   ⚠ Redis unavailable, skipping the queue checks: {e}", Colors.YELLOW)
+        else:
+            try:
+                test_redis(r)
+            finally:
+                cleanup(r)
+
+    finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Decoded Frame Cache Test
+Checks thumbor_azure.engines.frame_cache in process: the LRU's byte
+accounting and read-only frames, the acquire/wait/release protocol that
+makes concurrent requests decode a frame once, and, through the OpenCV
+engine, that a srcset burst decodes its original once, renders what it
+renders without the cache, and leaves the cached frame untouched.
+
+Run it where thumbor and thumbor_azure are importable, e.g. in the container:
+    docker cp test_scripts/test_frame_cache.py thumbor-dev:/tmp/
+    docker cp test_scripts/checks.py thumbor-dev:/tmp/
+    docker exec -w /app thumbor-dev python3.11 /tmp/test_frame_cache.py
+"""
+
+import io
+import threading
+
+import numpy as np
+from PIL import Image
+
+from thumbor.config import Config
+from thumbor.context import Context, RequestParameters
+from thumbor.importer import Importer
+
+from checks import Colors, check, finish, print_banner, print_colored
+from thumbor_azure.engines import opencv
+from thumbor_azure.engines.frame_cache import FRAME_CACHE_STATS, FrameLRU, frame_source
+
+SRCSET_WIDTHS = (200, 320, 400, 480, 640, 800, 960, 1280)
+
+
+def frame(nbytes):
+    return np.zeros(nbytes, dtype=np.uint8)
+
+
+def test_lru():
+    print_colored("\n1. Frame LRU byte accounting...", Colors.YELLOW)
+    source = frame_source('image.png', b'original')
+    lru = FrameLRU(max_bytes=100, max_item_bytes=60)
+    lru.put(source + (10, 4), frame(40))
+    lru.put(source + (10, 5), frame(50))
+    check("frames are charged their bytes", lru.size == 90, f"size {lru.size}")
+    check("only the exact size is a hit",
+          lru.get(source + (10, 4)) is not None and lru.get(source + (10, 3)) is None)
+    check("a changed original at the same URL misses",
+          lru.get(frame_source('image.png', b'changed') + (10, 4)) is None)
+    stored = lru.get(source + (10, 4))
+    try:
+        stored[0] = 1
+        written = True
+    except ValueError:
+        written = False
+    check("cached frames are read-only", not written)
+    lru.put(source + (10, 5), frame(20))
+    check("overwrite replaces the old bytes", lru.size == 60, f"size {lru.size}")
+    lru.get(source + (10, 4))
+    lru.put(source + (10, 6), frame(60))
+    check("least recently used frame is evicted first",
+          list(lru.frames) == [source + (10, 4), source + (10, 6)], str([key[-2:] for key in lru.frames]))
+    check("size matches the frames left", lru.size == sum(f.nbytes for f in lru.frames.values()),
+          f"size {lru.size}")
+    lru.put(source + (10, 7), frame(61))
+    check("frames over max_item_bytes are not kept", source + (10, 7) not in lru.frames and lru.size == 100)
+
+
+def test_protocol():
+    print_colored("\n2. Concurrent decodes...", Colors.YELLOW)
+    lru = FrameLRU(max_bytes=1000, max_item_bytes=1000)
+    key = frame_source('image.png', b'original') + (10, 10)
+    state, _ = lru.acquire(key)
+    check("the first request decodes", state == 'decode')
+    state, event = lru.acquire(key)
+    check("a second request waits for it", state == 'wait' and not event.is_set())
+    check("without waiting it decodes too", lru.acquire(key, wait=False)[0] == 'decode')
+    lru.release(key, frame(100))
+    check("release wakes the waiters", event.is_set())
+    state, found = lru.acquire(key)
+    check("the decoded frame is then a hit", state == 'hit' and found.nbytes == 100)
+
+    key = frame_source('broken.png', b'original') + (10, 10)
+    lru.acquire(key)
+    state, event = lru.acquire(key)
+    lru.release(key, None)
+    check("a failed decode wakes the waiters", event.is_set())
+    check("and leaves the next request to decode", lru.acquire(key)[0] == 'decode' and key not in lru.frames)
+    lru.release(key, None)
+    check("no decode is left claimed", not lru.decoding, str(list(lru.decoding)))
+
+
+def original():
+    buffer = io.BytesIO()
+    rng = np.random.default_rng(1)
+    array = np.asarray(Image.linear_gradient('L').resize((1600, 1200)).convert('RGB')).copy()
+    array[200:400, 200:600] = rng.integers(0, 255, (200, 400, 3))
+    Image.fromarray(array).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def render_burst(buffer, cache_bytes):
+    """PNG bytes per srcset width, rendered concurrently like a burst of requests"""
+    config = Config(ENGINE='thumbor_azure.engines.opencv', DECODED_FRAME_CACHE_MAX_BYTES=cache_bytes)
+    opencv.frame_cache = None
+    importer = Importer(config)
+    importer.import_modules()
+    rendered = {}
+
+    def render(width):
+        context = Context(config=config, importer=importer)
+        context.request = RequestParameters(width=width, height=0, image='original.png')
+        engine = context.modules.engine
+        context.request.engine = engine
+        engine.load(buffer, '.png')
+        engine.normalize()
+        engine.resize(width, engine.get_proportional_height(width))
+        engine.adjust_brightness(10)
+        rendered[width] = engine.read('.png')
+
+    for event in FRAME_CACHE_STATS:
+        FRAME_CACHE_STATS[event] = 0
+    threads = [threading.Thread(target=render, args=(width,)) for width in SRCSET_WIDTHS]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return rendered, dict(FRAME_CACHE_STATS)
+
+
+def test_engine():
+    print_colored("\n3. A srcset burst through the engine...", Colors.YELLOW)
+    buffer = original()
+    cached, stats = render_burst(buffer, 256 * 1024 * 1024)
+    check("every width renders", sorted(cached) == sorted(SRCSET_WIDTHS), str(sorted(cached)))
+    check("the original is decoded once", stats['miss'] == 1, str(stats))
+    # A request that waited for the decode counts as coalesced, then as a hit
+    check("the other requests reuse it", stats['hit'] == len(SRCSET_WIDTHS) - 1, str(stats))
+
+    frames = list(opencv.frame_cache.frames.values())
+    decoded = np.asarray(Image.open(io.BytesIO(buffer)).convert('RGB'))
+    check("the cached frame is the untouched decode",
+          len(frames) == 1 and np.array_equal(frames[0], decoded))
+
+    uncached, stats = render_burst(buffer, 0)
+    check("with the cache off nothing is looked up", not any(stats.values()) and opencv.frame_cache is None,
+          str(stats))
+    different = [width for width in SRCSET_WIDTHS if uncached.get(width) != cached.get(width)]
+    check("cached renders match uncached ones byte for byte", not different, str(different))
+
+
+def main():
+    print_banner("Decoded Frame Cache Test")
+
+    test_lru()
+    test_protocol()
+    test_engine()
+
+    finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+OpenCV Engine Test
+Runs the same operations through thumbor's PIL engine and the
+thumbor_azure.engines.opencv engine, in process, and checks that the array
+implementations give the PIL engine's result: pixel for pixel for crops,
+rotations, flips and the brightness and contrast lookup tables, and within
+a PSNR bound for resampling, grayscale, blur and sharpen. The filters are
+run through thumbor_azure.filters, on both engines.
+
+Run it where thumbor and thumbor_azure are importable, e.g. in the container:
+    docker cp test_scripts/test_opencv_engine.py thumbor-dev:/tmp/
+    docker cp test_scripts/checks.py thumbor-dev:/tmp/
+    docker exec -w /app thumbor-dev python3.11 /tmp/test_opencv_engine.py
+"""
+
+import io
+import asyncio
+
+import numpy as np
+from PIL import Image
+
+from thumbor.config import Config
+from thumbor.context import Context
+from thumbor.filters import blur, brightness, contrast, sharpen
+from thumbor.importer import Importer
+
+from checks import Colors, check, finish, print_banner, print_colored
+from thumbor_azure.filters import blur as cv_blur
+from thumbor_azure.filters import brightness as cv_brightness
+from thumbor_azure.filters import contrast as cv_contrast
+from thumbor_azure.filters import sharpen as cv_sharpen
+
+# Below this the output looks different, not just resampled differently;
+# OpenCV's Lanczos4 against Pillow's Lanczos3 stays well above it
+PSNR_MINIMUM = 30
+
+
+def psnr(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    if a.shape != b.shape:
+        return 0
+    mse = ((a - b) ** 2).mean()
+    return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def encode(image, format='PNG'):
+    buffer = io.BytesIO()
+    image.save(buffer, format)
+    return buffer.getvalue()
+
+
+def test_image():
+    """A gradient with a block of noise, so both edges and smooth areas are compared"""
+    rng = np.random.default_rng(1)
+    array = np.asarray(Image.linear_gradient('L').resize((640, 480)).convert('RGB')).copy()
+    array[100:200, 100:300] = rng.integers(0, 255, (100, 200, 3))
+    return encode(Image.fromarray(array))
+
+
+def alpha_image():
+    """An opaque blue square on transparent red"""
+    image = Image.new('RGBA', (300, 300), (255, 0, 0, 0))
+    image.paste((0, 0, 255, 255), (100, 100, 200, 200))
+    return encode(image)
+
+
+class Engines:
+    """Importers for a PIL and an OpenCV engine"""
+
+    def __init__(self):
+        self.importers = {}
+        for name, engine in (('pil', 'thumbor.engines.pil'), ('opencv', 'thumbor_azure.engines.opencv')):
+            config = Config(ENGINE=engine, DECODED_FRAME_CACHE_MAX_BYTES=0)
+            importer = Importer(config)
+            importer.import_modules()
+            self.importers[name] = importer
+
+    def load(self, buffer, extension='.png'):
+        """(PIL context, OpenCV context), their engines loaded with buffer"""
+        loaded = []
+        for name in ('pil', 'opencv'):
+            importer = self.importers[name]
+            context = Context(config=importer.config, importer=importer)
+            context.modules.engine.load(buffer, extension)
+            loaded.append(context)
+        return loaded
+
+
+def same(pil, cv):
+    return np.array_equal(np.asarray(pil.image), np.asarray(cv.image))
+
+
+def test_geometry(engines, buffer):
+    print_colored("\n1. Crop, rotate and flip...", Colors.YELLOW)
+    pil, cv = (context.modules.engine for context in engines.load(buffer))
+    pil.crop(10, 20, 300, 200)
+    cv.crop(10, 20, 300, 200)
+    check("crop matches pixel for pixel", same(pil, cv))
+    for degrees in (90, 180, 270):
+        pil.rotate(degrees)
+        cv.rotate(degrees)
+    pil.flip_horizontally()
+    cv.flip_horizontally()
+    pil.flip_vertically()
+    cv.flip_vertically()
+    check("the pixels stay in the array", cv._array is not None)
+    check("rotations and flips match pixel for pixel", same(pil, cv))
+
+    pil, cv = (context.modules.engine for context in engines.load(buffer))
+    pil.crop(-10, -10, 100, 100)
+    cv.crop(-10, -10, 100, 100)
+    check("out-of-bounds crops are padded like Pillow", same(pil, cv) and cv.size == (110, 110), str(cv.size))
+
+
+def test_resampling(engines, buffer):
+    print_colored("\n2. Resize and grayscale...", Colors.YELLOW)
+    pil, cv = (context.modules.engine for context in engines.load(buffer))
+    pil.resize(200, 150)
+    cv.resize(200, 150)
+    score = psnr(pil.image, cv.image)
+    check("resize keeps the requested size", cv.size == (200, 150), str(cv.size))
+    check(f"resize looks like Pillow's (PSNR {score:.1f})", score >= PSNR_MINIMUM)
+
+    pil, cv = (context.modules.engine for context in engines.load(buffer))
+    pil.resize(1000, 750)
+    cv.resize(1000, 750)
+    score = psnr(pil.image, cv.image)
+    check(f"upscaling looks like Pillow's (PSNR {score:.1f})", score >= PSNR_MINIMUM)
+
+    pil, cv = (context.modules.engine for context in engines.load(alpha_image()))
+    pil.resize(37, 37)
+    cv.resize(37, 37)
+    pil_pixels = np.asarray(pil.image).astype(np.float64)
+    cv_pixels = np.asarray(cv.image).astype(np.float64)
+    visible = (pil_pixels[..., 3] > 0) & (cv_pixels[..., 3] > 0)
+    check("alpha survives the resize", cv.image.mode == 'RGBA' and cv.has_transparency())
+    score = psnr(pil_pixels[..., 3], cv_pixels[..., 3])
+    check(f"alpha is resampled like Pillow's (PSNR {score:.1f})", score >= PSNR_MINIMUM)
+    score = psnr(pil_pixels[visible][:, :3], cv_pixels[visible][:, :3])
+    check(f"transparent pixels do not bleed into the edges (PSNR {score:.1f})", score >= PSNR_MINIMUM)
+
+    pil, cv = (context.modules.engine for context in engines.load(buffer))
+    pil.convert_to_grayscale()
+    cv.convert_to_grayscale()
+    score = psnr(pil.image, cv.image)
+    check(f"grayscale uses Pillow's luma weights (PSNR {score:.1f})",
+          cv.image.mode == 'L' and score >= 45)
+
+
+async def run_filter(filter_class, params, context):
+    filter_class.pre_compile()
+    await filter_class(params, context).run()
+
+
+async def test_filters(engines, buffer):
+    print_colored("\n3. Filters...", Colors.YELLOW)
+    cases = (
+        ('brightness(-40)', brightness.Filter, cv_brightness.Filter, None),
+        ('brightness(25)', brightness.Filter, cv_brightness.Filter, None),
+        ('contrast(-40)', contrast.Filter, cv_contrast.Filter, None),
+        ('contrast(25)', contrast.Filter, cv_contrast.Filter, None),
+        ('blur(7)', blur.Filter, cv_blur.Filter, PSNR_MINIMUM),
+        ('sharpen(2,1,true)', sharpen.Filter, cv_sharpen.Filter, PSNR_MINIMUM),
+        ('sharpen(2,1,false)', sharpen.Filter, cv_sharpen.Filter, PSNR_MINIMUM),
+    )
+    for params, pil_filter, cv_filter, minimum in cases:
+        pil, cv = engines.load(buffer)
+        await run_filter(pil_filter, params, pil)
+        await run_filter(cv_filter, params, cv)
+        pil, cv = pil.modules.engine, cv.modules.engine
+        if minimum is None:
+            check(f"{params} matches thumbor's pixel for pixel", same(pil, cv))
+        else:
+            score = psnr(pil.image, cv.image)
+            check(f"{params} looks like thumbor's (PSNR {score:.1f})", score >= minimum)
+
+    pil, cv = engines.load(buffer)
+    for params, pil_filter, cv_filter in (
+        ('brightness(10)', brightness.Filter, cv_brightness.Filter),
+        ('contrast(20)', contrast.Filter, cv_contrast.Filter),
+        ('blur(3)', blur.Filter, cv_blur.Filter),
+    ):
+        await run_filter(pil_filter, params, pil)
+        await run_filter(cv_filter, params, cv)
+    check("a chain of filters stays in the array", cv.modules.engine._array is not None)
+    score = psnr(pil.modules.engine.image, cv.modules.engine.image)
+    check(f"a chain of filters looks like thumbor's (PSNR {score:.1f})", score >= PSNR_MINIMUM)
+
+    pil, fallback = engines.load(buffer)[0], engines.load(buffer)[0]
+    await run_filter(contrast.Filter, 'contrast(25)', pil)
+    await run_filter(cv_contrast.Filter, 'contrast(25)', fallback)
+    check("the filters fall back to thumbor's on other engines", same(pil.modules.engine, fallback.modules.engine))
+
+    # thumbor's apply_blur clamps the radius to 150 and keeps sigma at the
+    # requested radius rather than rejecting the URL; so does the engine
+    pil, cv = engines.load(buffer)
+    await run_filter(blur.Filter, 'blur(200)', pil)
+    await run_filter(cv_blur.Filter, 'blur(200)', cv)
+    score = psnr(pil.modules.engine.image, cv.modules.engine.image)
+    check(f"blur(200) renders like thumbor's (PSNR {score:.1f})", score >= PSNR_MINIMUM)
+    _, clamped = engines.load(buffer)
+    await run_filter(cv_blur.Filter, 'blur(150,200)', clamped)
+    check("blur(200) is blur(150, 200)", same(cv.modules.engine, clamped.modules.engine))
+
+
+def test_read(engines, buffer):
+    print_colored("\n4. Encoding...", Colors.YELLOW)
+    _, cv = (context.modules.engine for context in engines.load(buffer))
+    cv.resize(320, 240)
+    encoded = cv.read('.jpg', 80)
+    image = Image.open(io.BytesIO(encoded))
+    check("the array is encoded as a JPEG of its size", image.format == 'JPEG' and image.size == (320, 240))
+
+    _, cv = (context.modules.engine for context in engines.load(alpha_image()))
+    cv.resize(50, 50)
+    check("an array with alpha defaults to PNG", cv.get_default_extension() == '.png')
+    image = Image.open(io.BytesIO(cv.read('.png')))
+    check("alpha is encoded", image.mode == 'RGBA' and image.getextrema()[3][0] == 0)
+
+
+def main():
+    print_banner("OpenCV Engine Test")
+
+    engines = Engines()
+    buffer = test_image()
+    test_geometry(engines, buffer)
+    test_resampling(engines, buffer)
+    asyncio.run(test_filters(engines, buffer))
+    test_read(engines, buffer)
+
+    finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+Detector Storage Test
+Checks thumbor_azure.storages.redis_detector_storage: that the focal points
+RemoteCV and thumbor's detectors write come back from a packed record as
+they went in, centres on half pixels included, that what the fixed-width
+points cannot hold falls back to JSON, and that JSON written by tc_redis or
+RemoteCV still reads. With Redis reachable it also stores records through
+the thumbor Storage: bucketed, as keys of their own when large, and
+rewritten from legacy JSON keys. Everything it writes is deleted again.
+
+Run it where thumbor and thumbor_azure are importable, e.g. in the container:
+    docker cp test_scripts/test_redis_detector_storage.py thumbor-dev:/tmp/
+    docker cp test_scripts/checks.py thumbor-dev:/tmp/
+    docker exec -w /app thumbor-dev python3.11 /tmp/test_redis_detector_storage.py
+"""
+
+import json
+import random
+import asyncio
+import argparse
+from types import SimpleNamespace
+
+import redis
+
+from thumbor.config import Config
+from thumbor.point import FocalPoint
+
+from checks import Colors, check, finish, print_banner, print_colored
+from thumbor_azure.storages import redis_detector_storage
+from thumbor_azure.storages.redis_detector_storage import (
+    COMPRESSED, JSON, LARGE, LEGACY_KEY, POINTS, DETECTOR_STORAGE_STATS, pack, unpack,
+)
+
+REDIS_HOST = 'localhost'
+REDIS_PORT = 6379
+REDIS_DB = 0
+TEST_PREFIX = 'test:detectors'
+URL_PREFIX = 'detector-test.invalid/images/'
+
+
+def remotecv_point(x, y, width, height):
+    # RemoteCV's BaseStore.serialize of one [x, y, width, height] detection
+    return {
+        'x': x + width / 2, 'y': y + height / 2,
+        'z': width * height, 'height': height, 'width': width, 'origin': '',
+    }
+
+
+def synthetic_results(count, seed):
+    """(url, points) pairs shaped like RemoteCV's 'all' detection: a few
+    faces when it finds any, otherwise a cloud of 1x1 feature points"""
+    rng = random.Random(seed)
+    for i in range(count):
+        width, height = rng.choice([(800, 600), (1600, 1200), (1200, 1800), (3000, 2000)])
+        if rng.random() < 0.4:
+            points = []
+            for _ in range(rng.choice([1, 1, 1, 2, 2, 3])):
+                size = rng.randint(40, min(width, height) // 2)
+                points.append(remotecv_point(rng.randint(0, width - size), rng.randint(0, height - size), size, size))
+        else:
+            points = [remotecv_point(rng.randint(0, width - 1), rng.randint(0, height - 1), 1, 1)
+                      for _ in range(rng.randint(1, 20))]
+        yield f'{URL_PREFIX}{i:08d}.jpg', points
+
+
+def focal_points(points):
+    """What thumbor's smart crop makes of stored points"""
+    return [vars(FocalPoint.from_dict(point)) for point in points]
+
+
+def test_remotecv_points():
+    print_colored("\n1. RemoteCV results...", Colors.YELLOW)
+    face = [remotecv_point(10, 20, 25, 31)]
+    record = pack(face)
+    check("a face centre on a half pixel is kept", unpack(record) == face, f"{unpack(record)} != {face}")
+    check("it is packed as fixed-width points", record[0] == POINTS and len(record) == 1 + 11, repr(record[:1]))
+
+    results_ = list(synthetic_results(2000, 1234))
+    changed = [url for url, points in results_ if unpack(pack(points)) != points]
+    check("2000 synthetic RemoteCV results round-trip exactly", not changed, f"{len(changed)} changed")
+    changed = [url for url, points in results_ if unpack(pack(points, compress=True)) != points]
+    check("and with lz4", not changed, f"{len(changed)} changed")
+    fallbacks = [url for url, points in results_ if points and pack(points)[0] & ~COMPRESSED != POINTS]
+    check("none of them falls back to JSON", not fallbacks, f"{len(fallbacks)} as JSON")
+    json_bytes = sum(len(json.dumps(points)) for _, points in results_)
+    packed_bytes = sum(len(pack(points)) for _, points in results_)
+    check(f"packed they take {packed_bytes / json_bytes:.0%} of the JSON", packed_bytes * 4 < json_bytes)
+
+
+def test_thumbor_points():
+    print_colored("\n2. thumbor's focal points...", Colors.YELLOW)
+    samples = {
+        'a point': [FocalPoint(100, 200).to_dict()],
+        'a square': [FocalPoint.from_square(5, 6, 70, 81).to_dict()],
+        'a weighted face': [FocalPoint(10, 20, weight=2.5, origin='Face Detection').to_dict()],
+        'features': [FocalPoint(i * 3, i * 7, origin='Feature Detection').to_dict() for i in range(30)],
+        'an empty result': [],
+    }
+    for name, points in samples.items():
+        check(f"{name} reads back as the same focal points",
+              focal_points(unpack(pack(points))) == focal_points(points))
+    fractional = [{'x': 10.75, 'y': 3.3, 'z': 1, 'width': 1, 'height': 1, 'origin': ''}]
+    check("finer fractions truncate like FocalPoint.from_dict",
+          focal_points(unpack(pack(fractional))) == focal_points(fractional), str(unpack(pack(fractional))))
+
+    print_colored("\n3. What the points cannot hold...", Colors.YELLOW)
+    fallbacks = {
+        'a weight beyond float16': [FocalPoint(10, 20, weight=123457).to_dict()],
+        'a negative coordinate': [FocalPoint(-5, 20).to_dict()],
+        'a coordinate over 32767': [remotecv_point(40000, 10, 20, 20)],
+        'an unknown origin': [{'x': 1, 'y': 2, 'z': 3, 'origin': 'elsewhere'}],
+        'an unknown key': [{'x': 1, 'y': 2, 'z': 3, 'label': 'cat'}],
+    }
+    for name, points in fallbacks.items():
+        record = pack(points)
+        check(f"{name} is stored as JSON, unchanged", record[0] == JSON and unpack(record) == points)
+    legacy = [remotecv_point(1, 2, 3, 5), remotecv_point(100, 200, 50, 50)]
+    check("JSON text from tc_redis or RemoteCV reads", unpack(json.dumps(legacy).encode()) == legacy)
+    crowd = [remotecv_point(i * 10, i * 5, 20, 20) for i in range(40)]
+    record = pack(crowd, compress=True)
+    if redis_detector_storage.lz4framed is not None:
+        check("large records are lz4-compressed", record[0] == POINTS | COMPRESSED and unpack(record) == crowd)
+    else:
+        check("without py-lz4framed records stay uncompressed", record[0] == POINTS and unpack(record) == crowd)
+
+
+async def test_redis(r, args):
+    print_colored("\n4. Through Redis...", Colors.YELLOW)
+    config = Config(
+        REDIS_STORAGE_SERVER_HOST=args.redis_host,
+        REDIS_STORAGE_SERVER_PORT=args.redis_port,
+        REDIS_STORAGE_SERVER_DB=args.redis_db,
+        REDIS_STORAGE_SERVER_PASSWORD=None,
+        DETECTOR_STORAGE_BUCKET=TEST_PREFIX,
+        DETECTOR_STORAGE_BUCKETS=4,
+        REDIS_DETECTOR_STORAGE_KEY=f'{TEST_PREFIX}:%(key)s',
+    )
+    redis_detector_storage.Storage.client = None
+    storage = redis_detector_storage.Storage(SimpleNamespace(config=config, metrics=None))
+    layout = storage.layout
+
+    face = [remotecv_point(10, 20, 25, 31)]
+    await storage.put_detector_data(f'{URL_PREFIX}face.jpg', face)
+    key, field = layout.bucket(f'{URL_PREFIX}face.jpg')
+    check("a small record is a bucket field", r.hget(key, field) == pack(face, layout.compress))
+    check("and reads back unchanged", await storage.get_detector_data(f'{URL_PREFIX}face.jpg') == face)
+
+    crowd = [remotecv_point(i * 37, i * 11, 21, 21) for i in range(60)]
+    await storage.put_detector_data(f'{URL_PREFIX}crowd.jpg', crowd)
+    key, field = layout.bucket(f'{URL_PREFIX}crowd.jpg')
+    check("a large record gets a key of its own",
+          r.hget(key, field) == LARGE and r.exists(layout.large_key(f'{URL_PREFIX}crowd.jpg')))
+    check("and reads back unchanged", await storage.get_detector_data(f'{URL_PREFIX}crowd.jpg') == crowd)
+    r.delete(layout.large_key(f'{URL_PREFIX}crowd.jpg'))
+    check("an evicted large record is a miss", await storage.get_detector_data(f'{URL_PREFIX}crowd.jpg') is None)
+
+    legacy_url = f'{URL_PREFIX}legacy.jpg'
+    r.set(LEGACY_KEY % {'key': legacy_url}, json.dumps(face))
+    DETECTOR_STORAGE_STATS['legacy'] = 0
+    check("a legacy JSON key reads", await storage.get_detector_data(legacy_url) == face
+          and DETECTOR_STORAGE_STATS['legacy'] == 1)
+    key, field = layout.bucket(legacy_url)
+    check("and is rewritten packed", r.hget(key, field) is not None
+          and not r.exists(LEGACY_KEY % {'key': legacy_url}))
+    check("an unknown image is a miss", await storage.get_detector_data(f'{URL_PREFIX}missing.jpg') is None)
+
+    encoding = r.object('encoding', key)
+    encoding = encoding.decode() if isinstance(encoding, bytes) else encoding
+    check(f"buckets keep Redis's compact encoding ({encoding})", encoding in ('ziplist', 'listpack'))
+
+
+def cleanup(r):
+    for pattern in (f'{TEST_PREFIX}*', LEGACY_KEY % {'key': URL_PREFIX + '*'}):
+        keys = list(r.scan_iter(match=pattern))
+        if keys:
+            r.delete(*keys)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the packed detector storage')
+    parser.add_argument('--redis-host', default=REDIS_HOST)
+    parser.add_argument('--redis-port', type=int, default=REDIS_PORT)
+    parser.add_argument('--redis-db', type=int, default=REDIS_DB)
+    parser.add_argument('--no-redis', action='store_true', help='only check the record format')
+    args = parser.parse_args()
+
+    print_banner("Detector Storage Test")
+
+    test_remotecv_points()
+    test_thumbor_points()
+
+    if not args.no_redis:
+        r = redis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db)
+        try:
+            r.ping()
+        except redis.RedisError as e:
+            print_colored(f"   ⚠ Redis unavailable, skipping the storage checks: {e}", Colors.YELLOW)
+        else:
+            try:
+                asyncio.run(test_redis(r, args))
+            finally:
+                cleanup(r)
+
+    finish()
+
+
+if __name__ == "__main__":
+    main()
@@ -243,7 +243,7 @@ def generate_summary(results):
     print(f"  Redis: {REDIS_HOST}:{REDIS_PORT} (DB {REDIS_DB})")
     print(f"  Thumbor: {THUMBOR_URL}")
     print("  Detector: thumbor.detectors.queued_detector")
-    print("  Storage: tc_redis.storages.redis_storage")
+    print("  Storage: thumbor_azure.storages.redis_detector_storage")
 
     print_colored("\nMonitoring commands:", Colors.BLUE)
     print("  • Real-time monitor: redis-cli monitor | grep detector")
@@ -0,0 +1,295 @@
+#!/usr/bin/env python3
+"""
+Segment Storage Test
+Checks thumbor_azure.storages.segment_storage in process, on a temporary
+directory: round trips through the thumbor Storage API, index probing
+across colliding slots and deleted ones, index growth, overwrites and
+removals, compaction of mostly dead segments, expiry, torn records, writes
+to a shard another process holds locked, and writers in several processes
+sharing one shard.
+
+Run it where thumbor and thumbor_azure are importable, e.g. in the container:
+    docker cp test_scripts/test_segment_storage.py thumbor-dev:/tmp/
+    docker cp test_scripts/checks.py thumbor-dev:/tmp/
+    docker exec -w /app thumbor-dev python3.11 /tmp/test_segment_storage.py
+"""
+
+import os
+import time
+import random
+import fcntl
+import asyncio
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+from types import SimpleNamespace
+
+from thumbor.config import Config
+
+from checks import Colors, check, finish, print_banner, print_colored
+from thumbor_azure.storages import segment_storage
+from thumbor_azure.storages.segment_storage import INDEX_HEADER, INITIAL_SLOTS, MAX_LOAD, RECORD, Shard, slot_of
+
+WRITER_PROCESSES = 4
+WRITES_PER_PROCESS = 500
+
+
+def make_storage(root, shards=4, segment_bytes=1024 * 1024, expiration=None):
+    """A Storage over a SegmentStore of its own, as a new thumbor process would have"""
+    segment_storage.segment_store = None
+    config = Config(
+        SEGMENT_STORAGE_ROOT_PATH=root,
+        SEGMENT_STORAGE_SHARDS=shards,
+        SEGMENT_STORAGE_SEGMENT_BYTES=segment_bytes,
+        SEGMENT_STORAGE_FSYNC_SECONDS=0,
+        SEGMENT_STORAGE_COMPACT_SECONDS=0,
+        STORAGE_EXPIRATION_SECONDS=expiration,
+        STORES_CRYPTO_KEY_FOR_EACH_IMAGE=True,
+    )
+    context = SimpleNamespace(config=config, metrics=None, server=SimpleNamespace(security_key='s3cr3t'))
+    return segment_storage.Storage(context)
+
+
+def blob(seed, size=None):
+    rng = random.Random(seed)
+    return rng.randbytes(size or rng.randint(200, 2000))
+
+
+def header(shard):
+    """(slot count, used slots, active segment)"""
+    return INDEX_HEADER.unpack_from(shard.index)[2:5]
+
+
+def colliding_digests(count, slots):
+    """count digests that all probe from the same slot"""
+    digests = []
+    target = None
+    i = 0
+    while len(digests) < count:
+        digest = hashlib.sha1(f'collision-{i}'.encode()).digest()
+        i += 1
+        slot = slot_of(digest, slots)
+        if target is None:
+            target = slot
+        if slot == target:
+            digests.append(digest)
+    return digests
+
+
+async def test_round_trip(root):
+    print_colored("\n1. Storage API round trip...", Colors.YELLOW)
+    storage = make_storage(root)
+    await storage.put('images/a.jpg', blob(1))
+    check("an original is read back", await storage.get('images/a.jpg') == blob(1))
+    check("an unknown path is a miss", await storage.get('images/missing.jpg') is None)
+    check("exists() sees stored paths only",
+          await storage.exists('images/a.jpg') and not await storage.exists('images/missing.jpg'))
+    await storage.put_crypto('images/a.jpg')
+    await storage.put_detector_data('images/a.jpg', [{'x': 1, 'y': 2}])
+    check("crypto keys and detector results are kept beside the original",
+          await storage.get_crypto('images/a.jpg') == 's3cr3t'
+          and await storage.get_detector_data('images/a.jpg') == [{'x': 1, 'y': 2}]
+          and await storage.get('images/a.jpg') == blob(1))
+    other = make_storage(root)
+    check("another process maps the same records", await other.get('images/a.jpg') == blob(1))
+
+
+def test_probing(root):
+    print_colored("\n2. Index probing...", Colors.YELLOW)
+    shard = Shard(root, 1024 * 1024)
+    first, second, third = colliding_digests(3, INITIAL_SLOTS)
+    for digest in (first, second, third):
+        shard.put(digest, digest * 10)
+    slots = [shard.find(shard.index, digest)[0] for digest in (first, second, third)]
+    check("colliding keys take the next free slots", slots == [slots[0], (slots[0] + 1) % INITIAL_SLOTS,
+                                                               (slots[0] + 2) % INITIAL_SLOTS], str(slots))
+    check("every colliding key is read back",
+          all(shard.get(digest, 0)[1] == digest * 10 for digest in (first, second, third)))
+
+    shard.remove(second)
+    check("a removed key is a miss", shard.get(second, 0) == ('miss', None))
+    check("keys probed past a removed one are still found", shard.get(third, 0)[1] == third * 10)
+    used = header(shard)[1]
+    shard.put(second, b'again')
+    check("a re-added key reuses the deleted slot",
+          shard.find(shard.index, second)[0] == slots[1] and header(shard)[1] == used,
+          f"slot {shard.find(shard.index, second)[0]}, used {header(shard)[1]} (was {used})")
+    shard.put(first, b'replaced')
+    check("an overwrite keeps its slot and slot count",
+          shard.get(first, 0)[1] == b'replaced' and header(shard)[1] == used)
+
+
+def test_growth(root):
+    print_colored("\n3. Index growth...", Colors.YELLOW)
+    shard = Shard(root, 256 * 1024)
+    count = int(INITIAL_SLOTS * MAX_LOAD) + 500
+    digests = [hashlib.sha1(f'grow-{i}'.encode()).digest() for i in range(count)]
+    for i, digest in enumerate(digests):
+        shard.put(digest, blob(i, 100))
+    slots, used, active = header(shard)
+    check("the index grows before it is 70% full", slots > INITIAL_SLOTS and used <= slots * MAX_LOAD,
+          f"{used} of {slots} slots")
+    check("segments roll over at their size limit", active > 1 and all(
+        size <= 256 * 1024 for size in shard.segment_sizes().values()), str(shard.segment_sizes()))
+    missing = [i for i, digest in enumerate(digests) if shard.get(digest, 0)[1] != blob(i, 100)]
+    check("every key is read back after the rebuild", not missing, f"{len(missing)} missing")
+
+    shard = Shard(f'{root}/tombstones', 256 * 1024)
+    digests = [hashlib.sha1(f'tombstone-{i}'.encode()).digest() for i in range(1500)]
+    for digest in digests:
+        shard.put(digest, digest)
+    for digest in digests[:1100]:
+        shard.remove(digest)
+    shard.compact(0, segment_storage.COMPACT_BATCH_BYTES)
+    slots, used, _ = header(shard)
+    check("compaction drops deleted slots once they fill a quarter of the index",
+          used == 400 and all(shard.get(digest, 0)[1] == digest for digest in digests[1100:]),
+          f"{used} of {slots} slots used")
+
+
+async def test_compaction(root):
+    print_colored("\n4. Overwrites, removals and compaction...", Colors.YELLOW)
+    storage = make_storage(root, shards=2, segment_bytes=64 * 1024)
+    count = 600
+    for i in range(count):
+        await storage.put(f'img/{i}', blob(i))
+    for i in range(0, count, 2):
+        await storage.put(f'img/{i}', b'new %d' % i)
+    for i in range(1, count, 4):
+        await storage.remove(f'img/{i}')
+
+    def expected(i):
+        if i % 2 == 0:
+            return b'new %d' % i
+        return None if i % 4 == 1 else blob(i)
+
+    shards = storage.store.shards
+    before = sum(sum(shard.segment_sizes().values()) for shard in shards)
+    for _ in range(20):
+        # Each pass moves at most COMPACT_BATCH_BYTES per shard
+        if not any(shard.compact(0, segment_storage.COMPACT_BATCH_BYTES)[1] for shard in shards):
+            break
+    after = sum(sum(shard.segment_sizes().values()) for shard in shards)
+    live = sum(RECORD.size + len(expected(i)) for i in range(count) if expected(i) is not None)
+    check("compaction deletes mostly dead segments", after < before / 2, f"{before} -> {after} bytes")
+    check("what is left is mostly live records", after <= live * 2, f"{after} bytes for {live} live")
+    wrong = [i for i in range(count) if await storage.get(f'img/{i}') != expected(i)]
+    check("every key reads its latest value after compaction", not wrong, f"{len(wrong)} wrong")
+    other = make_storage(root, shards=2, segment_bytes=64 * 1024)
+    wrong = [i for i in range(count) if await other.get(f'img/{i}') != expected(i)]
+    check("another process reads the compacted shards", not wrong, f"{len(wrong)} wrong")
+
+
+async def test_expiry(root):
+    print_colored("\n5. Expiry...", Colors.YELLOW)
+    storage = make_storage(root, expiration=1)
+    await storage.put('expiring.jpg', b'soon gone')
+    check("a fresh record is a hit", await storage.get('expiring.jpg') == b'soon gone')
+    time.sleep(1.2)
+    segment_storage.SEGMENT_STORAGE_STATS['expired'] = 0
+    check("an expired record is a miss", await storage.get('expiring.jpg') is None
+          and segment_storage.SEGMENT_STORAGE_STATS['expired'] == 1)
+    check("exists() agrees", not await storage.exists('expiring.jpg'))
+    expired = sum(shard.compact(1, segment_storage.COMPACT_BATCH_BYTES)[0] for shard in storage.store.shards)
+    left = sum(sum(shard.segment_sizes().values()) for shard in storage.store.shards)
+    check("compaction drops expired records and their segments", expired == 1 and left == 0,
+          f"{expired} expired, {left} bytes left")
+
+
+async def test_torn_record(root):
+    print_colored("\n6. Torn records...", Colors.YELLOW)
+    storage = make_storage(root)
+    await storage.put('torn.jpg', b'hello world' * 10)
+    digest = storage.digest('torn.jpg')
+    shard = storage.store.shard(digest)
+    _, segment, offset, length, _ = shard.find(shard.index, digest)
+    with open(shard.segment_path(segment), 'r+b') as f:
+        f.seek(offset + RECORD.size + 3)
+        f.write(b'X')
+    check("a record failing its checksum reads as a miss", await make_storage(root).get('torn.jpg') is None)
+
+    await storage.put('short.jpg', b'hello world' * 10)
+    digest = storage.digest('short.jpg')
+    shard = storage.store.shard(digest)
+    _, segment, offset, length, _ = shard.find(shard.index, digest)
+    os.truncate(shard.segment_path(segment), offset + RECORD.size + length - 1)
+    check("a record cut short reads as a miss", await make_storage(root).get('short.jpg') is None)
+
+
+async def test_locked_shard(root):
+    print_colored("\n7. Writes to a locked shard...", Colors.YELLOW)
+    storage = make_storage(root, shards=1)
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await asyncio.sleep(0.01)
+
+    ticker = asyncio.create_task(tick())
+    # A lock of its own, as a compacting process would hold it, released
+    # from a thread so a write blocking the IOLoop cannot deadlock the test
+    with open(f'{storage.store.shards[0].root}/lock', 'ab') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        threading.Timer(0.5, fcntl.flock, (lock, fcntl.LOCK_UN)).start()
+        put = asyncio.create_task(storage.put('locked.jpg', b'waiting'))
+        await asyncio.sleep(0.3)
+        check("a write waits for the shard lock", not put.done())
+        check("the IOLoop keeps running meanwhile", ticks >= 10, f"{ticks} ticks")
+        await asyncio.wait_for(put, 5)
+    ticker.cancel()
+    check("the write lands once the lock is released", await storage.get('locked.jpg') == b'waiting')
+
+
+def write_from_process(root, number):
+    storage = make_storage(root, shards=1)
+
+    async def write():
+        for i in range(WRITES_PER_PROCESS):
+            await storage.put(f'p{number}/{i}', blob(number * 100000 + i))
+
+    asyncio.run(write())
+
+
+async def test_processes(root):
+    print_colored("\n8. Writers in several processes...", Colors.YELLOW)
+    fork = multiprocessing.get_context('fork')
+    processes = [fork.Process(target=write_from_process, args=(root, number))
+                 for number in range(WRITER_PROCESSES)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    check("every writer exits cleanly", all(process.exitcode == 0 for process in processes))
+    storage = make_storage(root, shards=1)
+    wrong = [
+        (number, i) for number in range(WRITER_PROCESSES) for i in range(WRITES_PER_PROCESS)
+        if await storage.get(f'p{number}/{i}') != blob(number * 100000 + i)
+    ]
+    check(f"all {WRITER_PROCESSES * WRITES_PER_PROCESS} records of the shared shard are read back",
+          not wrong, f"{len(wrong)} wrong")
+
+
+def main():
+    print_banner("Segment Storage Test")
+
+    async def run(root):
+        await test_round_trip(f'{root}/round-trip')
+        test_probing(f'{root}/probing')
+        test_growth(f'{root}/growth')
+        await test_compaction(f'{root}/compaction')
+        await test_expiry(f'{root}/expiry')
+        await test_torn_record(f'{root}/torn')
+        await test_locked_shard(f'{root}/locked')
+        await test_processes(f'{root}/processes')
+
+    with tempfile.TemporaryDirectory() as root:
+        asyncio.run(run(root))
+
+    finish()
+
+
+if __name__ == "__main__":
+    main()
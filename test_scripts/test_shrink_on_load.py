@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Shrink-on-Load Test
+Runs a thumbor application with the thumbor_azure.engines.opencv engine in
+process, once with SHRINK_ON_LOAD and once without, on a large JPEG whose
+red and green channels encode the x and y of each pixel. Checks that
+requests decode at the smallest scale they allow, that manual crops given in
+original pixels land on the same part of the image when the original was
+decoded smaller, and that requests give their decode budget back through
+thumbor's own handlers: on encoding, failed or not, without the garbage
+collector, and when their engine is collected if they fail before that.
+
+Run it where thumbor and thumbor_azure are importable, e.g. in the container:
+    docker cp test_scripts/test_shrink_on_load.py thumbor-dev:/tmp/
+    docker cp test_scripts/checks.py thumbor-dev:/tmp/
+    docker exec -w /app thumbor-dev python3.11 /tmp/test_shrink_on_load.py
+"""
+
+import gc
+import io
+import asyncio
+import tempfile
+
+import numpy as np
+from PIL import Image
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+from thumbor.config import Config
+from thumbor.context import Context, ServerParameters
+from thumbor.handler_lists import BUILTIN_HANDLERS
+from thumbor.importer import Importer
+from thumbor.server import get_application
+
+from checks import Colors, check, finish, print_banner, print_colored
+from thumbor_azure.engines import opencv
+
+ORIGINAL_SIZE = (4000, 3000)
+PSNR_MINIMUM = 30
+
+
+def psnr(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    if a.shape != b.shape:
+        return 0
+    mse = ((a - b) ** 2).mean()
+    return float('inf') if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def coordinate_image():
+    """Red grows with x and green with y, so a crop's mean color says where it came from"""
+    width, height = ORIGINAL_SIZE
+    red = np.linspace(0, 255, width, dtype=np.float32)[np.newaxis, :].repeat(height, 0)
+    green = np.linspace(0, 255, height, dtype=np.float32)[:, np.newaxis].repeat(width, 1)
+    array = np.dstack((red, green, np.full((height, width), 128, dtype=np.float32))).astype(np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(array).save(buffer, 'JPEG', quality=95)
+    return buffer.getvalue()
+
+
+def expected_color(left, top, right, bottom):
+    """Mean (red, green) of a box of coordinate_image"""
+    width, height = ORIGINAL_SIZE
+    return ((left + right - 1) / 2 * 255 / (width - 1), (top + bottom - 1) / 2 * 255 / (height - 1))
+
+
+class Decodes:
+    """Records the size each rendered original was decoded at"""
+
+    def __init__(self):
+        self.sizes = []
+        self.load = opencv.Engine.load
+
+    def __enter__(self):
+        load = self.load
+        sizes = self.sizes
+
+        def recording_load(engine, buffer, extension):
+            load(engine, buffer, extension)
+            if getattr(engine.context.request, 'engine', None) is engine:
+                sizes.append(engine.size)
+
+        opencv.Engine.load = recording_load
+        return self
+
+    def __exit__(self, *exc):
+        opencv.Engine.load = self.load
+
+
+class patched:
+    """Replace an attribute for the duration of a with block"""
+
+    def __init__(self, owner, name, value):
+        self.owner, self.name, self.value = owner, name, value
+
+    def __enter__(self):
+        self.saved = getattr(self.owner, self.name)
+        setattr(self.owner, self.name, self.value)
+
+    def __exit__(self, *exc):
+        setattr(self.owner, self.name, self.saved)
+
+
+def build_app(root, shrink_on_load, handler_lists=BUILTIN_HANDLERS + ['thumbor_azure.handler_lists.single_flight']):
+    config = Config(
+        SECURITY_KEY='shrink-on-load-test',
+        ALLOW_UNSAFE_URL=True,
+        LOADER='thumbor.loaders.file_loader',
+        FILE_LOADER_ROOT_PATH=root,
+        STORAGE='thumbor.storages.no_storage',
+        RESULT_STORAGE=None,
+        ENGINE='thumbor_azure.engines.opencv',
+        SHRINK_ON_LOAD=shrink_on_load,
+        DECODED_FRAME_CACHE_MAX_BYTES=0,
+        QUALITY=95,
+        HANDLER_LISTS=handler_lists,
+        SINGLE_FLIGHT_REDIS=False,
+    )
+    importer = Importer(config)
+    importer.import_modules()
+    server = ServerParameters(None, 'localhost', None, None, 'info', 'thumbor.app.ThumborServiceApp')
+    return get_application(Context(server=server, config=config, importer=importer))
+
+
+async def fetch(base, path):
+    response = await AsyncHTTPClient().fetch(base + path, raise_error=False)
+    if response.code != 200:
+        return response.code, None
+    return response.code, Image.open(io.BytesIO(response.body)).convert('RGB')
+
+
+async def render(shrunk, full, path):
+    """(decoded size, image) of path with and without shrink on load"""
+    with Decodes() as decodes:
+        code, image = await fetch(shrunk, path)
+        _, reference = await fetch(full, path)
+    return code, decodes.sizes[0] if decodes.sizes else None, image, reference
+
+
+async def test_shrink(shrunk, full):
+    print_colored("\n1. Decode scale...", Colors.YELLOW)
+    code, size, image, reference = await render(shrunk, full, '/unsafe/300x200/image.jpg')
+    check("a 300x200 thumbnail of 4000x3000 decodes at 1/4", size == (1000, 750), str(size))
+    score = psnr(image, reference) if code == 200 else 0
+    check(f"it looks like a full decode (PSNR {score:.1f})",
+          image is not None and image.size == (300, 200) and score >= PSNR_MINIMUM, str(code))
+
+    code, size, image, _ = await render(shrunk, full, '/unsafe/fit-in/200x200/image.jpg')
+    check("fit-in keeps twice the output size", size == (500, 375) and image.size == (200, 150),
+          f"{size} {image.size if image else code}")
+
+    code, size, image, _ = await render(shrunk, full, '/unsafe/1600x0/image.jpg')
+    check("large outputs decode at full size", size == ORIGINAL_SIZE, str(size))
+
+    code, size, image, _ = await render(shrunk, full, '/unsafe/300x200/smart/image.jpg')
+    check("smart crops decode at full size", size == ORIGINAL_SIZE, str(size))
+
+
+async def test_crop_translation(shrunk, full):
+    print_colored("\n2. Manual crops on a shrunk decode...", Colors.YELLOW)
+    for left, top, right, bottom in ((1000, 500, 2000, 1500), (3000, 2000, 4000, 3000), (0, 0, 800, 600)):
+        path = f'/unsafe/{left}x{top}:{right}x{bottom}/100x100/image.jpg'
+        code, size, image, reference = await render(shrunk, full, path)
+        box = f'{left}x{top}:{right}x{bottom}'
+        check(f"{box} is shrunk on load", size is not None and size[0] < ORIGINAL_SIZE[0], str(size))
+        if image is None:
+            check(f"{box} renders", False, str(code))
+            continue
+        red, green = np.asarray(image, dtype=np.float64)[..., :2].mean(axis=(0, 1))
+        expected_red, expected_green = expected_color(left, top, right, bottom)
+        check(f"{box} lands on the same pixels",
+              abs(red - expected_red) < 3 and abs(green - expected_green) < 3,
+              f"mean ({red:.1f}, {green:.1f}), expected ({expected_red:.1f}, {expected_green:.1f})")
+        score = psnr(image, reference)
+        check(f"{box} looks like a full decode (PSNR {score:.1f})", score >= PSNR_MINIMUM)
+
+
+async def test_budget(plain, root):
+    """Through thumbor's own handlers only, which never clean a request up"""
+    print_colored("\n3. Decode budget...", Colors.YELLOW)
+    check("finished requests hold no budget", opencv.decode_budget.in_use == 0,
+          f"{opencv.decode_budget.in_use} bytes")
+
+    def failing_encode(engine, extension=None, quality=None):
+        raise RuntimeError('encoder failed')
+
+    def failing_read(engine, extension=None, quality=None):
+        engine.array  # decoded, then the request fails before encoding
+        raise RuntimeError('request failed')
+
+    gc.disable()
+    try:
+        with patched(opencv.PILEngine, 'read', failing_encode):
+            code, _ = await fetch(plain, '/unsafe/300x200/image.jpg')
+        check("a request failing to encode answers 500", code == 500, str(code))
+        check("it gives the budget back without the garbage collector", opencv.decode_budget.in_use == 0,
+              f"{opencv.decode_budget.in_use} bytes")
+
+        with patched(opencv.Engine, 'read', failing_read):
+            code, _ = await fetch(plain, '/unsafe/300x200/image.jpg')
+        check("a request failing before encoding answers 500", code == 500, str(code))
+        held = opencv.decode_budget.in_use
+        gc.collect()
+        check("its engine gives the budget back when collected, with its frame",
+              held > 0 and opencv.decode_budget.in_use == 0, f"{held} bytes, then {opencv.decode_budget.in_use}")
+    finally:
+        gc.enable()
+
+    config = Config(ENGINE='thumbor_azure.engines.opencv', DECODED_FRAME_CACHE_MAX_BYTES=0)
+    importer = Importer(config)
+    importer.import_modules()
+    context = Context(config=config, importer=importer)
+    with open(f'{root}/image.jpg', 'rb') as f:
+        buffer = f.read()
+    engine = context.modules.engine
+    engine.load(buffer, '.jpg')
+    engine.array
+    # A second engine of the same request, as the watermark filter creates
+    watermark = engine.__class__(context)
+    watermark.load(buffer, '.jpg')
+    watermark.array
+    check("decoded frames are charged to the budget",
+          opencv.decode_budget.in_use == 2 * ORIGINAL_SIZE[0] * ORIGINAL_SIZE[1] * 3,
+          f"{opencv.decode_budget.in_use} bytes")
+    context.modules.cleanup()
+    check("cleanup gives back what every engine of the request holds", opencv.decode_budget.in_use == 0,
+          f"{opencv.decode_budget.in_use} bytes")
+
+
+def main():
+    print_banner("Shrink-on-Load Test")
+
+    async def run(root):
+        servers = []
+        bases = []
+        for app in (build_app(root, True), build_app(root, False), build_app(root, True, BUILTIN_HANDLERS)):
+            sock, port = bind_unused_port()
+            server = HTTPServer(app)
+            server.add_sockets([sock])
+            servers.append(server)
+            bases.append(f'http://127.0.0.1:{port}')
+        try:
+            await test_shrink(*bases[:2])
+            await test_crop_translation(*bases[:2])
+            await test_budget(bases[2], root)
+        finally:
+            for server in servers:
+                server.stop()
+
+    with tempfile.TemporaryDirectory() as root:
+        with open(f'{root}/image.jpg', 'wb') as f:
+            f.write(coordinate_image())
+        asyncio.run(run(root))
+
+    finish()
+
+
+if __name__ == "__main__":
+    main()
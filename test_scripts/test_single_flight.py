@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Single-Flight Handler Test
+Runs a thumbor application with thumbor_azure.handler_lists.single_flight in
+process, behind a loader that counts and delays loads, and checks that
+identical concurrent requests load and render once, that Accept variants
+and different operations get flights of their own, and, with Redis, that a
+follower serves a remote leader's hand-off and leaders release their lock.
+
+Run it where thumbor and thumbor_azure are importable, e.g. in the container:
+    docker cp test_scripts/test_single_flight.py thumbor-dev:/tmp/
+    docker cp test_scripts/checks.py thumbor-dev:/tmp/
+    docker exec -w /app thumbor-dev python3.11 /tmp/test_single_flight.py
+"""
+
+import io
+import asyncio
+import hashlib
+import argparse
+import tempfile
+
+import redis
+from PIL import Image
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+from thumbor.config import Config
+from thumbor.context import Context, ServerParameters
+from thumbor.handler_lists import BUILTIN_HANDLERS
+from thumbor.importer import Importer
+from thumbor.loaders import file_loader
+from thumbor.server import get_application
+
+from checks import Colors, check, finish, print_banner, print_colored
+from thumbor_azure.handlers import single_flight
+
+REDIS_HOST = 'localhost'
+REDIS_PORT = 6379
+REDIS_DB = 0
+LOAD_DELAY = 0.3
+
+
+class SlowLoader:
+    """file_loader that counts loads and holds each one for LOAD_DELAY, so
+    concurrent requests overlap"""
+
+    def __init__(self):
+        self.loads = 0
+
+    async def load(self, context, path):
+        self.loads += 1
+        await asyncio.sleep(LOAD_DELAY)
+        return await file_loader.load(context, path)
+
+
+def build_app(root, use_redis, args):
+    config = Config(
+        SECURITY_KEY='single-flight-test',
+        ALLOW_UNSAFE_URL=True,
+        LOADER='thumbor.loaders.file_loader',
+        FILE_LOADER_ROOT_PATH=root,
+        STORAGE='thumbor.storages.no_storage',
+        RESULT_STORAGE=None,
+        AUTO_WEBP=True,
+        HANDLER_LISTS=BUILTIN_HANDLERS + ['thumbor_azure.handler_lists.single_flight'],
+        SINGLE_FLIGHT_ENABLED=True,
+        SINGLE_FLIGHT_REDIS=use_redis,
+        SINGLE_FLIGHT_WAIT_SECONDS=5,
+        REDIS_STORAGE_SERVER_HOST=args.redis_host,
+        REDIS_STORAGE_SERVER_PORT=args.redis_port,
+        REDIS_STORAGE_SERVER_DB=args.redis_db,
+        REDIS_STORAGE_SERVER_PASSWORD=None,
+    )
+    importer = Importer(config)
+    importer.import_modules()
+    loader = SlowLoader()
+    importer.loader = loader
+    server = ServerParameters(None, 'localhost', None, None, 'info', 'thumbor.app.ThumborServiceApp')
+    return get_application(Context(server=server, config=config, importer=importer)), loader
+
+
+async def fetch_all(base, paths, accept=None):
+    client = AsyncHTTPClient()
+    headers = {'Accept': accept} if accept else {}
+    responses = await asyncio.gather(*(
+        client.fetch(base + path, headers=headers, raise_error=False) for path in paths
+    ))
+    return [(response.code, response.body) for response in responses]
+
+
+def reset_stats():
+    for event in single_flight.FLIGHT_STATS:
+        single_flight.FLIGHT_STATS[event] = 0
+
+
+async def test_local(base, loader):
+    print_colored("\n1. Collapsing inside a process...", Colors.YELLOW)
+    reset_stats()
+    responses = await fetch_all(base, ['/unsafe/120x80/image.jpg'] * 5)
+    check("every follower gets a 200", all(code == 200 for code, _ in responses),
+          str([code for code, _ in responses]))
+    check("followers get the leader's bytes", len({body for _, body in responses}) == 1)
+    check("the original is loaded once", loader.loads == 1, f"{loader.loads} loads")
+    check("one leader, four local followers",
+          single_flight.FLIGHT_STATS['leader'] == 1 and single_flight.FLIGHT_STATS['collapsed_local'] == 4,
+          str(single_flight.FLIGHT_STATS))
+    check("finished flights are forgotten", not single_flight.in_flight)
+
+    print_colored("\n2. Separate flights...", Colors.YELLOW)
+    loader.loads = 0
+    webp, default = await asyncio.gather(
+        fetch_all(base, ['/unsafe/120x80/image.jpg'] * 2, 'image/webp,*/*'),
+        fetch_all(base, ['/unsafe/120x80/image.jpg'] * 2, 'image/jpeg'),
+    )
+    check("Accept variants render separately", loader.loads == 2, f"{loader.loads} loads")
+    check("each variant gets its own format",
+          webp[0][1][8:12] == b'WEBP' and default[0][1][:2] == b'\xff\xd8')
+    loader.loads = 0
+    await fetch_all(base, ['/unsafe/120x80/image.jpg', '/unsafe/60x40/image.jpg'])
+    check("different operations render separately", loader.loads == 2, f"{loader.loads} loads")
+
+
+async def test_remote(base, loader, r):
+    print_colored("\n3. Hand-off between processes through Redis...", Colors.YELLOW)
+    path = '/unsafe/100x100/image.jpg'
+    key = hashlib.sha1(f"{path.lstrip('/').split('/', 1)[-1]}|default|".encode()).hexdigest()
+    r.delete(single_flight.LOCK_PREFIX + key, single_flight.RESULT_PREFIX + key)
+
+    # Another process leads: it holds the lock and hands its result off later
+    r.set(single_flight.LOCK_PREFIX + key, 'other-process', px=5000)
+    handed_off = single_flight.Flight(b'rendered elsewhere', 'image/jpeg', 60, False)
+
+    async def remote_leader():
+        await asyncio.sleep(0.2)
+        r.hset(single_flight.RESULT_PREFIX + key, mapping=handed_off.to_redis())
+
+    reset_stats()
+    loader.loads = 0
+    [(code, body)], _ = await asyncio.gather(fetch_all(base, [path], 'image/jpeg'), remote_leader())
+    check("the follower serves the remote leader's result", code == 200 and body == b'rendered elsewhere',
+          f"{code} {body[:20]!r}")
+    check("nothing is loaded locally", loader.loads == 0, f"{loader.loads} loads")
+    check("counted as collapsed_remote", single_flight.FLIGHT_STATS['collapsed_remote'] == 1,
+          str(single_flight.FLIGHT_STATS))
+    r.delete(single_flight.LOCK_PREFIX + key, single_flight.RESULT_PREFIX + key)
+
+    # The remote leader dies without a hand-off: its lock expires, we render
+    r.set(single_flight.LOCK_PREFIX + key, 'other-process', px=300)
+    reset_stats()
+    [(code, body)] = await fetch_all(base, [path], 'image/jpeg')
+    check("a lost remote leader falls back to rendering", code == 200 and body[:2] == b'\xff\xd8'
+          and single_flight.FLIGHT_STATS['fallback'] == 1, str(single_flight.FLIGHT_STATS))
+
+    reset_stats()
+    await fetch_all(base, ['/unsafe/90x90/image.jpg'], 'image/jpeg')
+    # The lock is released once thumbor is done with the result storage,
+    # just after the response has been written
+    for _ in range(20):
+        leftover = list(r.scan_iter(f'{single_flight.LOCK_PREFIX}*'))
+        if not leftover:
+            break
+        await asyncio.sleep(0.05)
+    check("leaders release their lock", single_flight.FLIGHT_STATS['leader'] == 1 and not leftover,
+          f"{leftover}")
+    r.delete(*r.keys(f'{single_flight.RESULT_PREFIX}*'), single_flight.STATS_KEY)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the single-flight imaging handler')
+    parser.add_argument('--redis-host', default=REDIS_HOST)
+    parser.add_argument('--redis-port', type=int, default=REDIS_PORT)
+    parser.add_argument('--redis-db', type=int, default=REDIS_DB)
+    parser.add_argument('--no-redis', action='store_true', help='skip the cross-process checks')
+    args = parser.parse_args()
+
+    print_banner("Single-Flight Handler Test")
+
+    r = None
+    if not args.no_redis:
+        try:
+            r = redis.Redis(host=args.redis_host, port=args.redis_port, db=args.redis_db)
+            r.ping()
+        except redis.RedisError as e:
+            print_colored(f"   ⚠ Redis unavailable, skipping the cross-process checks: {e}", Colors.YELLOW)
+            r = None
+
+    async def run(root):
+        sock, port = bind_unused_port()
+        app, loader = build_app(root, r is not None, args)
+        server = HTTPServer(app)
+        server.add_sockets([sock])
+        base = f'http://127.0.0.1:{port}'
+        try:
+            await test_local(base, loader)
+            if r is not None:
+                await test_remote(base, loader, r)
+        finally:
+            server.stop()
+
+    with tempfile.TemporaryDirectory() as root:
+        buffer = io.BytesIO()
+        Image.linear_gradient('L').resize((640, 480)).convert('RGB').save(buffer, 'JPEG')
+        with open(f'{root}/image.jpg', 'wb') as f:
+            f.write(buffer.getvalue())
+        asyncio.run(run(root))
+
+    finish()
+
+
+if __name__ == "__main__":
+    main()
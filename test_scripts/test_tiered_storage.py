@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Tiered Result Storage Test
+Checks thumbor_azure.result_storages.tiered_storage in process, without
+Redis or Azure: the memory LRU's byte accounting, disk tier expiry, that the
+disk tier is shared by the per-request Storage instances and sweeps in the
+background once enough was written, and that a backend hit survives a disk
+tier that cannot be written.
+
+Run it where thumbor and thumbor_azure are importable, e.g. in the container:
+    docker cp test_scripts/test_tiered_storage.py thumbor-dev:/tmp/
+    docker cp test_scripts/checks.py thumbor-dev:/tmp/
+    docker exec -w /app thumbor-dev python3.11 /tmp/test_tiered_storage.py
+"""
+
+import os
+import time
+import asyncio
+import tempfile
+import threading
+
+from thumbor.config import Config
+from thumbor.context import Context, RequestParameters
+
+from checks import Colors, check, finish, print_banner, print_colored
+from thumbor_azure.result_storages import tiered_storage
+from thumbor_azure.result_storages.tiered_storage import DiskTier, MemoryLRU
+
+
+def make_context(root, disk_max_bytes, url, backend='none'):
+    config = Config(
+        RESULT_STORAGE_FILE_STORAGE_ROOT_PATH=root,
+        TIERED_RESULT_STORAGE_MEMORY_MAX_BYTES=1024 * 1024,
+        TIERED_RESULT_STORAGE_DISK_MAX_BYTES=disk_max_bytes,
+        TIERED_RESULT_STORAGE_BACKEND=backend,
+        AUTO_WEBP=False,
+    )
+    context = Context(config=config)
+    context.request = RequestParameters(url=url)
+    return context
+
+
+def test_memory_lru():
+    print_colored("\n1. Memory LRU byte accounting...", Colors.YELLOW)
+    lru = MemoryLRU(max_bytes=100, max_item_bytes=60)
+    lru.put('a', b'x' * 40, time.time())
+    lru.put('b', b'x' * 40, time.time())
+    check("size counts stored bytes", lru.size == 80, f"size {lru.size}")
+    lru.put('a', b'x' * 10, time.time())
+    check("overwrite replaces the old bytes", lru.size == 50, f"size {lru.size}")
+    lru.get('a', 0)
+    lru.put('c', b'x' * 60, time.time())
+    check("least recently used entry is evicted first", list(lru.items) == ['a', 'c'], str(list(lru.items)))
+    check("size matches the entries left", lru.size == sum(len(v[0]) for v in lru.items.values()),
+          f"size {lru.size}")
+    lru.put('d', b'x' * 61, time.time())
+    check("items over max_item_bytes are not kept", 'd' not in lru.items and lru.size == 70)
+    lru.put('old', b'x' * 5, time.time() - 100)
+    check("expired entries are dropped and uncounted", lru.get('old', 10) is None and lru.size == 70,
+          f"size {lru.size}")
+
+
+def test_disk_tier(root):
+    print_colored("\n2. Disk tier...", Colors.YELLOW)
+    disk = DiskTier(root, 0)
+    disk.put('abcdef', b'result')
+    found = disk.get('abcdef', 0)
+    check("stored results are read back", found is not None and found[0] == b'result')
+    check("results are sharded by key prefix", os.path.exists(f'{root}/ab/cd/abcdef'))
+    past = time.time() - 100
+    os.utime(f'{root}/ab/cd/abcdef', (past, past))
+    check("results older than max_age are misses", disk.get('abcdef', 10) is None)
+
+
+def test_shared_disk_sweep(root):
+    print_colored("\n3. Disk tier sweep across requests...", Colors.YELLOW)
+    tiered_storage.memory_tier = tiered_storage.disk_tier = None
+    max_bytes = 100 * 1024
+    storages = [
+        tiered_storage.Storage(make_context(root, max_bytes, f'/unsafe/{i}x0/image.jpg'))
+        for i in range(60)
+    ]
+    check("every request uses the process's disk tier", len({id(s.disk) for s in storages}) == 1)
+
+    started = threading.Event()
+    release = threading.Event()
+    sweep = DiskTier.sweep
+
+    def slow_sweep(self):
+        started.set()
+        release.wait(5)
+        sweep(self)
+
+    DiskTier.sweep = slow_sweep
+    try:
+        # 60 requests of 4KB: 240KB written against a 100KB budget, so the
+        # 5KB sweep threshold is crossed many times over
+        for storage in storages:
+            asyncio.run(storage.put(b'x' * 4096))
+        check("sweep starts once a twentieth of the budget is written", started.wait(5))
+        check("put does not wait for the sweep", not release.is_set())
+        release.set()
+        deadline = time.time() + 5
+        while storages[0].disk.sweeping and time.time() < deadline:
+            time.sleep(0.01)
+    finally:
+        DiskTier.sweep = sweep
+
+    total = sum(
+        os.path.getsize(os.path.join(dirpath, name))
+        for dirpath, _, names in os.walk(root) for name in names if not name.startswith('.')
+    )
+    check("one sweep runs at a time", not storages[0].disk.sweeping)
+    check("the sweep trims the tree to the budget", total <= max_bytes, f"{total} bytes left")
+
+
+def test_backfill_error(root):
+    print_colored("\n4. Backend hit with an unwritable disk tier...", Colors.YELLOW)
+
+    class Backend:
+        async def get(self, key, max_age):
+            return b'backend result', time.time()
+
+    tiered_storage.memory_tier = tiered_storage.disk_tier = None
+    storage = tiered_storage.Storage(make_context(root, 0, '/unsafe/300x0/backend.jpg'))
+    storage.backend = Backend()
+
+    def full(key, buffer):
+        raise OSError(28, 'No space left on device')
+
+    storage.disk.put = full
+    try:
+        result = asyncio.run(storage.get())
+    except OSError as e:
+        result = e
+    check("the backend result is still served", getattr(result, 'buffer', None) == b'backend result',
+          repr(result))
+
+
+def main():
+    print_banner("Tiered Result Storage Test")
+
+    with tempfile.TemporaryDirectory() as root:
+        test_memory_lru()
+        test_disk_tier(f'{root}/disk')
+        test_shared_disk_sweep(f'{root}/sweep')
+        test_backfill_error(f'{root}/backfill')
+
+    finish()
+
+
+if __name__ == "__main__":
+    main()
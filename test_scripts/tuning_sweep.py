@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Thumbor Tuning Sweep
+Starts the container once per point of a parameter grid (THUMBOR_NUM_PROCESSES,
+ENGINE_THREADPOOL_SIZE, HTTP_LOADER_MAX_CONN_PER_HOST), runs the same
+benchmark_stack.py workload inside it, and recommends the configuration with
+the best throughput per CPU core.
+
+Usage:
+    ./tuning_sweep.py --image thumbor-azure:latest --processes 2,4,8 --engine-threads 5,10,20 --cpus 4
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import subprocess
+import requests
+
+BENCHMARK_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_stack.py')
+HOST_PORT = 18080
+STARTUP_TIMEOUT = 180
+
+class Colors:
+    """ANSI color codes for terminal output"""
+    RED = '\033[0;31m'
+    GREEN = '\033[0;32m'
+    YELLOW = '\033[1;33m'
+    BLUE = '\033[0;34m'
+    NC = '\033[0m'  # No Color
+
+def print_colored(message, color=Colors.NC):
+    """Print message with color"""
+    print(f"{color}{message}{Colors.NC}")
+
+def int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+def docker(*args, check=True, capture=True):
+    """Run a docker command and return its stdout"""
+    result = subprocess.run(['docker', *args], capture_output=capture, text=True)
+    if check and result.returncode != 0:
+        raise RuntimeError(f"docker {' '.join(args)} failed with exit code {result.returncode}: {(result.stderr or '').strip()}")
+    return result.stdout.strip() if capture else ''
+
+def start_stack(image, name, port, cpus, env):
+    """Start the container with the given settings and wait for /healthcheck"""
+    docker('rm', '-f', name, check=False)
+    args = ['run', '-d', '--name', name, '-p', f'{port}:80']
+    if cpus:
+        args += ['--cpus', str(cpus)]
+    for key, value in env.items():
+        args += ['-e', f'{key}={value}']
+    docker(*args, image)
+
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        try:
+            if requests.get(f'http://localhost:{port}/healthcheck', timeout=2).status_code == 200:
+                # Give every thumbor process time to bind, not just the first one
+                time.sleep(5)
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(2)
+    logs = docker('logs', '--tail', '50', name, check=False)
+    raise RuntimeError(f"stack did not become healthy within {STARTUP_TIMEOUT}s\n{logs}")
+
+def run_workload(name, args):
+    """Run benchmark_stack.py inside the container and return its JSON report"""
+    docker('cp', BENCHMARK_SCRIPT, f'{name}:/tmp/benchmark_stack.py')
+    docker('exec', name, 'python3.11', '/tmp/benchmark_stack.py',
+           '--thumbor-url', 'http://localhost:80',
+           '--scenarios', args.scenarios,
+           '--concurrency', str(args.concurrency),
+           '--repeat', str(args.repeat),
+           '--output', '/tmp/benchmark.json',
+           capture=not args.verbose)
+    return json.loads(docker('exec', name, 'cat', '/tmp/benchmark.json'))
+
+def summarize(report):
+    """Aggregate warm-phase throughput, p95 and CPU cores used over all scenarios"""
+    requests_total = seconds = cpu_seconds = 0.0
+    p95 = []
+    errors = 0
+    for phases in report['scenarios'].values():
+        for phase_name, phase in phases.items():
+            errors += sum(phase['errors'].values())
+            if not phase_name.endswith('_warm'):
+                continue
+            requests_total += phase['succeeded']
+            seconds += phase['seconds']
+            if phase['latency']['p95'] is not None:
+                p95.append(phase['latency']['p95'])
+            cpu_seconds += sum(group['cpu_seconds'] for group in (phase['processes'] or {}).values())
+    throughput = requests_total / seconds if seconds else 0.0
+    # Cores actually consumed by the stack while serving the warm phases
+    cores = cpu_seconds / seconds if seconds else 0.0
+    return {
+        'throughput_rps': round(throughput, 2),
+        'cores_used': round(cores, 2),
+        'rps_per_core': round(throughput / cores, 2) if cores else None,
+        'p95_max': max(p95) if p95 else None,
+        'errors': errors,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep thumbor process/thread settings and recommend the best one')
+    parser.add_argument('--image', required=True, help='container image to test')
+    parser.add_argument('--processes', type=int_list, default=[2, 4, 8], help='THUMBOR_NUM_PROCESSES values')
+    parser.add_argument('--engine-threads', type=int_list, default=[10], help='ENGINE_THREADPOOL_SIZE values')
+    parser.add_argument('--loader-conns', type=int_list, default=[30], help='HTTP_LOADER_MAX_CONN_PER_HOST values')
+    parser.add_argument('--cpus', type=float, help='docker --cpus limit, so points are comparable')
+    parser.add_argument('--scenarios', default='resize,smart,filter-chain', help='benchmark_stack.py scenarios')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--max-errors', type=int, default=0, help='points with more errors are not recommended')
+    parser.add_argument('--port', type=int, default=HOST_PORT)
+    parser.add_argument('--name', default='thumbor-sweep')
+    parser.add_argument('--output', default='tuning-sweep.json')
+    parser.add_argument('--verbose', action='store_true', help='show benchmark output')
+    args = parser.parse_args()
+
+    grid = list(itertools.product(args.processes, args.engine_threads, args.loader_conns))
+    print_colored(f"\nSweeping {len(grid)} configurations of {args.image}", Colors.BLUE)
+
+    points = []
+    try:
+        for processes, engine_threads, loader_conns in grid:
+            env = {
+                'THUMBOR_NUM_PROCESSES': processes,
+                'ENGINE_THREADPOOL_SIZE': engine_threads,
+                'HTTP_LOADER_MAX_CONN_PER_HOST': loader_conns,
+            }
+            label = f"processes={processes} engine_threads={engine_threads} loader_conns={loader_conns}"
+            print_colored(f"\n{label}", Colors.YELLOW)
+            try:
+                start_stack(args.image, args.name, args.port, args.cpus, env)
+                summary = summarize(run_workload(args.name, args))
+            except RuntimeError as e:
+                print_colored(f"   ✗ {e}", Colors.RED)
+                points.append({'settings': env, 'error': str(e)})
+                continue
+            finally:
+                docker('rm', '-f', args.name, check=False)
+            print(f"   {summary['throughput_rps']} req/s on {summary['cores_used']} cores "
+                  f"({summary['rps_per_core']} req/s per core), p95 {summary['p95_max']}s, "
+                  f"{summary['errors']} errors")
+            points.append({'settings': env, **summary})
+    except KeyboardInterrupt:
+        print_colored("\nSweep interrupted, reporting completed points", Colors.YELLOW)
+
+    eligible = [p for p in points if p.get('rps_per_core') and p['errors'] <= args.max_errors]
+    best = max(eligible, key=lambda p: p['rps_per_core'], default=None)
+    fastest = max(eligible, key=lambda p: p['throughput_rps'], default=None)
+
+    with open(args.output, 'w') as f:
+        json.dump({'image': args.image, 'cpus': args.cpus, 'points': points,
+                   'best_per_core': best, 'best_throughput': fastest}, f, indent=2, sort_keys=True)
+
+    print_colored("\n" + "=" * 50, Colors.BLUE)
+    if not best:
+        print_colored("No configuration completed without errors", Colors.RED)
+        sys.exit(1)
+    print_colored("Recommended (best throughput per core):", Colors.GREEN)
+    for key, value in best['settings'].items():
+        print(f"  {key}={value}")
+    print(f"  -> {best['rps_per_core']} req/s per core, {best['throughput_rps']} req/s total")
+    if fastest is not best:
+        print(f"Highest total throughput: {fastest['settings']} ({fastest['throughput_rps']} req/s)")
+    print(f"\nAll points written to {args.output}")
+
+if __name__ == "__main__":
+    main()
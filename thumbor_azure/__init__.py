@@ -0,0 +1,4 @@
+"""
+Thumbor extensions for the thumbor-azure container
+Storage, loader and engine modules selectable from thumbor.conf
+"""
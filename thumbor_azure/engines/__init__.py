@@ -0,0 +1 @@
+"""Engines for thumbor"""
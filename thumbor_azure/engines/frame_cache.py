@@ -0,0 +1,92 @@
+"""
+Decoded frame cache for the OpenCV engine
+Keeps the arrays originals decode to, keyed by source (image URL and a
+checksum of its bytes) and decoded size, so the requests of a srcset burst,
+which all load the same original, decode it once per decode scale. Only the
+exact size is reused: libjpeg decodes at 1/8 scale faster than the engine
+resizes a frame twice as large, so a larger cached frame is no shortcut.
+Frames are shared between requests and never written to.
+
+thumbor.conf:
+    DECODED_FRAME_CACHE_MAX_BYTES = 256 * 1024 * 1024
+    DECODED_FRAME_CACHE_MAX_ITEM_BYTES = 64 * 1024 * 1024
+    DECODED_FRAME_CACHE_WAIT_SECONDS = 10
+"""
+
+import zlib
+import threading
+from collections import OrderedDict
+
+# Per-process counters, also sent to thumbor's METRICS as decoded_frame_cache.<event>
+FRAME_CACHE_STATS = {'hit': 0, 'miss': 0, 'coalesced': 0}
+
+
+def frame_source(url, buffer):
+    # The checksum keeps a changed original at the same URL from being served
+    # from an old frame
+    return url, len(buffer), zlib.crc32(buffer)
+
+
+class FrameLRU:
+    """Byte-budgeted LRU of decoded frames shared by the engine threadpool
+
+    Frames are charged their pixel bytes, so one 12000x9000 frame pushes out
+    as much as a hundred small ones.
+    """
+
+    def __init__(self, max_bytes, max_item_bytes):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.size = 0
+        # (source, width, height) -> read-only uint8 array
+        self.frames = OrderedDict()
+        # (source, width, height) -> Event set when its decode in progress ends
+        self.decoding = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.frames.move_to_end(key)
+            return frame
+
+    def acquire(self, key, wait=True):
+        """Look up a frame
+
+        Returns ('hit', frame); ('wait', event) when another thread is
+        decoding it and wait is set; or ('decode', None), after which the
+        caller decodes and must call release().
+        """
+        with self.lock:
+            frame = self.frames.get(key)
+            if frame is not None:
+                self.frames.move_to_end(key)
+                return 'hit', frame
+            if wait and key in self.decoding:
+                return 'wait', self.decoding[key]
+            self.decoding.setdefault(key, threading.Event())
+            return 'decode', None
+
+    def release(self, key, frame):
+        """Finish a decode claimed by acquire(); frame is None if it failed"""
+        with self.lock:
+            if frame is not None:
+                self.put(key, frame)
+            event = self.decoding.pop(key, None)
+            if event is not None:
+                event.set()
+
+    def put(self, key, frame):
+        if frame.nbytes > self.max_item_bytes or frame.nbytes > self.max_bytes:
+            return
+        frame.flags.writeable = False
+        old = self.frames.pop(key, None)
+        if old is not None:
+            self.size -= old.nbytes
+        self.frames[key] = frame
+        self.size += frame.nbytes
+        # Evict least recently used frames until the pixels fit the budget
+        while self.size > self.max_bytes:
+            _, evicted = self.frames.popitem(last=False)
+            self.size -= evicted.nbytes
@@ -0,0 +1 @@
+"""Filters for thumbor"""
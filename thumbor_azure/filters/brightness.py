@@ -0,0 +1,12 @@
+"""thumbor's brightness filter, applied to the engine's array when it has one"""
+
+from thumbor.filters import BaseFilter, filter_method
+from thumbor.filters import brightness
+
+
+class Filter(brightness.Filter):
+    @filter_method(BaseFilter.Number)
+    async def brightness(self, value):
+        if not hasattr(self.engine, 'adjust_brightness'):
+            return await super().brightness(value)
+        self.engine.adjust_brightness(value)
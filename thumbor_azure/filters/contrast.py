@@ -0,0 +1,12 @@
+"""thumbor's contrast filter, applied to the engine's array when it has one"""
+
+from thumbor.filters import BaseFilter, filter_method
+from thumbor.filters import contrast
+
+
+class Filter(contrast.Filter):
+    @filter_method(BaseFilter.Number)
+    async def contrast(self, value):
+        if not hasattr(self.engine, 'adjust_contrast'):
+            return await super().contrast(value)
+        self.engine.adjust_contrast(value)
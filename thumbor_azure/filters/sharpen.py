@@ -0,0 +1,12 @@
+"""thumbor's sharpen filter, applied to the engine's array when it has one"""
+
+from thumbor.filters import BaseFilter, filter_method
+from thumbor.filters import sharpen
+
+
+class Filter(sharpen.Filter):
+    @filter_method(BaseFilter.DecimalNumber, BaseFilter.DecimalNumber, BaseFilter.Boolean)
+    async def sharpen(self, amount, radius, luminance_only):
+        if not hasattr(self.engine, 'wavelet_sharpen'):
+            return await super().sharpen(amount, radius, luminance_only)
+        self.engine.wavelet_sharpen(amount, radius, luminance_only)
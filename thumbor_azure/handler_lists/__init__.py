@@ -0,0 +1 @@
+"""Handler lists for thumbor's HANDLER_LISTS setting"""
@@ -0,0 +1,15 @@
+"""
+Routes thumbor image URLs to the single-flight imaging handler
+Handler lists are registered before thumbor's catch-all imaging route, so
+listing this module in HANDLER_LISTS takes over every image request.
+"""
+
+from thumbor.url import Url
+
+from thumbor_azure.handlers.single_flight import SingleFlightImagingHandler
+
+
+def get_handlers(context):
+    return [
+        (Url.regex(), SingleFlightImagingHandler, {'context': context}),
+    ]
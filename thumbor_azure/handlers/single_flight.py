@@ -0,0 +1,281 @@
+"""
+Single-flight imaging handler for thumbor
+Identical concurrent requests, keyed on the normalized thumbor URL plus the
+output format negotiated from Accept, are rendered once. Inside a process the
+followers await the leader's future; across processes the leader holds a
+short-lived Redis lock and hands its result off through Redis, so nginx's
+least_conn spreading a burst over every worker does not multiply the loader
+fetch and engine work.
+
+thumbor.conf:
+    HANDLER_LISTS = BUILTIN_HANDLERS + ['thumbor_azure.handler_lists.single_flight']
+    SINGLE_FLIGHT_ENABLED = True
+    SINGLE_FLIGHT_REDIS = True
+    SINGLE_FLIGHT_LOCK_SECONDS = 15
+    SINGLE_FLIGHT_WAIT_SECONDS = 15
+    SINGLE_FLIGHT_RESULT_SECONDS = 5
+    SINGLE_FLIGHT_MAX_HANDOFF_BYTES = 2 * 1024 * 1024
+"""
+
+import time
+import asyncio
+import hashlib
+from urllib.parse import unquote
+from uuid import uuid4
+
+from thumbor.handlers.imaging import ImagingHandler
+from thumbor.utils import logger
+
+LOCK_PREFIX = 'thumbor:singleflight:lock:'
+RESULT_PREFIX = 'thumbor:singleflight:result:'
+# Collapsed and fallback counts summed over every process and instance
+STATS_KEY = 'thumbor:singleflight:stats'
+POLL_INTERVAL = 0.05
+
+# (setting, Accept mime type, name) of the formats thumbor negotiates from Accept
+AUTO_FORMATS = (
+    ('AUTO_AVIF', 'image/avif', 'avif'),
+    ('AUTO_HEIF', 'image/heif', 'heif'),
+    ('AUTO_WEBP', 'image/webp', 'webp'),
+)
+
+# Only delete the lock if it still holds our token; it may have expired and
+# been taken by another leader in the meantime
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Per-process counters, also sent to thumbor's METRICS as single_flight.<event>
+FLIGHT_STATS = {'leader': 0, 'collapsed_local': 0, 'collapsed_remote': 0, 'fallback': 0}
+
+# flight key -> future resolved with the Flight of this process's leader, or
+# None when the leader produced no image
+in_flight = {}
+
+
+class Flight:
+    """A rendered result as handed from a leader to its followers"""
+
+    __slots__ = ('body', 'content_type', 'max_age', 'temporary')
+
+    def __init__(self, body, content_type, max_age, temporary):
+        self.body = body
+        self.content_type = content_type
+        self.max_age = max_age
+        self.temporary = temporary
+
+    def to_redis(self):
+        return {
+            'body': self.body,
+            'content_type': self.content_type,
+            'max_age': '' if self.max_age is None else self.max_age,
+            'temporary': int(self.temporary),
+        }
+
+    @classmethod
+    def from_redis(cls, fields):
+        max_age = fields.get(b'max_age')
+        return cls(
+            fields[b'body'],
+            fields[b'content_type'].decode(),
+            int(max_age) if max_age else None,
+            fields.get(b'temporary') == b'1',
+        )
+
+
+class SingleFlightImagingHandler(ImagingHandler):
+    redis = None
+    release_script = None
+
+    def initialize(self, context):
+        super().initialize(context)
+        self.flight = None
+        self.flight_key = None
+        self.flight_lock = None
+        self.flight_metrics = None
+
+    def redis_client(self):
+        config = self.context.config
+        if not config.get('SINGLE_FLIGHT_REDIS', True):
+            return None
+        if SingleFlightImagingHandler.redis is None:
+            from redis import asyncio as aioredis
+
+            SingleFlightImagingHandler.redis = aioredis.Redis(
+                host=config.REDIS_STORAGE_SERVER_HOST,
+                port=config.REDIS_STORAGE_SERVER_PORT,
+                db=config.REDIS_STORAGE_SERVER_DB,
+                password=config.REDIS_STORAGE_SERVER_PASSWORD,
+                socket_timeout=config.get('SINGLE_FLIGHT_REDIS_TIMEOUT', 1),
+            )
+            SingleFlightImagingHandler.release_script = (
+                SingleFlightImagingHandler.redis.register_script(RELEASE_SCRIPT)
+            )
+        return SingleFlightImagingHandler.redis
+
+    def compute_flight_key(self):
+        # The first segment is the signature or 'unsafe'; both address the
+        # same operations on the same image
+        path = unquote(self.request.path).lstrip('/').split('/', 1)[-1]
+        accept = self.request.headers.get('Accept', '')
+        negotiated = [
+            name for setting, mime, name in AUTO_FORMATS
+            if self.context.config.get(setting, False) and mime in accept
+        ]
+        # The meta handler wraps its JSON in the JSONP callback argument
+        callback = self.get_argument('callback', '')
+        raw = f"{path}|{','.join(negotiated) or 'default'}|{callback}"
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    async def record(self, event):
+        FLIGHT_STATS[event] += 1
+        if self.flight_metrics:
+            self.flight_metrics.incr(f'single_flight.{event}')
+        if event == 'leader':
+            return
+        client = self.redis_client()
+        if client is not None:
+            try:
+                await client.hincrby(STATS_KEY, event, 1)
+            except Exception as e:
+                logger.debug('[SINGLE_FLIGHT] stats update failed: %s', e)
+
+    async def execute_image_operations(self):
+        config = self.context.config
+        if not config.get('SINGLE_FLIGHT_ENABLED', True):
+            return await super().execute_image_operations()
+
+        self.flight_metrics = self.context.metrics
+        key = self.compute_flight_key()
+        leader = in_flight.get(key)
+        if leader is not None:
+            return await self.follow(leader)
+
+        self.flight = asyncio.get_running_loop().create_future()
+        self.flight_key = key
+        in_flight[key] = self.flight
+        try:
+            await self.lead(key)
+        finally:
+            if not self.flight.done():
+                self.flight.set_result(None)
+            if in_flight.get(key) is self.flight:
+                del in_flight[key]
+            if self.flight_lock:
+                await self.release_lock(key)
+
+    async def follow(self, leader):
+        """Serve the result of this process's in-flight leader"""
+        timeout = self.context.config.get('SINGLE_FLIGHT_WAIT_SECONDS', 15)
+        try:
+            flight = await asyncio.wait_for(asyncio.shield(leader), timeout)
+        except asyncio.TimeoutError:
+            flight = None
+        if flight is None:
+            await self.record('fallback')
+            return await super().execute_image_operations()
+        await self.record('collapsed_local')
+        await self.write_flight(flight)
+
+    async def lead(self, key):
+        """Render the image, or wait for the leader in another process to do it"""
+        self.flight_lock = await self.acquire_lock(key)
+        if self.flight_lock is False:
+            self.flight_lock = None
+            flight = await self.wait_remote(key)
+            if flight is not None:
+                self.flight.set_result(flight)
+                await self.record('collapsed_remote')
+                await self.write_flight(flight)
+                return
+            await self.record('fallback')
+        else:
+            await self.record('leader')
+        # The result is captured in _write_results_to_client and the lock is
+        # released only after thumbor has written the result storage
+        await super().execute_image_operations()
+
+    async def acquire_lock(self, key):
+        """Lock token, False if another process holds the lock, None without Redis"""
+        client = self.redis_client()
+        if client is None:
+            return None
+        token = uuid4().hex
+        lock_ms = int(self.context.config.get('SINGLE_FLIGHT_LOCK_SECONDS', 15) * 1000)
+        try:
+            if await client.set(LOCK_PREFIX + key, token, nx=True, px=lock_ms):
+                return token
+            return False
+        except Exception as e:
+            logger.warning('[SINGLE_FLIGHT] lock failed, rendering without it: %s', e)
+            return None
+
+    async def release_lock(self, key):
+        try:
+            await self.release_script(keys=[LOCK_PREFIX + key], args=[self.flight_lock])
+        except Exception as e:
+            logger.warning('[SINGLE_FLIGHT] lock release failed: %s', e)
+        self.flight_lock = None
+
+    async def wait_remote(self, key):
+        """Poll for the remote leader's result until it appears or its lock goes away"""
+        client = self.redis_client()
+        deadline = time.monotonic() + self.context.config.get('SINGLE_FLIGHT_WAIT_SECONDS', 15)
+        try:
+            while time.monotonic() < deadline:
+                await asyncio.sleep(POLL_INTERVAL)
+                pipe = client.pipeline(transaction=False)
+                pipe.hgetall(RESULT_PREFIX + key)
+                pipe.exists(LOCK_PREFIX + key)
+                fields, locked = await pipe.execute()
+                if fields:
+                    return Flight.from_redis(fields)
+                if not locked:
+                    # Released without a hand-off (an error or a result too
+                    # large for Redis); the result storage may have it now
+                    return None
+        except Exception as e:
+            logger.warning('[SINGLE_FLIGHT] waiting for remote result failed: %s', e)
+        return None
+
+    async def hand_off(self, key, flight):
+        config = self.context.config
+        if len(flight.body) > config.get('SINGLE_FLIGHT_MAX_HANDOFF_BYTES', 2 * 1024 * 1024):
+            return
+        result_ms = int(config.get('SINGLE_FLIGHT_RESULT_SECONDS', 5) * 1000)
+        try:
+            pipe = self.redis_client().pipeline(transaction=True)
+            pipe.hset(RESULT_PREFIX + key, mapping=flight.to_redis())
+            pipe.pexpire(RESULT_PREFIX + key, result_ms)
+            await pipe.execute()
+        except Exception as e:
+            logger.warning('[SINGLE_FLIGHT] result hand-off failed: %s', e)
+
+    async def write_flight(self, flight):
+        request = self.context.request
+        # Keep the leader's cache lifetime, e.g. MAX_AGE_TEMP_IMAGE while a
+        # smart detection is still queued
+        request.max_age = flight.max_age
+        request.prevent_result_storage = flight.temporary
+        await self._write_results_to_client(flight.body, flight.content_type)
+
+    async def _write_results_to_client(self, results, content_type):
+        flight = None
+        if self.flight is not None and not self.flight.done():
+            body = getattr(results, 'buffer', results)
+            if isinstance(body, str):
+                body = body.encode()
+            request = self.context.request
+            flight = Flight(
+                body,
+                content_type,
+                request.max_age,
+                bool(request.prevent_result_storage or request.detection_error),
+            )
+            self.flight.set_result(flight)
+        await super()._write_results_to_client(results, content_type)
+        if flight is not None and self.flight_lock:
+            await self.hand_off(self.flight_key, flight)
@@ -0,0 +1 @@
+"""Loaders for thumbor"""
@@ -0,0 +1,362 @@
+"""
+Caching HTTP loader for thumbor
+Wraps thumbor.loaders.http_loader with a source cache on local disk that all
+thumbor processes of the container share. Originals are stored once per
+content hash and evicted least recently used first; a stale entry is
+revalidated with If-None-Match/If-Modified-Since instead of being fetched
+again, and concurrent loads of one URL are collapsed into a single fetch,
+within a process and across processes.
+
+thumbor.conf:
+    LOADER = 'thumbor_azure.loaders.caching_http_loader'
+    CACHING_LOADER_ROOT_PATH = '/data/thumbor/source_cache'
+    CACHING_LOADER_MAX_BYTES = 10 * 1024 * 1024 * 1024
+    CACHING_LOADER_FRESH_SECONDS = 3600
+"""
+
+import os
+import re
+import json
+import time
+import fcntl
+import socket
+import asyncio
+import hashlib
+import datetime
+from uuid import uuid4
+
+import tornado.httpclient
+
+from thumbor.loaders import LoaderResult, http_loader
+from thumbor.utils import logger
+
+from thumbor_azure.result_storages.tiered_storage import DiskTier
+
+# The http_loader validates sources against ALLOWED_SOURCES; so do we
+validate = http_loader.validate
+
+EVENTS = ('hit', 'revalidated', 'fetched', 'coalesced', 'shared', 'stale')
+
+# Per-process counters, also sent to thumbor's METRICS as source_cache.<event>
+SOURCE_CACHE_STATS = {event: 0 for event in EVENTS}
+
+MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+LOCK_POLL_INTERVAL = 0.05
+# Fetches of different URLs only wait for each other when their hashes share
+# a lock byte, one in a million
+LOCK_SLOTS = 1 << 20
+
+# URL hash -> future of the fetch this process has in flight
+in_flight = {}
+
+
+class BlobStore(DiskTier):
+    """Originals named by their sha256; reads refresh the mtime, so the
+    oldest-first sweep DiskTier runs in the background evicts the least
+    recently used originals"""
+
+    def get(self, key, max_age=0):
+        found = super().get(key, max_age)
+        if found is not None:
+            try:
+                os.utime(self.path(key))
+            except OSError:
+                pass
+        return found
+
+    def put(self, key, buffer):
+        try:
+            # Same content already stored for another URL or an earlier fetch
+            os.utime(self.path(key))
+            return
+        except OSError:
+            # Not stored, or the background sweep just removed it
+            pass
+        super().put(key, buffer)
+
+
+class SourceIndex:
+    """URL -> blob digest and HTTP validators, one small JSON file per URL"""
+
+    def __init__(self, root):
+        self.root = root.rstrip('/')
+
+    def path(self, key):
+        return f'{self.root}/{key[:2]}/{key}.json'
+
+    def get(self, key):
+        try:
+            with open(self.path(key)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, entry):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f'{path}.{uuid4().hex}'
+        with open(temp, 'w') as f:
+            json.dump(entry, f)
+        os.replace(temp, path)
+
+    def remove(self, key):
+        try:
+            os.remove(self.path(key))
+        except OSError:
+            pass
+
+
+class FetchLock:
+    """Cross-process lock on one byte of a shared lock file, per URL hash
+
+    POSIX record locks belong to the process, so a single descriptor is kept
+    open for its lifetime; closing any descriptor of the file would drop
+    every lock the process holds.
+    """
+
+    fd = None
+
+    def __init__(self, root, key, timeout):
+        self.path = f"{root.rstrip('/')}/.fetch.lock"
+        self.offset = int(key[:8], 16) % LOCK_SLOTS
+        self.timeout = timeout
+        self.locked = False
+
+    async def __aenter__(self):
+        if FetchLock.fd is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            FetchLock.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o664)
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fcntl.lockf(FetchLock.fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, self.offset)
+                self.locked = True
+                return self
+            except OSError:
+                if time.monotonic() > deadline:
+                    # Give up on dedup rather than on the request
+                    return self
+                await asyncio.sleep(LOCK_POLL_INTERVAL)
+
+    async def __aexit__(self, *exc):
+        if self.locked:
+            fcntl.lockf(FetchLock.fd, fcntl.LOCK_UN, 1, self.offset)
+            self.locked = False
+
+
+class SourceCache:
+    def __init__(self, config):
+        root = config.get('CACHING_LOADER_ROOT_PATH', '/data/thumbor/source_cache').rstrip('/')
+        self.root = root
+        self.blobs = BlobStore(f'{root}/blobs', config.get('CACHING_LOADER_MAX_BYTES', 10 * 1024 * 1024 * 1024))
+        self.index = SourceIndex(f'{root}/index')
+        self.fresh_seconds = config.get('CACHING_LOADER_FRESH_SECONDS', 3600)
+
+    def lookup(self, key):
+        """(index entry, buffer) for a URL, or (None, None)"""
+        entry = self.index.get(key)
+        if entry is None:
+            return None, None
+        found = self.blobs.get(entry['digest'])
+        if found is None:
+            # Blob evicted by the sweep; drop the dangling index entry
+            self.index.remove(key)
+            return None, None
+        return entry, found[0]
+
+    def freshness(self, headers, default):
+        """Seconds a response may be served without revalidation, None if it must not be stored"""
+        cache_control = (headers.get('Cache-Control') or '').lower()
+        if 'no-store' in cache_control:
+            return None
+        match = MAX_AGE_PATTERN.search(cache_control)
+        return int(match.group(1)) if match else default
+
+    def store(self, key, url, buffer, headers):
+        fresh_for = self.freshness(headers, self.fresh_seconds)
+        if fresh_for is None:
+            self.index.remove(key)
+            return
+        digest = hashlib.sha256(buffer).hexdigest()
+        self.blobs.put(digest, buffer)
+        self.index.put(key, {
+            'url': url,
+            'digest': digest,
+            'size': len(buffer),
+            'content_type': headers.get('Content-Type'),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'fresh_for': fresh_for,
+            'fresh_until': time.time() + fresh_for,
+        })
+
+    def refresh(self, key, entry, headers):
+        """Extend an entry after a 304; the origin may send new validators
+        and caching headers, otherwise the stored ones still apply"""
+        fresh_for = self.freshness(headers, entry.get('fresh_for', self.fresh_seconds))
+        if fresh_for is None:
+            self.index.remove(key)
+            return
+        entry['fresh_for'] = fresh_for
+        entry['fresh_until'] = time.time() + fresh_for
+        entry['etag'] = headers.get('ETag') or entry.get('etag')
+        entry['last_modified'] = headers.get('Last-Modified') or entry.get('last_modified')
+        self.index.put(key, entry)
+
+
+source_cache = None
+
+
+def record(context, event):
+    SOURCE_CACHE_STATS[event] += 1
+    context.metrics.incr(f'source_cache.{event}')
+
+
+def cached_result(entry, buffer):
+    return LoaderResult(
+        buffer=buffer,
+        metadata={
+            'Content-Type': entry.get('content_type'),
+            'ETag': entry.get('etag'),
+            'Last-Modified': entry.get('last_modified'),
+        },
+    )
+
+
+def build_request(context, url, validators):
+    """The HTTPRequest http_loader.load would send, plus conditional headers"""
+    config = context.config
+    using_proxy = config.HTTP_LOADER_PROXY_HOST and config.HTTP_LOADER_PROXY_PORT
+    if using_proxy or config.HTTP_LOADER_CURL_ASYNC_HTTP_CLIENT:
+        http_client_implementation = 'tornado.curl_httpclient.CurlAsyncHTTPClient'
+        prepare_curl_callback = http_loader._get_prepare_curl_callback(config)
+    else:
+        http_client_implementation = None
+        prepare_curl_callback = None
+    tornado.httpclient.AsyncHTTPClient.configure(
+        http_client_implementation,
+        max_clients=config.HTTP_LOADER_MAX_CLIENTS,
+    )
+
+    request_headers = context.request_handler.request.headers
+    user_agent = None
+    headers = {'Accept': 'image/*;q=0.9,*/*;q=0.1'}
+    if config.HTTP_LOADER_FORWARD_ALL_HEADERS:
+        headers = dict(request_headers)
+    else:
+        if config.HTTP_LOADER_FORWARD_USER_AGENT and 'User-Agent' in request_headers:
+            user_agent = request_headers['User-Agent']
+        for header_key in config.HTTP_LOADER_FORWARD_HEADERS_WHITELIST or []:
+            if header_key in request_headers:
+                headers[header_key] = request_headers[header_key]
+    if user_agent is None and 'User-Agent' not in headers:
+        user_agent = config.HTTP_LOADER_DEFAULT_USER_AGENT
+    # Never forward the client's own validators; only ours describe the cached copy
+    for header_key in ('If-None-Match', 'If-Modified-Since'):
+        headers.pop(header_key, None)
+    headers.update(validators)
+
+    encode = http_loader.encode
+    return tornado.httpclient.HTTPRequest(
+        url=url,
+        headers=headers,
+        connect_timeout=config.HTTP_LOADER_CONNECT_TIMEOUT,
+        request_timeout=config.HTTP_LOADER_REQUEST_TIMEOUT,
+        follow_redirects=config.HTTP_LOADER_FOLLOW_REDIRECTS,
+        max_redirects=config.HTTP_LOADER_MAX_REDIRECTS,
+        user_agent=user_agent,
+        proxy_host=encode(config.HTTP_LOADER_PROXY_HOST),
+        proxy_port=config.HTTP_LOADER_PROXY_PORT,
+        proxy_username=encode(config.HTTP_LOADER_PROXY_USERNAME),
+        proxy_password=encode(config.HTTP_LOADER_PROXY_PASSWORD),
+        ca_certs=encode(config.HTTP_LOADER_CA_CERTS),
+        client_key=encode(config.HTTP_LOADER_CLIENT_KEY),
+        client_cert=encode(config.HTTP_LOADER_CLIENT_CERT),
+        validate_cert=config.HTTP_LOADER_VALIDATE_CERTS,
+        prepare_curl_callback=prepare_curl_callback,
+    )
+
+
+async def fetch(context, key, url):
+    """Fetch or revalidate a URL while holding its cross-process lock"""
+    timeout = context.config.HTTP_LOADER_REQUEST_TIMEOUT
+    async with FetchLock(source_cache.root, key, timeout):
+        entry, buffer = source_cache.lookup(key)
+        if entry and entry['fresh_until'] > time.time():
+            # Another process fetched it while we waited for the lock
+            record(context, 'shared')
+            return cached_result(entry, buffer)
+
+        validators = {}
+        if entry:
+            if entry.get('etag'):
+                validators['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                validators['If-Modified-Since'] = entry['last_modified']
+
+        request = build_request(context, url, validators)
+        start = datetime.datetime.now()
+        try:
+            response = await tornado.httpclient.AsyncHTTPClient().fetch(request, raise_error=False)
+        except socket.gaierror as err:
+            response = tornado.httpclient.HTTPResponse(request, 599, reason=str(err), start_time=start)
+        except Exception as err:
+            if entry:
+                logger.warning('[CACHING_LOADER] fetching %s failed (%s), serving stale copy', url, err)
+                record(context, 'stale')
+                return cached_result(entry, buffer)
+            raise
+
+        if response.code == 304 and entry:
+            source_cache.refresh(key, entry, response.headers)
+            record(context, 'revalidated')
+            return cached_result(entry, buffer)
+
+        if entry and (response.code == 599 or response.code >= 500):
+            # Serve the copy we have rather than an error while the origin is down
+            logger.warning('[CACHING_LOADER] origin returned %s for %s, serving stale copy', response.code, url)
+            record(context, 'stale')
+            return cached_result(entry, buffer)
+
+        result = http_loader.return_contents(response, url, context, start)
+        if result.successful:
+            record(context, 'fetched')
+            try:
+                source_cache.store(key, url, result.buffer, response.headers)
+            except OSError as e:
+                logger.warning('[CACHING_LOADER] could not store %s: %s', url, e)
+        return result
+
+
+async def load(context, url):
+    global source_cache
+    if source_cache is None:
+        source_cache = SourceCache(context.config)
+
+    url = http_loader._normalize_url(url)
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+    entry, buffer = source_cache.lookup(key)
+    if entry and entry['fresh_until'] > time.time():
+        record(context, 'hit')
+        return cached_result(entry, buffer)
+
+    leader = in_flight.get(key)
+    if leader is not None:
+        record(context, 'coalesced')
+        return await asyncio.shield(leader)
+
+    future = asyncio.get_running_loop().create_future()
+    in_flight[key] = future
+    try:
+        result = await fetch(context, key, url)
+        future.set_result(result)
+        return result
+    except Exception as e:
+        future.set_exception(e)
+        # Followers re-raise it; mark it retrieved so an unawaited future
+        # does not log "exception was never retrieved"
+        future.exception()
+        raise
+    finally:
+        del in_flight[key]
@@ -0,0 +1 @@
+"""Result storages for thumbor"""
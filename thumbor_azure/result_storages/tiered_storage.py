@@ -0,0 +1,366 @@
+"""
+Tiered result storage for thumbor
+Looks results up in a per-process LRU, then on local disk, then in a shared
+backend (Redis or Azure Blob), and fills the faster tiers on the way back.
+
+thumbor.conf:
+    RESULT_STORAGE = 'thumbor_azure.result_storages.tiered_storage'
+    RESULT_STORAGE_FILE_STORAGE_ROOT_PATH = '/data/thumbor/result_storage'
+    TIERED_RESULT_STORAGE_MEMORY_MAX_BYTES = 64 * 1024 * 1024
+    TIERED_RESULT_STORAGE_DISK_MAX_BYTES = 5 * 1024 * 1024 * 1024
+    TIERED_RESULT_STORAGE_BACKEND = 'redis'  # or 'azure_blob' or 'none'
+"""
+
+import os
+import time
+import fcntl
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import unquote, urlsplit, urlunsplit
+from uuid import uuid4
+
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+from thumbor.engines import BaseEngine
+from thumbor.result_storages import BaseStorage, ResultStorageResult
+from thumbor.utils import logger
+
+TIERS = ('memory', 'disk', 'backend')
+
+# Per-process hit/miss counters, also sent to thumbor's METRICS as
+# result_storage.<tier>.hit / result_storage.<tier>.miss
+TIER_STATS = {tier: {'hit': 0, 'miss': 0} for tier in TIERS}
+
+
+class MemoryLRU:
+    """Byte-budgeted LRU of (buffer, stored_at) shared by all requests of a process"""
+
+    def __init__(self, max_bytes, max_item_bytes):
+        self.max_bytes = max_bytes
+        self.max_item_bytes = max_item_bytes
+        self.size = 0
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, max_age):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                return None
+            if max_age and time.time() - entry[1] > max_age:
+                self.size -= len(entry[0])
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return entry
+
+    def put(self, key, buffer, stored_at):
+        if len(buffer) > self.max_item_bytes or len(buffer) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.size -= len(old[0])
+            self.items[key] = (buffer, stored_at)
+            self.size += len(buffer)
+            # Evict least recently used entries until the bytes fit the budget
+            while self.size > self.max_bytes:
+                _, (evicted, _) = self.items.popitem(last=False)
+                self.size -= len(evicted)
+
+
+class DiskTier:
+    """Result files under a root directory, trimmed oldest-first to a byte budget
+
+    Every process writes here and counts what it wrote; once roughly a
+    twentieth of the budget has been written since its last sweep, it sweeps
+    in a background thread, and the process that takes the sweep lock scans
+    the tree and deletes the oldest files.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root.rstrip('/')
+        self.max_bytes = max_bytes
+        self.written = 0
+        self.sweeping = False
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return f'{self.root}/{key[:2]}/{key[2:4]}/{key}'
+
+    def get(self, key, max_age):
+        path = self.path(key)
+        try:
+            mtime = os.path.getmtime(path)
+            if max_age and time.time() - mtime > max_age:
+                return None
+            with open(path, 'rb') as f:
+                return f.read(), mtime
+        except OSError:
+            return None
+
+    def put(self, key, buffer):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp = f'{path}.{uuid4().hex}'
+        with open(temp, 'wb') as f:
+            f.write(buffer)
+        os.replace(temp, path)
+        if not self.max_bytes:
+            return
+        with self.lock:
+            self.written += len(buffer)
+            if self.sweeping or self.written <= self.max_bytes / 20:
+                return
+            self.written = 0
+            self.sweeping = True
+        # Walking the tree takes seconds on a full volume; keep it off the IOLoop
+        threading.Thread(target=self.background_sweep, name='disk-tier-sweep', daemon=True).start()
+
+    def background_sweep(self):
+        try:
+            self.sweep()
+        except OSError as e:
+            logger.warning('[TIERED_RESULT_STORAGE] disk sweep failed: %s', e)
+        finally:
+            self.sweeping = False
+
+    def sweep(self):
+        """Delete the oldest files until the tree fits max_bytes"""
+        os.makedirs(self.root, exist_ok=True)
+        with open(f'{self.root}/.sweep.lock', 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return  # Another process is already sweeping
+            files = []
+            total = 0
+            for dirpath, _, filenames in os.walk(self.root):
+                for name in filenames:
+                    if name.startswith('.'):
+                        continue
+                    path = os.path.join(dirpath, name)
+                    try:
+                        stat = os.stat(path)
+                    except OSError:
+                        continue
+                    files.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            if total <= self.max_bytes:
+                return
+            files.sort()
+            removed = 0
+            for _, size, path in files:
+                if total <= self.max_bytes * 0.9:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            logger.debug('[TIERED_RESULT_STORAGE] disk sweep removed %d files', removed)
+
+
+class RedisBackend:
+    """Results stored as plain Redis strings expiring after the configured TTL"""
+
+    client = None
+
+    def __init__(self, config):
+        self.prefix = config.get('TIERED_RESULT_STORAGE_REDIS_PREFIX', 'thumbor:result:')
+        self.max_item_bytes = config.get('TIERED_RESULT_STORAGE_REDIS_MAX_ITEM_BYTES', 512 * 1024)
+        if RedisBackend.client is None:
+            from redis import asyncio as aioredis
+
+            RedisBackend.client = aioredis.Redis(
+                host=config.REDIS_STORAGE_SERVER_HOST,
+                port=config.REDIS_STORAGE_SERVER_PORT,
+                db=config.REDIS_STORAGE_SERVER_DB,
+                password=config.REDIS_STORAGE_SERVER_PASSWORD,
+                socket_timeout=config.get('TIERED_RESULT_STORAGE_BACKEND_TIMEOUT', 2),
+            )
+
+    async def get(self, key, max_age):
+        pipe = self.client.pipeline(transaction=False)
+        pipe.get(self.prefix + key)
+        pipe.get(f'{self.prefix}{key}:mtime')
+        buffer, mtime = await pipe.execute()
+        if buffer is None:
+            return None
+        return buffer, float(mtime) if mtime else time.time()
+
+    async def put(self, key, buffer, max_age):
+        # Redis is shared with detector results under allkeys-lru; keep large
+        # results out so they cannot push detections out of memory
+        if len(buffer) > self.max_item_bytes:
+            return
+        pipe = self.client.pipeline(transaction=False)
+        pipe.set(self.prefix + key, buffer, ex=max_age or None)
+        pipe.set(f'{self.prefix}{key}:mtime', time.time(), ex=max_age or None)
+        await pipe.execute()
+
+
+class AzureBlobBackend:
+    """Results stored as block blobs in a container addressed by a SAS URL
+
+    TIERED_RESULT_STORAGE_AZURE_CONTAINER_URL is the container URL including
+    its SAS token, e.g. https://account.blob.core.windows.net/results?sv=...&sig=...
+    or an Azurite URL for local testing.
+    """
+
+    API_VERSION = '2021-08-06'
+
+    def __init__(self, config):
+        url = urlsplit(config.TIERED_RESULT_STORAGE_AZURE_CONTAINER_URL)
+        self.base = urlunsplit((url.scheme, url.netloc, url.path.rstrip('/'), '', ''))
+        self.sas = url.query
+        self.timeout = config.get('TIERED_RESULT_STORAGE_BACKEND_TIMEOUT', 2)
+
+    def url(self, key):
+        url = f'{self.base}/{key[:2]}/{key}'
+        return f'{url}?{self.sas}' if self.sas else url
+
+    async def get(self, key, max_age):
+        response = await AsyncHTTPClient().fetch(
+            HTTPRequest(self.url(key), headers={'x-ms-version': self.API_VERSION},
+                        request_timeout=self.timeout),
+            raise_error=False,
+        )
+        if response.code != 200:
+            if response.code not in (404, 599):
+                logger.warning('[TIERED_RESULT_STORAGE] blob GET returned %s', response.code)
+            return None
+        modified = response.headers.get('Last-Modified')
+        mtime = parsedate_to_datetime(modified).timestamp() if modified else time.time()
+        if max_age and time.time() - mtime > max_age:
+            return None
+        return response.body, mtime
+
+    async def put(self, key, buffer, max_age):
+        response = await AsyncHTTPClient().fetch(
+            HTTPRequest(
+                self.url(key),
+                method='PUT',
+                body=buffer,
+                headers={
+                    'x-ms-version': self.API_VERSION,
+                    'x-ms-blob-type': 'BlockBlob',
+                    'x-ms-date': formatdate(usegmt=True),
+                    'Content-Type': BaseEngine.get_mimetype(buffer) or 'application/octet-stream',
+                },
+                request_timeout=self.timeout,
+            ),
+            raise_error=False,
+        )
+        if response.code not in (200, 201):
+            logger.warning('[TIERED_RESULT_STORAGE] blob PUT returned %s', response.code)
+
+
+BACKENDS = {
+    'redis': RedisBackend,
+    'azure_blob': AzureBlobBackend,
+}
+
+# Shared by all requests of a process; thumbor creates a Storage per request
+memory_tier = None
+disk_tier = None
+
+
+class Storage(BaseStorage):
+    def __init__(self, context):
+        super().__init__(context)
+        global memory_tier, disk_tier
+        config = context.config
+        if memory_tier is None:
+            memory_tier = MemoryLRU(
+                config.get('TIERED_RESULT_STORAGE_MEMORY_MAX_BYTES', 64 * 1024 * 1024),
+                config.get('TIERED_RESULT_STORAGE_MEMORY_MAX_ITEM_BYTES', 2 * 1024 * 1024),
+            )
+        self.memory = memory_tier
+        if disk_tier is None:
+            disk_tier = DiskTier(
+                config.RESULT_STORAGE_FILE_STORAGE_ROOT_PATH,
+                config.get('TIERED_RESULT_STORAGE_DISK_MAX_BYTES', 5 * 1024 * 1024 * 1024),
+            )
+        self.disk = disk_tier
+        backend = config.get('TIERED_RESULT_STORAGE_BACKEND', 'none')
+        self.backend = BACKENDS[backend](config) if backend in BACKENDS else None
+
+    @property
+    def is_auto_webp(self):
+        return self.context.config.AUTO_WEBP and self.context.request.accepts_webp
+
+    @property
+    def max_age(self):
+        return self.context.config.get('RESULT_STORAGE_EXPIRATION_SECONDS', 0) or 0
+
+    @property
+    def key(self):
+        # AUTO_WEBP results depend on Accept, like thumbor's file result storage
+        digest = hashlib.sha1(unquote(self.context.request.url).encode('utf-8')).hexdigest()
+        return f"{digest}{'w' if self.is_auto_webp else 'd'}"
+
+    def record(self, tier, outcome):
+        TIER_STATS[tier][outcome] += 1
+        if self.context.metrics:
+            self.context.metrics.incr(f'result_storage.{tier}.{outcome}')
+
+    async def get(self):
+        key = self.key
+        max_age = self.max_age
+
+        found = self.memory.get(key, max_age)
+        self.record('memory', 'hit' if found else 'miss')
+
+        if found is None:
+            found = self.disk.get(key, max_age)
+            self.record('disk', 'hit' if found else 'miss')
+            if found is None and self.backend:
+                try:
+                    found = await self.backend.get(key, max_age)
+                except Exception as e:
+                    logger.warning('[TIERED_RESULT_STORAGE] backend get failed: %s', e)
+                self.record('backend', 'hit' if found else 'miss')
+                if found:
+                    try:
+                        self.disk.put(key, found[0])
+                    except OSError as e:
+                        logger.warning('[TIERED_RESULT_STORAGE] disk put failed: %s', e)
+            if found:
+                self.memory.put(key, found[0], found[1])
+
+        if found is None:
+            return None
+        buffer, mtime = found
+        return ResultStorageResult(
+            buffer=buffer,
+            metadata={
+                'LastModified': datetime.fromtimestamp(mtime, tz=timezone.utc),
+                'ContentLength': len(buffer),
+                'ContentType': BaseEngine.get_mimetype(buffer),
+            },
+        )
+
+    async def put(self, image_bytes):
+        key = self.key
+        now = time.time()
+        self.memory.put(key, image_bytes, now)
+        try:
+            self.disk.put(key, image_bytes)
+        except OSError as e:
+            logger.warning('[TIERED_RESULT_STORAGE] disk put failed: %s', e)
+        if self.backend:
+            try:
+                await self.backend.put(key, image_bytes, self.max_age)
+            except Exception as e:
+                logger.warning('[TIERED_RESULT_STORAGE] backend put failed: %s', e)
+
+    def last_updated(self):
+        found = self.memory.get(self.key, self.max_age) or self.disk.get(self.key, self.max_age)
+        if found is None:
+            return True
+        return datetime.fromtimestamp(found[1], tz=timezone.utc)
@@ -0,0 +1 @@
+"""Storages for thumbor"""
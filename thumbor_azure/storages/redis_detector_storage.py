@@ -0,0 +1,279 @@
+"""
+Compact Redis detector storage for thumbor
+Stores focal points as fixed-width binary records instead of JSON strings,
+many per Redis hash, so Redis keeps each hash as a ziplist (a listpack since
+Redis 7) and pays its per-key overhead once per bucket instead of once per
+image. A point is x and y in half pixels, width and height as uint16, the
+weight as float16 (or flagged as width * height, which is what detectors
+write) and its origin as an index into ORIGINS. Points that do not fit are
+stored as JSON, lz4-compressed when py-lz4framed is installed and it pays off.
+
+Records larger than a ziplist value go to a key of their own, so one face
+crowd cannot turn its whole bucket into a hashtable; the bucket keeps a
+one-byte marker for them, so a lookup is a single HGET unless the record is
+large or missing. JSON written by tc_redis or RemoteCV under
+thumbor-detector-<url> is still read on a miss, and rewritten here.
+
+Also a RemoteCV result store, so RemoteCV writes the same records:
+    remotecv.worker --store thumbor_azure.storages.redis_detector_storage
+
+thumbor.conf:
+    MIXED_STORAGE_DETECTOR_STORAGE = 'thumbor_azure.storages.redis_detector_storage'
+    DETECTOR_STORAGE_BUCKET = 'thumbor:detectors'
+    DETECTOR_STORAGE_BUCKETS = 16384  # RemoteCV reads it from the environment
+    DETECTOR_STORAGE_MAX_BUCKET_VALUE = 256  # Redis hash-max-ziplist-value
+    DETECTOR_STORAGE_COMPRESS = True
+    REDIS_DETECTOR_STORAGE_KEY = 'thumbor:detectors:%(key)s'
+"""
+
+import os
+import json
+import struct
+import hashlib
+
+from redis import RedisError
+from redis import asyncio as aioredis
+
+from thumbor.storages import BaseStorage
+from thumbor.utils import logger
+
+try:
+    import lz4framed
+except ImportError:
+    lz4framed = None
+
+# Record type, the first byte of a record
+POINTS = 1
+JSON = 2
+COMPRESSED = 0x80
+# Bucket value of a record stored under a key of its own
+LARGE = b'\x03'
+
+# x * 2, y * 2, width, height, weight, origin index | AREA_WEIGHT
+POINT = struct.Struct('<HHHHeB')
+POINT_KEYS = {'x', 'y', 'z', 'width', 'height', 'origin'}
+# Origins thumbor's detectors, RemoteCV ('') and FocalPoint's default write
+ORIGINS = ('', 'alignment', 'detection', 'Face Detection', 'Feature Detection')
+ORIGIN_MASK = 0x7F
+AREA_WEIGHT = 0x80
+
+# Only records at least this long are worth an lz4 frame header
+COMPRESS_MIN_BYTES = 64
+
+DEFAULT_BUCKETS = 16384
+# The hash-max-ziplist-value the Dockerfile sets in redis.conf; Redis's own
+# default is 64
+DEFAULT_MAX_BUCKET_VALUE = 256
+# tc_redis and RemoteCV's redis_store
+LEGACY_KEY = 'thumbor-detector-%(key)s'
+
+# Per-process counters, also sent to thumbor's METRICS as detector_storage.<event>
+DETECTOR_STORAGE_STATS = {'hit': 0, 'miss': 0, 'legacy': 0}
+
+
+def pack_point(point):
+    if not POINT_KEYS.issuperset(point):
+        raise ValueError(f'unknown focal point keys {sorted(set(point) - POINT_KEYS)}')
+    # Stored as thumbor's FocalPoint.from_dict reads them
+    width = int(point.get('width', 1))
+    height = int(point.get('height', 1))
+    flags = ORIGINS.index(point.get('origin', 'alignment'))
+    weight = point['z']
+    if weight == width * height:
+        flags |= AREA_WEIGHT
+        weight = 0
+    elif int(struct.unpack('<e', struct.pack('<e', weight))[0]) != int(weight):
+        raise ValueError(f'weight {weight} does not fit a float16')
+    # Half pixels keep the centres detectors write (x + width / 2) exact;
+    # anything finer is truncated, which FocalPoint.from_dict's int() agrees with
+    return POINT.pack(int(point['x'] * 2), int(point['y'] * 2), width, height, weight, flags)
+
+
+def pack(points, compress=False):
+    """Encode a list of focal point dicts, as fixed-width points when they all fit"""
+    try:
+        payload = bytes([POINTS]) + b''.join(pack_point(point) for point in points)
+    except (KeyError, TypeError, ValueError, OverflowError, struct.error):
+        payload = bytes([JSON]) + json.dumps(points, separators=(',', ':')).encode('utf-8')
+    if compress and lz4framed is not None and len(payload) >= COMPRESS_MIN_BYTES:
+        compressed = lz4framed.compress(payload[1:])
+        if len(compressed) + 1 < len(payload):
+            payload = bytes([payload[0] | COMPRESSED]) + compressed
+    return payload
+
+
+def unpack(value):
+    kind = value[0]
+    if kind & ~COMPRESSED not in (POINTS, JSON):
+        # JSON text written by tc_redis or RemoteCV
+        return json.loads(value)
+    payload = value[1:]
+    if kind & COMPRESSED:
+        if lz4framed is None:
+            raise RuntimeError('detector record is lz4-compressed but py-lz4framed is not installed')
+        payload = lz4framed.decompress(payload)
+        kind &= ~COMPRESSED
+    if kind == JSON:
+        return json.loads(payload)
+    return [
+        {
+            'x': x / 2,
+            'y': y / 2,
+            'z': width * height if flags & AREA_WEIGHT else weight,
+            'height': height,
+            'width': width,
+            'origin': ORIGINS[flags & ORIGIN_MASK],
+        }
+        for x, y, width, height, weight, flags in POINT.iter_unpack(payload)
+    ]
+
+
+class DetectorLayout:
+    """Where an image's detector record lives in Redis
+
+    Records are fields of one of `buckets` hashes, named by 8 bytes of the
+    sha1 of the image URL; larger ones are keys of their own, with LARGE in
+    their bucket field. Writes are queued on a redis-py pipeline, sync or
+    asyncio.
+    """
+
+    def __init__(self, prefix='thumbor:detectors', buckets=DEFAULT_BUCKETS,
+                 key_template='thumbor:detectors:%(key)s', max_bucket_value=DEFAULT_MAX_BUCKET_VALUE,
+                 compress=True):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.key_template = key_template
+        self.max_bucket_value = max_bucket_value
+        self.compress = compress
+
+    @classmethod
+    def from_env(cls):
+        """The layout thumbor.conf sets up, for RemoteCV and the command line tools"""
+        return cls(
+            buckets=int(os.environ.get('DETECTOR_STORAGE_BUCKETS', DEFAULT_BUCKETS)),
+            max_bucket_value=int(os.environ.get('DETECTOR_STORAGE_MAX_BUCKET_VALUE', DEFAULT_MAX_BUCKET_VALUE)),
+            compress=os.environ.get('DETECTOR_STORAGE_COMPRESS', 'True').lower() == 'true',
+        )
+
+    def bucket(self, url):
+        digest = hashlib.sha1(url.encode('utf-8')).digest()
+        return f'{self.prefix}:bucket:{int.from_bytes(digest[:4], "big") % self.buckets:x}', digest[4:12]
+
+    def large_key(self, url):
+        return self.key_template % {'key': url}
+
+    def queue_put(self, pipe, url, points):
+        key, field = self.bucket(url)
+        value = pack(points, self.compress)
+        if len(value) <= self.max_bucket_value:
+            pipe.hset(key, field, value)
+            pipe.delete(self.large_key(url), LEGACY_KEY % {'key': url})
+        else:
+            pipe.set(self.large_key(url), value)
+            pipe.hset(key, field, LARGE)
+            pipe.delete(LEGACY_KEY % {'key': url})
+        return len(value)
+
+    def queue_exists(self, pipe, url):
+        key, field = self.bucket(url)
+        pipe.hexists(key, field)
+        pipe.exists(LEGACY_KEY % {'key': url})
+
+
+class Storage(BaseStorage):
+    """Detector storage for MIXED_STORAGE_DETECTOR_STORAGE; originals and
+    crypto keys are left to the other storages"""
+
+    client = None
+
+    def __init__(self, context):
+        super().__init__(context)
+        config = context.config
+        self.layout = DetectorLayout(
+            config.get('DETECTOR_STORAGE_BUCKET', 'thumbor:detectors'),
+            config.get('DETECTOR_STORAGE_BUCKETS', DEFAULT_BUCKETS),
+            config.get('REDIS_DETECTOR_STORAGE_KEY', 'thumbor:detectors:%(key)s'),
+            config.get('DETECTOR_STORAGE_MAX_BUCKET_VALUE', DEFAULT_MAX_BUCKET_VALUE),
+            config.get('DETECTOR_STORAGE_COMPRESS', True),
+        )
+        if Storage.client is None:
+            Storage.client = aioredis.Redis(
+                host=config.REDIS_STORAGE_SERVER_HOST,
+                port=config.REDIS_STORAGE_SERVER_PORT,
+                db=config.REDIS_STORAGE_SERVER_DB,
+                password=config.REDIS_STORAGE_SERVER_PASSWORD,
+            )
+
+    def record(self, event):
+        DETECTOR_STORAGE_STATS[event] += 1
+        if self.context.metrics:
+            self.context.metrics.incr(f'detector_storage.{event}')
+
+    def on_redis_error(self, error):
+        # Same switch as tc_redis: a smart request without detector results
+        # still renders
+        if self.context.config.get('REDIS_STORAGE_IGNORE_ERRORS', True):
+            logger.error('[DETECTOR_STORAGE] %s', error)
+            return
+        raise error
+
+    async def put_detector_data(self, path, data):
+        pipe = self.client.pipeline(transaction=False)
+        self.layout.queue_put(pipe, path, data)
+        try:
+            await pipe.execute()
+        except RedisError as e:
+            self.on_redis_error(e)
+
+    async def get_detector_data(self, path):
+        key, field = self.layout.bucket(path)
+        legacy = False
+        try:
+            value = await self.client.hget(key, field)
+            if value == LARGE:
+                # None when LRU evicted the record but not its bucket
+                value = await self.client.get(self.layout.large_key(path))
+            elif value is None:
+                value = await self.client.get(LEGACY_KEY % {'key': path})
+                legacy = value is not None
+        except RedisError as e:
+            self.on_redis_error(e)
+            return None
+
+        if value is None:
+            self.record('miss')
+            return None
+        try:
+            points = unpack(value)
+        except Exception as e:
+            logger.warning('[DETECTOR_STORAGE] unreadable detector record for %s: %s', path, e)
+            return None
+        if legacy:
+            self.record('legacy')
+            await self.put_detector_data(path, points)
+        else:
+            self.record('hit')
+        return points
+
+
+class ResultStore:
+    """RemoteCV result store writing the same records as Storage"""
+
+    client = None
+
+    def __init__(self, config):
+        from remotecv.utils import redis_client
+
+        self.config = config
+        if ResultStore.client is None:
+            ResultStore.client = redis_client()
+        self.layout = DetectorLayout.from_env()
+
+    def store(self, key, points):
+        from remotecv.result_store import BaseStore
+
+        # RemoteCV's own conversion of detections to focal point dicts
+        focal_points = json.loads(BaseStore.serialize(self, points))
+        pipe = self.client.pipeline(transaction=False)
+        self.layout.queue_put(pipe, key, focal_points)
+        pipe.execute()
@@ -0,0 +1,566 @@
+"""
+Segment file storage for thumbor
+Stores originals in append-only segment files instead of one file per image.
+Keys are spread over shard directories by their sha1. Each shard holds its
+segments and an open-addressing hash index, both memory mapped by every
+thumbor process of the container, so a read is an index probe and a slice of
+a mapped segment: no open, stat or read calls per image. Writes are appended
+under a per-shard lock, in the loop's executor rather than on the IOLoop, and
+fsynced in batches by a background thread; a record torn by a crash fails its
+checksum and reads as a miss. Expired and replaced records are dropped by a
+background compaction that moves the live records out of mostly dead segments.
+
+Crypto keys and detector results are stored too when this module is the
+whole STORAGE. Changing SEGMENT_STORAGE_SHARDS orphans what is stored.
+
+thumbor.conf:
+    MIXED_STORAGE_FILE_STORAGE = 'thumbor_azure.storages.segment_storage'
+    SEGMENT_STORAGE_ROOT_PATH = '/data/thumbor/storage/segments'
+    SEGMENT_STORAGE_SHARDS = 16
+    SEGMENT_STORAGE_SEGMENT_BYTES = 64 * 1024 * 1024
+    SEGMENT_STORAGE_FSYNC_SECONDS = 1  # 0 fsyncs every write
+    SEGMENT_STORAGE_COMPACT_SECONDS = 300
+    STORAGE_EXPIRATION_SECONDS = 60 * 60 * 24 * 30
+"""
+
+import os
+import json
+import mmap
+import time
+import zlib
+import errno
+import asyncio
+import fcntl
+import struct
+import hashlib
+import threading
+from contextlib import contextmanager
+from uuid import uuid4
+
+from thumbor.storages import BaseStorage
+from thumbor.utils import logger
+
+# magic, flags, slot count, used slots (live and deleted), active segment,
+# generation (bumped whenever segments are deleted or the index is replaced)
+INDEX_HEADER = struct.Struct('<4sIIIII')
+INDEX_HEADER_SIZE = 64
+INDEX_MAGIC = b'TSI1'
+# key digest, segment, offset, length, stored_at
+SLOT = struct.Struct('<20sIQId')
+# magic, key digest, length, stored_at, crc32 of the data
+RECORD = struct.Struct('<4s20sIdI')
+RECORD_MAGIC = b'TSR1'
+
+# Index header flag: the index was rewritten and this file replaced
+SUPERSEDED = 1
+# Slot segment values; segments are numbered from 1
+EMPTY = 0
+DELETED = 0xFFFFFFFF
+
+INITIAL_SLOTS = 4096
+MAX_LOAD = 0.7
+# Sealed segments with less than this share of live bytes are compacted
+COMPACT_LIVE_RATIO = 0.5
+# Bytes moved per shard and compaction pass, which bounds how long the
+# compaction holds a shard's lock
+COMPACT_BATCH_BYTES = 8 * 1024 * 1024
+# Records whose checksum a process has checked, remembered so a hot original
+# is not checksummed on every read; forgotten all at once when full
+MAX_VERIFIED = 65536
+
+# Per-process counters, also sent to thumbor's METRICS as segment_storage.<event>
+SEGMENT_STORAGE_STATS = {'hit': 0, 'miss': 0, 'expired': 0}
+
+
+def slot_of(digest, slots):
+    # The first byte picks the shard; the next ones are independent of it
+    return int.from_bytes(digest[4:12], 'little') % slots
+
+
+def write_index(path, slots, entries, active, generation):
+    """Write a fresh index holding entries and swap it in atomically"""
+    buffer = bytearray(INDEX_HEADER_SIZE + slots * SLOT.size)
+    INDEX_HEADER.pack_into(buffer, 0, INDEX_MAGIC, 0, slots, len(entries), active, generation)
+    taken = bytearray(slots)
+    for entry in entries:
+        slot = slot_of(entry[0], slots)
+        while taken[slot]:
+            slot = (slot + 1) % slots
+        taken[slot] = 1
+        SLOT.pack_into(buffer, INDEX_HEADER_SIZE + slot * SLOT.size, *entry)
+    temp = f'{path}.{uuid4().hex}'
+    with open(temp, 'wb') as f:
+        f.write(buffer)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp, path)
+
+
+def read_record(mapped, offset, digest, length, verify=True):
+    """The data of the record an index slot points to, or None when the
+    record there is not that one, e.g. torn by a crash"""
+    end = offset + RECORD.size + length
+    if mapped is None or end > len(mapped):
+        return None
+    magic, key, size, _, crc = RECORD.unpack_from(mapped, offset)
+    if magic != RECORD_MAGIC or key != digest or size != length:
+        return None
+    data = mapped[offset + RECORD.size:end]
+    if verify and zlib.crc32(data) != crc:
+        return None
+    return data
+
+
+class Shard:
+    """A directory of segments and their index
+
+    Writers of all processes take the shard's flock; readers probe the
+    mapped index without it and check the record they land on, so a slot
+    read while it is rewritten reads as a miss.
+    """
+
+    def __init__(self, root, segment_bytes):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        os.makedirs(root, exist_ok=True)
+        self.lock_file = open(f'{root}/lock', 'ab')
+        self.mutex = threading.Lock()
+        self.index = None
+        self.generation = None
+        # segment -> read-only mmap
+        self.segments = {}
+        # (segment, offset) of records read back intact
+        self.verified = set()
+        # (segment, fd) this process appends to
+        self.writer = None
+        # fds written since the last sync, and replaced writers to close after it
+        self.dirty = set()
+        self.retired = []
+
+    def segment_path(self, number):
+        return f'{self.root}/{number:08x}.seg'
+
+    def segment_sizes(self):
+        sizes = {}
+        for entry in os.scandir(self.root):
+            if entry.name.endswith('.seg'):
+                try:
+                    sizes[int(entry.name[:-4], 16)] = entry.stat().st_size
+                except (ValueError, OSError):
+                    continue
+        return sizes
+
+    @contextmanager
+    def locked(self):
+        with self.mutex:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+            try:
+                self.current_index(create=True)
+                yield self.index
+            finally:
+                fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+
+    def current_index(self, create=False):
+        """The mapped index, remapped when another process replaced it"""
+        index = self.index
+        if index is None or INDEX_HEADER.unpack_from(index)[1] & SUPERSEDED:
+            index = self.index = self.open_index(create)
+        return index
+
+    def open_index(self, create=False):
+        path = f'{self.root}/index'
+        try:
+            with open(path, 'r+b') as f:
+                index = mmap.mmap(f.fileno(), 0)
+            if INDEX_HEADER.unpack_from(index)[0] == INDEX_MAGIC:
+                return index
+            logger.warning('[SEGMENT_STORAGE] %s is not a segment index, starting a new one', path)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, struct.error) as e:
+            logger.warning('[SEGMENT_STORAGE] cannot map %s: %s', path, e)
+        if not create:
+            return None
+        # Segments left without an index are reclaimed by the compaction
+        write_index(path, INITIAL_SLOTS, [], max(self.segment_sizes(), default=0) + 1, 0)
+        return self.open_index()
+
+    def segment(self, number, end):
+        """The mapped segment, remapped when it has grown past end since it was mapped"""
+        mapped = self.segments.get(number)
+        if mapped is None or len(mapped) < end:
+            try:
+                with open(self.segment_path(number), 'rb') as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                return None
+            self.segments[number] = mapped
+        return mapped
+
+    def find(self, index, digest):
+        """(slot, segment, offset, length, stored_at) of digest, or None"""
+        slots = INDEX_HEADER.unpack_from(index)[2]
+        slot = slot_of(digest, slots)
+        for _ in range(slots):
+            key, segment, offset, length, stored_at = SLOT.unpack_from(
+                index, INDEX_HEADER_SIZE + slot * SLOT.size)
+            if segment == EMPTY:
+                return None
+            if segment != DELETED and key == digest:
+                return slot, segment, offset, length, stored_at
+            slot = (slot + 1) % slots
+        return None
+
+    def locate(self, digest, max_age):
+        index = self.current_index()
+        found = self.find(index, digest) if index is not None else None
+        if found is None:
+            return 'miss', None
+        if max_age and time.time() - found[4] > max_age:
+            return 'expired', None
+        return 'hit', found
+
+    def get(self, digest, max_age):
+        event, found = self.locate(digest, max_age)
+        if found is None:
+            return event, None
+        _, segment, offset, length, _ = found
+        location = (segment, offset)
+        verify = location not in self.verified
+        data = read_record(self.segment(segment, offset + RECORD.size + length), offset, digest, length, verify)
+        if data is None:
+            return 'miss', None
+        if verify:
+            if len(self.verified) >= MAX_VERIFIED:
+                self.verified.clear()
+            self.verified.add(location)
+        return 'hit', data
+
+    def put(self, digest, data):
+        stored_at = time.time()
+        record = RECORD.pack(RECORD_MAGIC, digest, len(data), stored_at, zlib.crc32(data))
+        with self.locked():
+            segment, offset = self.append(record, data)
+            self.insert(digest, segment, offset, len(data), stored_at)
+
+    def remove(self, digest):
+        with self.locked() as index:
+            found = self.find(index, digest)
+            if found:
+                SLOT.pack_into(index, INDEX_HEADER_SIZE + found[0] * SLOT.size, digest, DELETED, 0, 0, 0)
+
+    def append(self, record, data):
+        """Append a record to the active segment; called under the lock"""
+        header = list(INDEX_HEADER.unpack_from(self.index))
+        size = len(record) + len(data)
+        fd = self.writer_fd(header[4])
+        offset = os.fstat(fd).st_size
+        if offset and offset + size > self.segment_bytes:
+            header[4] += 1
+            INDEX_HEADER.pack_into(self.index, 0, *header)
+            fd = self.writer_fd(header[4])
+            offset = os.fstat(fd).st_size
+        if os.pwritev(fd, [record, data], offset) != size:
+            raise OSError(errno.ENOSPC, 'short write to segment', self.segment_path(header[4]))
+        self.dirty.add(fd)
+        return header[4], offset
+
+    def writer_fd(self, number):
+        if self.writer is not None and self.writer[0] == number:
+            return self.writer[1]
+        fd = os.open(self.segment_path(number), os.O_RDWR | os.O_CREAT, 0o644)
+        if self.writer is not None:
+            self.retired.append(self.writer[1])
+        self.writer = (number, fd)
+        return fd
+
+    def insert(self, digest, segment, offset, length, stored_at):
+        """Point digest's slot at a record; called under the lock"""
+        _, _, slots, used, _, _ = INDEX_HEADER.unpack_from(self.index)
+        if used + 1 > slots * MAX_LOAD:
+            self.rebuild()
+        index = self.index
+        header = list(INDEX_HEADER.unpack_from(index))
+        slots = header[2]
+        slot = slot_of(digest, slots)
+        target = None
+        for _ in range(slots):
+            key, current = SLOT.unpack_from(index, INDEX_HEADER_SIZE + slot * SLOT.size)[:2]
+            if current == EMPTY:
+                break
+            if current == DELETED:
+                if target is None:
+                    target = slot
+            elif key == digest:
+                target = slot
+                break
+            slot = (slot + 1) % slots
+        if target is None:
+            target = slot
+            header[3] += 1
+            INDEX_HEADER.pack_into(index, 0, *header)
+        SLOT.pack_into(index, INDEX_HEADER_SIZE + target * SLOT.size, digest, segment, offset, length, stored_at)
+
+    def entries(self, index):
+        """(slot, digest, segment, offset, length, stored_at) of every live slot"""
+        slots = INDEX_HEADER.unpack_from(index)[2]
+        region = index[INDEX_HEADER_SIZE:INDEX_HEADER_SIZE + slots * SLOT.size]
+        return [
+            (slot,) + entry
+            for slot, entry in enumerate(SLOT.iter_unpack(region))
+            if entry[1] != EMPTY and entry[1] != DELETED
+        ]
+
+    def rebuild(self):
+        """Rewrite the index without deleted slots, growing it so it stays
+        at most half as loaded as MAX_LOAD; called under the lock"""
+        old = self.index
+        header = list(INDEX_HEADER.unpack_from(old))
+        entries = [entry[1:] for entry in self.entries(old)]
+        slots = header[2]
+        while len(entries) + 1 > slots * MAX_LOAD / 2:
+            slots *= 2
+        write_index(f'{self.root}/index', slots, entries, header[4], header[5] + 1)
+        self.index = self.open_index()
+        header[1] |= SUPERSEDED
+        INDEX_HEADER.pack_into(old, 0, *header)
+
+    def sync(self):
+        """fsync what this process wrote since the last call, and drop the
+        mappings of segments another process deleted"""
+        with self.mutex:
+            dirty, self.dirty = self.dirty, set()
+            retired, self.retired = self.retired, []
+        for fd in dirty.union(retired):
+            os.fdatasync(fd)
+        for fd in retired:
+            os.close(fd)
+        index = self.index
+        if index is None:
+            return
+        if dirty:
+            index.flush()
+        generation = INDEX_HEADER.unpack_from(index)[5]
+        if generation != self.generation:
+            self.generation = generation
+            for number in list(self.segments):
+                if not os.path.exists(self.segment_path(number)):
+                    self.segments.pop(number, None)
+
+    def compact(self, max_age, budget):
+        """Expire entries and move live records out of mostly dead sealed
+        segments, at most budget bytes per call; segments left without live
+        records are deleted. Returns (expired, moved bytes, deleted segments)"""
+        now = time.time()
+        expired = moved = dropped = 0
+        emptied = []
+        with self.locked() as index:
+            header = list(INDEX_HEADER.unpack_from(index))
+            live = {}
+            entries = []
+            for slot, digest, segment, offset, length, stored_at in self.entries(index):
+                if max_age and now - stored_at > max_age:
+                    SLOT.pack_into(index, INDEX_HEADER_SIZE + slot * SLOT.size, digest, DELETED, 0, 0, 0)
+                    expired += 1
+                    continue
+                live[segment] = live.get(segment, 0) + RECORD.size + length
+                entries.append((slot, digest, segment, offset, length, stored_at))
+
+            sizes = self.segment_sizes()
+            if sizes.get(header[4]) and not live.get(header[4]):
+                # Seal an active segment whose records all expired, so it goes
+                # now rather than whenever the shard is written to again
+                header[4] += 1
+                INDEX_HEADER.pack_into(index, 0, *header)
+            victims = sorted(
+                (number for number, size in sizes.items()
+                 if number < header[4] and live.get(number, 0) <= size * COMPACT_LIVE_RATIO),
+                key=lambda number: live.get(number, 0),
+            )
+            for number in victims:
+                if moved and moved + live.get(number, 0) > budget:
+                    break
+                for slot, digest, segment, offset, length, stored_at in entries:
+                    if segment != number:
+                        continue
+                    data = read_record(self.segment(number, offset + RECORD.size + length), offset, digest, length)
+                    position = INDEX_HEADER_SIZE + slot * SLOT.size
+                    if data is None:
+                        SLOT.pack_into(index, position, digest, DELETED, 0, 0, 0)
+                        dropped += 1
+                        continue
+                    record = RECORD.pack(RECORD_MAGIC, digest, length, stored_at, zlib.crc32(data))
+                    segment, offset = self.append(record, data)
+                    SLOT.pack_into(self.index, position, digest, segment, offset, length, stored_at)
+                    moved += RECORD.size + length
+                emptied.append(number)
+
+            header = list(INDEX_HEADER.unpack_from(self.index))
+            if header[3] - (len(entries) - dropped) > header[2] // 4:
+                self.rebuild()
+
+        if emptied:
+            # The moved records must be on disk before their old copies go
+            self.sync()
+            for number in emptied:
+                self.segments.pop(number, None)
+                try:
+                    os.remove(self.segment_path(number))
+                except FileNotFoundError:
+                    pass
+            # Have the other processes drop their mappings of the deleted segments
+            with self.locked() as index:
+                header = list(INDEX_HEADER.unpack_from(index))
+                header[5] += 1
+                INDEX_HEADER.pack_into(index, 0, *header)
+        return expired, moved, len(emptied)
+
+
+class SegmentStore:
+    """The shards of a root directory, and the thread that fsyncs and compacts them"""
+
+    def __init__(self, root, shards, segment_bytes, fsync_seconds, compact_seconds, max_age):
+        self.root = root.rstrip('/')
+        self.shards = [Shard(f'{self.root}/{number:02x}', segment_bytes) for number in range(shards)]
+        self.fsync_seconds = fsync_seconds
+        self.compact_seconds = compact_seconds
+        self.max_age = max_age
+        if fsync_seconds or compact_seconds:
+            threading.Thread(target=self.run, name='segment-storage', daemon=True).start()
+
+    def shard(self, digest):
+        return self.shards[digest[0] % len(self.shards)]
+
+    def put(self, digest, data):
+        shard = self.shard(digest)
+        shard.put(digest, data)
+        if not self.fsync_seconds:
+            shard.sync()
+
+    def run(self):
+        interval = self.fsync_seconds or self.compact_seconds
+        while True:
+            time.sleep(interval)
+            for shard in self.shards:
+                try:
+                    shard.sync()
+                except OSError as e:
+                    logger.warning('[SEGMENT_STORAGE] fsync failed: %s', e)
+            if self.compact_seconds:
+                try:
+                    self.compact()
+                except Exception as e:
+                    logger.warning('[SEGMENT_STORAGE] compaction failed: %s', e)
+
+    def compact(self):
+        """Compact every shard, once per SEGMENT_STORAGE_COMPACT_SECONDS across all processes"""
+        path = f'{self.root}/.compact.lock'
+        try:
+            if time.time() - os.path.getmtime(path) < self.compact_seconds:
+                return
+        except FileNotFoundError:
+            pass
+        with open(path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return  # Another process is already compacting
+            os.utime(path)
+            start = time.time()
+            expired = moved = deleted = 0
+            for shard in self.shards:
+                shard_expired, shard_moved, shard_deleted = shard.compact(self.max_age, COMPACT_BATCH_BYTES)
+                expired += shard_expired
+                moved += shard_moved
+                deleted += shard_deleted
+            logger.debug(
+                '[SEGMENT_STORAGE] compaction expired %d entries, moved %d bytes and deleted %d segments in %.2fs',
+                expired, moved, deleted, time.time() - start,
+            )
+
+
+segment_store = None
+
+
+class Storage(BaseStorage):
+    def __init__(self, context):
+        super().__init__(context)
+        global segment_store
+        config = context.config
+        if segment_store is None:
+            segment_store = SegmentStore(
+                config.get('SEGMENT_STORAGE_ROOT_PATH', f"{config.FILE_STORAGE_ROOT_PATH.rstrip('/')}/segments"),
+                config.get('SEGMENT_STORAGE_SHARDS', 16),
+                config.get('SEGMENT_STORAGE_SEGMENT_BYTES', 64 * 1024 * 1024),
+                config.get('SEGMENT_STORAGE_FSYNC_SECONDS', 1),
+                config.get('SEGMENT_STORAGE_COMPACT_SECONDS', 300),
+                config.STORAGE_EXPIRATION_SECONDS or 0,
+            )
+        self.store = segment_store
+
+    @property
+    def max_age(self):
+        return self.context.config.STORAGE_EXPIRATION_SECONDS or 0
+
+    def digest(self, path, suffix=''):
+        # Crypto keys and detector results get their own keys, named like
+        # thumbor's file_storage names their files
+        return hashlib.sha1(f'{path}{suffix}'.encode('utf-8')).digest()
+
+    def record(self, event):
+        SEGMENT_STORAGE_STATS[event] += 1
+        if self.context.metrics:
+            self.context.metrics.incr(f'segment_storage.{event}')
+
+    def read(self, digest):
+        event, data = self.store.shard(digest).get(digest, self.max_age)
+        self.record(event)
+        return data
+
+    async def write(self, digest, data):
+        # Off the IOLoop: the shard lock is held for a whole batch of moves
+        # while another process compacts the shard
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.store.put, digest, data)
+        except OSError as e:
+            logger.warning('[SEGMENT_STORAGE] put failed: %s', e)
+
+    async def put(self, path, file_bytes):
+        await self.write(self.digest(path), file_bytes)
+        return path
+
+    async def put_crypto(self, path):
+        if not self.context.config.STORES_CRYPTO_KEY_FOR_EACH_IMAGE:
+            return None
+        security_key = self.context.server.security_key
+        if not security_key:
+            raise RuntimeError(
+                "STORES_CRYPTO_KEY_FOR_EACH_IMAGE can't be True if no SECURITY_KEY specified"
+            )
+        if isinstance(security_key, str):
+            security_key = security_key.encode('utf-8')
+        await self.write(self.digest(path, '.txt'), security_key)
+        return path
+
+    async def put_detector_data(self, path, data):
+        await self.write(self.digest(path, '.detectors.txt'), json.dumps(data).encode('utf-8'))
+        return path
+
+    async def get(self, path):
+        return self.read(self.digest(path))
+
+    async def get_crypto(self, path):
+        data = self.read(self.digest(path, '.txt'))
+        return data.decode('utf-8') if data is not None else None
+
+    async def get_detector_data(self, path):
+        data = self.read(self.digest(path, '.detectors.txt'))
+        return json.loads(data) if data is not None else None
+
+    async def exists(self, path):
+        digest = self.digest(path)
+        return self.store.shard(digest).locate(digest, self.max_age)[0] == 'hit'
+
+    async def remove(self, path):
+        digest = self.digest(path)
+        await asyncio.get_running_loop().run_in_executor(None, self.store.shard(digest).remove, digest)